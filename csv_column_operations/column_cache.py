@@ -0,0 +1,106 @@
+import json
+import os
+import shutil
+import pandas as pd
+from model_io import read_model, write_model
+
+# Name of the layout file of the sidecar directory
+LAYOUT = 'columns.json'
+
+STALE_ERROR = 'The columns saved beside the model are older than the model file; discard them before saving.'
+
+# Size and modification time of a file, to tell whether the sidecar of a model was saved against it
+def file_signature(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+# Saved columns of a model, in a sidecar directory next to it (model.csv.columns): the columns changed since the
+# model file was written are kept there, one Feather file each, and the others are read from the model file.
+# columns.json holds the order of the columns, the file of each saved one, and the signature of the model file they
+# were saved against. Saving only writes the columns changed since the last save; the model file itself is only
+# written again on export. Columns saved against an older model file are stale: they are not read, nor removed until
+# discard is called
+class ColumnCache:
+    def __init__(self, path):
+        self.path = path
+        self.directory = f'{path}.columns'
+        # column -> its Feather file in the directory, or None for a column of the model file
+        self.files = {}
+        self.next_file = 0
+        self.dirty = set()
+        self.stale = False
+        self.load_layout()
+
+    def load_layout(self):
+        try:
+            with open(os.path.join(self.directory, LAYOUT), 'r') as file:
+                layout = json.load(file)
+        except (OSError, ValueError):
+            return
+        # a model file written since the last save makes the saved columns stale
+        if layout.get('signature') == file_signature(self.path):
+            self.files = dict(layout['columns'])
+            self.next_file = layout['next_file']
+        else:
+            self.stale = True
+
+    # Whether columns are saved beside the model file, other than the stale ones
+    def saved(self):
+        return any(file is not None for file in self.files.values())
+
+    # Remove the sidecar directory with the columns saved in it
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.files = {}
+        self.next_file = 0
+        self.stale = False
+
+    # The model as last saved: the model file with the saved columns in place of its own
+    def read(self):
+        if not self.files:
+            df = read_model(self.path)
+            self.files = dict.fromkeys(df.columns)
+            return df
+        model_columns = [column for column, file in self.files.items() if file is None]
+        df = read_model(self.path, columns=model_columns) if model_columns else pd.DataFrame()
+        for column, file in self.files.items():
+            if file is not None:
+                df[column] = pd.read_feather(os.path.join(self.directory, file))[column]
+        return df[list(self.files)]
+
+    def changed(self, *columns):
+        self.dirty.update(columns)
+
+    # Write the columns changed since the last save, and the new layout, then drop the files of removed columns
+    def save(self, df):
+        if self.stale:
+            raise ValueError(STALE_ERROR)
+        os.makedirs(self.directory, exist_ok=True)
+        files = {}
+        for column in df.columns:
+            if column in self.dirty or column not in self.files:
+                files[column] = f'{self.next_file}.feather'
+                self.next_file += 1
+                df[[column]].reset_index(drop=True).to_feather(os.path.join(self.directory, files[column]))
+            else:
+                files[column] = self.files[column]
+        layout = {'signature': file_signature(self.path), 'next_file': self.next_file,
+                  'columns': list(files.items())}
+        # written beside and renamed, so an interrupted save leaves the previous layout
+        partial = os.path.join(self.directory, f'{LAYOUT}.partial')
+        with open(partial, 'w') as file:
+            json.dump(layout, file)
+        os.replace(partial, os.path.join(self.directory, LAYOUT))
+
+        kept = set(files.values())
+        for file in set(self.files.values()) - kept - {None}:
+            os.remove(os.path.join(self.directory, file))
+        self.files = files
+        self.dirty.clear()
+
+    # Write the whole model to its file; its columns are then all read from it, so the sidecar is removed
+    def export(self, df):
+        write_model(df, self.path)
+        self.discard()
+        self.files = dict.fromkeys(df.columns)
+        self.dirty.clear()
@@ -0,0 +1,124 @@
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# CSV files are read with the Arrow CSV reader, which parses blocks of the file in parallel, and written with
+# values formatted by Arrow compute kernels, batches of rows in parallel. Synced copy: the same module is in every
+# tool, byte for byte, so a change to one copy goes to all of them. pandas is only needed to read into DataFrames.
+
+# Bytes of a CSV file parsed at a time by each thread
+BLOCK_SIZE = 1 << 24
+
+# Rows formatted at a time by each thread when writing
+WRITE_BATCH_ROWS = 1 << 17
+
+# The error pandas gives for a file Arrow could not read, or a plain ValueError where pandas is not installed
+def read_error(path, error):
+    message = f'{path} is empty.' if str(error).startswith('Empty CSV file') else f'{path}: {error}'
+    try:
+        import pandas as pd
+    except ImportError:
+        return ValueError(message)
+    if str(error).startswith('Empty CSV file'):
+        return pd.errors.EmptyDataError(message)
+    return pd.errors.ParserError(message)
+
+# Read a CSV file, or only the given columns of it, into an Arrow table
+def read_table(path, columns=None):
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+    # the errors are the ones pandas gives for the same files
+    try:
+        table = pyarrow.csv.read_csv(
+            path,
+            read_options=pyarrow.csv.ReadOptions(use_threads=True, block_size=BLOCK_SIZE),
+            convert_options=pyarrow.csv.ConvertOptions(include_columns=columns, timestamp_parsers=[],
+                                                       strings_can_be_null=True),
+        )
+    except pyarrow.ArrowKeyError as e:
+        raise ValueError(f'{path}: {e}') from None
+    except pyarrow.ArrowInvalid as e:
+        raise read_error(path, e) from None
+    # dates are still recognized, and given back as the text they were read from
+    for index, field in enumerate(table.schema):
+        if pyarrow.types.is_date(field.type) or pyarrow.types.is_timestamp(field.type):
+            table = table.set_column(index, field.name, pyarrow.compute.cast(table.column(index), pyarrow.string()))
+    return table
+
+# Read a CSV file into a DataFrame; missing values and types are the ones pandas gives
+def read_frame(path, columns=None):
+    df = read_table(path, columns).to_pandas()
+    # Arrow gives missing text as None, pandas as NaN
+    for column in df.columns[df.dtypes == object]:
+        df[column] = df[column].fillna(np.nan)
+    return df
+
+# Read a numeric CSV file: its column names and its values as a (rows, columns) float64 array, missing values NaN
+def read_numeric(path, columns=None):
+    import pyarrow
+    import pyarrow.compute
+    table = read_table(path, columns)
+    values = np.empty((table.num_rows, table.num_columns))
+    for index, column in enumerate(table.columns):
+        try:
+            values[:, index] = pyarrow.compute.cast(column, pyarrow.float64()).to_numpy()
+        except pyarrow.ArrowInvalid:
+            raise ValueError(f'Column {table.column_names[index]} of {path} is not numeric.') from None
+    return table.column_names, values
+
+# Text of the values of a numeric or boolean array, as pandas writes them: floats as their shortest repr, booleans
+# as True and False, and missing values empty
+def format_values(values):
+    import pyarrow
+    import pyarrow.compute
+    if values.dtype.kind == 'b':
+        return pyarrow.compute.if_else(pyarrow.array(values), 'True', 'False')
+    text = pyarrow.compute.cast(pyarrow.array(values, from_pandas=True), pyarrow.string())
+    if values.dtype.kind == 'f':
+        # the Arrow formatting writes whole floats as integers, which would be read back as integers
+        whole = pyarrow.compute.match_substring_regex(text, r'^-?\d+$')
+        text = pyarrow.compute.if_else(whole, pyarrow.compute.binary_join_element_wise(text, '.0', ''), text)
+        # and switches to an exponent at other magnitudes than repr (1.5e+10 for 15000000000.0, 0.000015 for
+        # 1.5e-05, e-9 for e-09); those values, rare in models, are formatted one at a time as numpy does
+        other = pyarrow.compute.or_(pyarrow.compute.match_substring(text, 'e'),
+                                    pyarrow.compute.match_substring_regex(text, r'^-?0\.000'))
+        other = pyarrow.compute.fill_null(other, False)
+        indices = np.flatnonzero(other.to_numpy(zero_copy_only=False))
+        if len(indices):
+            text = pyarrow.compute.replace_with_mask(text, other, [str(value) for value in values[indices]])
+    return text
+
+def format_batch(arrays, start, end):
+    import pyarrow
+    import pyarrow.csv
+    table = pyarrow.table({str(index): format_values(values[start:end]) for index, values in enumerate(arrays)})
+    output = io.BytesIO()
+    # numbers never need quotes
+    pyarrow.csv.write_csv(table, output, pyarrow.csv.WriteOptions(include_header=False, quoting_style='none'))
+    return output.getvalue()
+
+# Write columns, given by name as numeric or boolean arrays, to a CSV file
+def write_columns(path, names, arrays, threads=None):
+    arrays = [np.asarray(values) for values in arrays]
+    rows = len(arrays[0]) if arrays else 0
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow([str(name) for name in names])
+    threads = threads or os.cpu_count()
+    with open(path, 'wb') as file, ThreadPoolExecutor(max_workers=threads) as executor:
+        file.write(header.getvalue().encode())
+        # the batches are formatted in parallel and written in order, with a few formatted ahead at most
+        pending = deque()
+        for start in range(0, rows, WRITE_BATCH_ROWS):
+            pending.append(executor.submit(format_batch, arrays, start, start + WRITE_BATCH_ROWS))
+            if len(pending) > 2 * threads:
+                file.write(pending.popleft().result())
+        while pending:
+            file.write(pending.popleft().result())
+
+# Write a (rows, columns) array to a CSV file under the given column names
+def write_numeric(path, names, values, threads=None):
+    write_columns(path, names, [values[:, index] for index in range(values.shape[1])], threads)
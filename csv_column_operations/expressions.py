@@ -0,0 +1,281 @@
+import ast
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+# Rows evaluated at a time: the temporaries of a block fit in the CPU cache, and blocks are evaluated in parallel,
+# NumPy releasing the GIL in its loops
+BLOCK_ROWS = 16_384
+
+# Functions allowed in expressions, also as np.<name>; if(condition, a, b) is where
+FUNCTIONS = {
+    'where': np.where,
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'floor': np.floor,
+    'ceil': np.ceil,
+    'round': np.round,
+    'minimum': np.minimum,
+    'maximum': np.maximum,
+    'clip': np.clip,
+    'isnan': np.isnan,
+    'logical_and': np.logical_and,
+    'logical_or': np.logical_or,
+    'logical_not': np.logical_not,
+}
+
+# Group-wise functions, group_<name>(values, key, ...): the pandas groupby transform of the values within the groups
+# of rows with the same keys, broadcast back to the rows (missing for rows with a missing key); without keys the
+# whole column is one group, e.g. col['au'] / group_mean(col['au'], col['rock'])
+GROUP_FUNCTIONS = ['mean', 'sum', 'min', 'max', 'std', 'median', 'count', 'rank', 'cumsum']
+
+def group_transform(how):
+    def transform(values, *keys):
+        keys = [np.asarray(key) for key in keys]
+        values = np.asarray(values)
+        # a constant, as in group_count(1, col['rock'])
+        if values.ndim == 0 and keys:
+            values = np.full(len(keys[0]), values)
+        values = pd.Series(values)
+        keys = keys or [np.zeros(len(values), dtype=np.int8)]
+        return values.groupby(keys, sort=False).transform(how).to_numpy()
+    return transform
+
+# Names usable as constants
+CONSTANTS = {'nan': np.nan, 'inf': np.inf, 'pi': np.pi}
+
+BINARY_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow, ast.BitAnd, ast.BitOr,
+                    ast.BitXor)
+UNARY_OPERATORS = (ast.UAdd, ast.USub, ast.Invert)
+COMPARISONS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+# Globals of the compiled expressions: the functions and constants, under an underscore. The only builtin is
+# __import__, which NumPy calls to raise its type errors and no expression can name
+NAMESPACE = {'__builtins__': {'__import__': __import__},
+             **{f'_{name}': function for name, function in FUNCTIONS.items()},
+             **{f'_group_{how}': group_transform(how) for how in GROUP_FUNCTIONS},
+             **{f'_{name}': value for name, value in CONSTANTS.items()}}
+
+# Errors of valid expressions on the values they are given, e.g. adding a number to a text column
+EVALUATION_ERRORS = (ArithmeticError, LookupError, TypeError, ValueError)
+
+# An if( where a call can be: at the start, or after an operator, a bracket, a comma or a keyword, but not the if of
+# a if (condition) else b
+CALL_IF = re.compile(r'(^|[-+*/%&|^~<>=!(\[,]|\b(?:and|or|not|else|in))(\s*)if\s*\(')
+
+# Rewrite the conditional if(condition, a, b) of the expressions, a Python keyword, to where(condition, a, b)
+def fix_expression(expression):
+    # a call in the arguments of another is only found once the outer one is rewritten
+    fixed = CALL_IF.sub(r'\1\2where(', expression)
+    while fixed != expression:
+        expression, fixed = fixed, CALL_IF.sub(r'\1\2where(', fixed)
+    return fixed
+
+def function_call(name, args, node):
+    return ast.copy_location(ast.Call(ast.Name(f'_{name}', ast.Load()), args, []), node)
+
+# Checks an expression tree against the allowed syntax and rewrites it for evaluation: columns, col['name'],
+# become variables, functions and constants come from the evaluation namespace and the Python boolean operators
+# act element-wise. variables maps what each column reference stands for to its variable
+class ExpressionCompiler(ast.NodeTransformer):
+    def __init__(self, columns):
+        self.columns = columns
+        self.variables = {}
+
+    # What a column reference stands for, the column itself here
+    def reference(self, name):
+        if name not in self.columns:
+            raise ValueError(f'Unknown column: {name}')
+        return name
+
+    def generic_visit(self, node):
+        raise ValueError(f'Not allowed in an expression: {ast.unparse(node) if isinstance(node, ast.expr) else node}')
+
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, str)):
+            self.generic_visit(node)
+        return node
+
+    def visit_Name(self, node):
+        if node.id not in CONSTANTS:
+            raise ValueError(f"Unknown name: {node.id}, columns are written as col['{node.id}']")
+        return ast.copy_location(ast.Name(f'_{node.id}', ast.Load()), node)
+
+    def visit_Subscript(self, node):
+        key = node.slice
+        if not (isinstance(node.value, ast.Name) and node.value.id == 'col'
+                and isinstance(key, ast.Constant) and isinstance(key.value, str)):
+            raise ValueError(f"Only columns can be indexed, as col['name']: {ast.unparse(node)}")
+        variable = self.variables.setdefault(self.reference(key.value), f'column{len(self.variables)}')
+        return ast.copy_location(ast.Name(variable, ast.Load()), node)
+
+    def visit_Call(self, node):
+        function = node.func
+        if isinstance(function, ast.Attribute) and isinstance(function.value, ast.Name) and function.value.id == 'np':
+            name = function.attr
+        elif isinstance(function, ast.Name):
+            name = function.id
+        else:
+            name = None
+        grouped = isinstance(function, ast.Name) and name.startswith('group_') and name[6:] in GROUP_FUNCTIONS
+        if not (name in FUNCTIONS or grouped) or node.keywords:
+            raise ValueError(f'Unknown function: {ast.unparse(function)}')
+        if grouped and not node.args:
+            raise ValueError(f'{name} needs the values to transform, e.g. {name}(col[\'au\'], col[\'rock\'])')
+        return function_call(name, [self.visit(arg) for arg in node.args], node)
+
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, BINARY_OPERATORS):
+            self.generic_visit(node)
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+
+    def visit_UnaryOp(self, node):
+        if isinstance(node.op, ast.Not):
+            return function_call('logical_not', [self.visit(node.operand)], node)
+        if not isinstance(node.op, UNARY_OPERATORS):
+            self.generic_visit(node)
+        node.operand = self.visit(node.operand)
+        return node
+
+    def visit_BoolOp(self, node):
+        name = 'logical_and' if isinstance(node.op, ast.And) else 'logical_or'
+        values = [self.visit(value) for value in node.values]
+        result = values[0]
+        for value in values[1:]:
+            result = function_call(name, [result, value], node)
+        return result
+
+    # a < b < c is (a < b) and (b < c), element-wise
+    def visit_Compare(self, node):
+        if not all(isinstance(op, COMPARISONS) for op in node.ops):
+            self.generic_visit(node)
+        operands = [self.visit(node.left)] + [self.visit(comparator) for comparator in node.comparators]
+        comparisons = [ast.copy_location(ast.Compare(left, [op], [right]), node)
+                       for left, op, right in zip(operands, node.ops, operands[1:])]
+        result = comparisons[0]
+        for comparison in comparisons[1:]:
+            result = function_call('logical_and', [result, comparison], node)
+        return result
+
+    # a if condition else b
+    def visit_IfExp(self, node):
+        return function_call('where', [self.visit(node.test), self.visit(node.body), self.visit(node.orelse)], node)
+
+# Parse an expression, with if(condition, a, b) allowed, into the body of its tree
+def parse_expression(text):
+    try:
+        return ast.parse(fix_expression(text).strip(), mode='eval').body
+    except SyntaxError as e:
+        raise ValueError(f'Invalid expression: {e.msg}') from None
+
+# Whether a compiled tree calls a group function, which needs the whole column at once
+def is_grouped(body):
+    return any(isinstance(node, ast.Name) and node.id.startswith('_group_') for node in ast.walk(body))
+
+def compile_tree(body):
+    return compile(ast.fix_missing_locations(ast.Expression(body)), '<expression>', 'eval')
+
+def evaluate_block(code, arrays, start, end):
+    result = np.asarray(eval(code, NAMESPACE, {variable: values[start:end] for variable, values in arrays.items()}))
+    return np.full(end - start, result) if result.ndim == 0 else result
+
+# Values of compiled code over arrays of rows rows, given by variable, evaluated in blocks of block_rows rows by
+# threads threads; the errors of the evaluation are ValueErrors naming the text of the code
+def evaluate_code(code, arrays, rows, threads=None, block_rows=BLOCK_ROWS, text=None):
+    try:
+        return evaluate_rows(code, arrays, rows, threads, block_rows)
+    except EVALUATION_ERRORS as e:
+        raise ValueError(f'Cannot evaluate {text}: {e}') from None
+
+def evaluate_rows(code, arrays, rows, threads, block_rows):
+    first = evaluate_block(code, arrays, 0, min(block_rows, rows))
+    if rows <= block_rows:
+        return first
+    result = np.empty(rows, dtype=first.dtype)
+    result[:len(first)] = first
+
+    def evaluate_rest(start):
+        end = min(start + block_rows, rows)
+        result[start:end] = evaluate_block(code, arrays, start, end)
+
+    starts = range(block_rows, rows, block_rows)
+    if threads == 1:
+        for start in starts:
+            evaluate_rest(start)
+        return result
+    with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+        # consuming the results raises the errors of the blocks
+        list(executor.map(evaluate_rest, starts))
+    return result
+
+# A column expression, parsed, checked and compiled once, evaluated on NumPy arrays of the columns. An expression
+# with group functions is evaluated on whole columns, the others in blocks of rows
+class Expression:
+    def __init__(self, text, columns):
+        compiler = ExpressionCompiler(set(columns))
+        tree = compiler.visit(parse_expression(text))
+        self.text = text
+        self.grouped = is_grouped(tree)
+        self.code = compile_tree(tree)
+        self.columns = list(compiler.variables)
+        self.variables = compiler.variables
+
+    # Values of the expression for the rows of df, or only the rows where mask is set
+    def evaluate(self, df, threads=None, block_rows=BLOCK_ROWS, mask=None):
+        arrays = {variable: df[column].to_numpy() for column, variable in self.variables.items()}
+        rows = len(df)
+        if mask is not None:
+            arrays = {variable: values[mask] for variable, values in arrays.items()}
+            rows = int(np.count_nonzero(mask))
+        if self.grouped:
+            block_rows = max(rows, 1)
+        return evaluate_code(self.code, arrays, rows, threads, block_rows, self.text)
+
+# Values of a column given by expression on the rows of df where the condition where holds, both Expressions. The
+# group functions only see those rows. The other rows keep the values of the column name if df has it, or are
+# missing
+def evaluate_where(df, expression, where, name, threads=None):
+    mask = where.evaluate(df, threads)
+    if mask.dtype != bool:
+        raise ValueError(f"The filter must be a condition, e.g. col['DESTINO'] == 2: {where.text}")
+    values = expression.evaluate(df, threads, mask=mask)
+    if name in df.columns:
+        result = df[name].to_numpy()
+        result = result.astype(np.result_type(result, values))
+    elif values.dtype.kind in 'fc':
+        result = np.full(len(df), np.nan, dtype=values.dtype)
+    elif values.dtype.kind in 'iub':
+        result = np.full(len(df), np.nan)
+    else:
+        result = np.full(len(df), None, dtype=object)
+    result[mask] = values
+    return result
+
+# Compiled expressions are kept, so the same one is not parsed again
+@lru_cache(maxsize=128)
+def compile_expression(text, columns):
+    return Expression(text, columns)
+
+def evaluate(df, expression, threads=None):
+    return compile_expression(expression, tuple(df.columns)).evaluate(df, threads)
+
+# Values of a new column name, given by expression, only on the rows where the condition where holds
+def evaluate_filtered(df, expression, where, name, threads=None):
+    columns = tuple(df.columns)
+    return evaluate_where(df, compile_expression(expression, columns), compile_expression(where, columns), name,
+                          threads)
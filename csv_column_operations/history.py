@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+from lazy import ColumnPlan
+
+# Versions kept for undo
+UNDO_LIMIT = 50
+
+# Make an array read-only, with the arrays it is a view of, so that writing over its values raises instead
+def freeze(values):
+    while isinstance(values, np.ndarray):
+        values.flags.writeable = False
+        values = values.base
+
+# Version of the columns of a model. For a DataFrame it is its columns, as Series sharing their values with it: the
+# windows only add, replace and remove whole columns, which pandas does without writing over the values of the
+# others, so a version costs only the memory of the columns replaced since. The shared values are frozen, so that
+# a change in place raises rather than changing the versions too; extension arrays other than categoricals, which
+# are not frozen, are copied. For a lazy ColumnPlan it is its operations
+def model_version(df):
+    if isinstance(df, ColumnPlan):
+        return list(df.operations), list(df.columns)
+    version = {}
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.array, pd.Categorical):
+            freeze(series.array.codes)
+        elif isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            series = series.copy()
+        else:
+            freeze(series.to_numpy())
+        version[column] = series
+    return version
+
+# The model at a version; a DataFrame is built again on the values of the version, without copying them
+def restore_version(df, version):
+    if isinstance(df, ColumnPlan):
+        df.operations, df.columns = list(version[0]), list(version[1])
+        return df
+    if not version:
+        return pd.DataFrame(index=df.index)
+    return pd.DataFrame(version, copy=False)
+
+# Where the values of a column are, the same for columns sharing their values, or None when unknown
+def values_address(series):
+    values = series.array
+    if isinstance(values, pd.Categorical):
+        values = values.codes
+    elif isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+        return None
+    else:
+        values = series.to_numpy()
+    return values.__array_interface__['data'][0], values.strides, values.shape
+
+# Columns differing between two versions of a model
+def changed_columns(before, after):
+    if isinstance(before, tuple):
+        operations_before, operations_after = before[0], after[0]
+        common = 0
+        while (common < min(len(operations_before), len(operations_after))
+               and operations_before[common] is operations_after[common]):
+            common += 1
+        columns = set(before[1]) ^ set(after[1])
+        for operation, argument in operations_before[common:] + operations_after[common:]:
+            if operation == 'add':
+                columns.add(argument[0])
+            elif operation == 'script':
+                columns.update(argument.names)
+        return sorted(columns)
+    columns = set(before) ^ set(after)
+    for column in set(before) & set(after):
+        address = values_address(before[column])
+        if address is None or address != values_address(after[column]):
+            columns.add(column)
+    return sorted(columns)
+
+# Undo and redo of the column operations, as versions of the model before (undo) and after (redo) each of them
+class ColumnHistory:
+    def __init__(self, limit=UNDO_LIMIT):
+        self.limit = limit
+        self.undo_versions = []
+        self.redo_versions = []
+
+    # Record the version of the model before an operation
+    def record(self, version):
+        self.undo_versions.append(version)
+        del self.undo_versions[:-self.limit]
+        self.redo_versions.clear()
+
+    # Forget every version, e.g. once a lazy ColumnPlan is saved: its versions are operations on the file before it
+    def clear(self):
+        self.undo_versions.clear()
+        self.redo_versions.clear()
+
+    def can_undo(self):
+        return bool(self.undo_versions)
+
+    def can_redo(self):
+        return bool(self.redo_versions)
+
+    # The model before the last operation, and the columns it changed
+    def undo(self, df):
+        return self.move(df, self.undo_versions, self.redo_versions)
+
+    def redo(self, df):
+        return self.move(df, self.redo_versions, self.undo_versions)
+
+    @staticmethod
+    def move(df, versions, other_versions):
+        current = model_version(df)
+        version = versions.pop()
+        other_versions.append(current)
+        return restore_version(df, version), changed_columns(current, version)
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import pandas as pd
+from expressions import Expression, evaluate_where
+from model_io import ModelWriter, iter_model, model_columns
+from scripts import Script
+
+# Rows read, operated on and written at a time
+CHUNK_ROWS = 250_000
+
+GROUPED_ERROR = 'The group functions need the whole columns and are not available in the lazy mode.'
+
+# The column operations on a model file, recorded instead of applied: they are applied chunk by chunk as the
+# model is streamed to its output, so the memory used depends on the chunk size and not on the model size.
+# Operations are ('add', (name, Expression, where Expression or None)), ('script', Script) and ('remove', column).
+# The group functions need whole columns, so they are not available
+class ColumnPlan:
+    def __init__(self, path, chunksize=CHUNK_ROWS):
+        self.path = path
+        self.chunksize = chunksize
+        self.input_columns = model_columns(path)
+        self.columns = list(self.input_columns)
+        self.operations = []
+        # the last column read, as (name, operations applied, values); undo may replace the operations
+        self.cached = None
+
+    def add_column(self, name):
+        if name not in self.columns:
+            self.columns.append(name)
+
+    # Record a new column, only on the rows where the condition where holds if given; the expressions are checked
+    # against the columns at this point of the plan
+    def add_expression(self, name, expression, where=None):
+        expression = Expression(expression, tuple(self.columns))
+        where = Expression(where, tuple(self.columns)) if where else None
+        if expression.grouped or (where is not None and where.grouped):
+            raise ValueError(GROUPED_ERROR)
+        self.operations.append(('add', (name, expression, where)))
+        self.add_column(name)
+
+    def add_script(self, text):
+        script = Script(text, tuple(self.columns))
+        if script.grouped:
+            raise ValueError(GROUPED_ERROR)
+        self.operations.append(('script', script))
+        for name in script.names:
+            self.add_column(name)
+        return script.names
+
+    def remove(self, column):
+        if column not in self.columns:
+            raise ValueError(f'Unknown column: {column}')
+        self.operations.append(('remove', column))
+        self.columns.remove(column)
+
+    # The input columns to read and the operations to apply for the given columns, skipping the ones that add
+    # columns not needed for them
+    def prune(self, columns):
+        needed = set(columns)
+        operations = []
+        for operation, argument in reversed(self.operations):
+            if operation == 'add':
+                name, expression, where = argument
+                if name not in needed:
+                    continue
+                needed.discard(name)
+                needed.update(expression.columns)
+                if where is not None:
+                    # the rows not matching keep the values of the column, if it is there before
+                    needed.add(name)
+                    needed.update(where.columns)
+            elif operation == 'script':
+                if not needed.intersection(argument.names):
+                    continue
+                needed.difference_update(argument.names)
+                needed.update(argument.inputs.values())
+            operations.append((operation, argument))
+        return [column for column in self.input_columns if column in needed], operations[::-1]
+
+    @staticmethod
+    def apply(df, operations):
+        for operation, argument in operations:
+            if operation == 'add':
+                name, expression, where = argument
+                if where is None:
+                    df[name] = expression.evaluate(df)
+                else:
+                    df[name] = evaluate_where(df, expression, where, name)
+            elif operation == 'script':
+                argument.run(df)
+            else:
+                # a column not read because nothing needs it
+                df = df.drop(columns=argument, errors='ignore')
+        return df
+
+    # Chunks of the model with the operations applied, with the given columns; the chunks are read as they are
+    # consumed, but with the operations recorded at the time of the call
+    def iter_chunks(self, columns=None):
+        columns = self.columns if columns is None else columns
+        input_columns, operations = self.prune(columns)
+        return (self.apply(chunk, operations)[columns]
+                for chunk in iter_model(self.path, input_columns, self.chunksize))
+
+    # Values of a column, streamed through the operations it depends on
+    def __getitem__(self, column):
+        if column not in self.columns:
+            raise KeyError(column)
+        if self.cached is None or self.cached[:2] != (column, tuple(self.operations)):
+            values = pd.concat([chunk[column] for chunk in self.iter_chunks([column])], ignore_index=True)
+            self.cached = (column, tuple(self.operations), values)
+        return self.cached[2]
+
+    # Stream the model with the operations applied to path, which may be the input file: it is then written to a
+    # temporary file next to it and replaced at the end. The saved model is the input of the next operations
+    def save(self, path):
+        directory, name = os.path.split(os.path.abspath(path))
+        descriptor, partial = tempfile.mkstemp(prefix=f'.{name}.', suffix=os.path.splitext(name)[1],
+                                               dir=directory)
+        os.close(descriptor)
+        try:
+            with ModelWriter(partial) as writer:
+                for chunk in self.iter_chunks():
+                    writer.write(chunk)
+            os.replace(partial, path)
+        except BaseException:
+            os.remove(partial)
+            raise
+        self.path = path
+        self.input_columns = list(self.columns)
+        self.operations = []
+        self.cached = None
@@ -1,4 +1,3 @@
-from io import StringIO
 import pandas as pd
 import sys
 from PySide6.QtWidgets import (
@@ -11,20 +10,28 @@ from PySide6.QtWidgets import (
     QFileDialog,
     QComboBox,
     QMessageBox,
-    QTextBrowser
+    QTextBrowser,
+    QPlainTextEdit,
+    QCheckBox
 )
-
-# Function to perform operations between columns based on the user-provided expression
-def perform_operations(col, expression, new_column_name):
-    import numpy as np
-    # Evaluate the expression using the eval function
-    col[new_column_name] = eval(expression, locals())
-
-# Function to fix the conditional expression
-def fix_expression(expression):
-    # Replace 'if(' with 'np.where('
-    expression = expression.replace("if(", "np.where(")
-    return expression
+from expressions import evaluate, evaluate_filtered
+from column_cache import ColumnCache
+from history import ColumnHistory, model_version
+from lazy import ColumnPlan
+from profiler import ColumnProfiler, format_profile
+from scripts import run_script
+from model_io import FILE_FILTER
+
+# Function to perform operations between columns based on the user-provided expression; it is checked against
+# the allowed columns, operators and functions and evaluated in parallel blocks of rows, or, in the lazy mode,
+# recorded to be applied when saving. With a where condition, only the rows where it holds get new values
+def perform_operations(col, expression, new_column_name, where=None):
+    if isinstance(col, ColumnPlan):
+        col.add_expression(new_column_name, expression, where)
+    elif where:
+        col[new_column_name] = evaluate_filtered(col, expression, where, new_column_name)
+    else:
+        col[new_column_name] = evaluate(col, expression)
 
 class InitialWindow(QWidget):
     def __init__(self):
@@ -32,15 +39,20 @@ class InitialWindow(QWidget):
 
         self.df = pd.DataFrame()
         self.file = None
+        self.cache = None
 
         self.setWindowTitle('File Selection')
 
         layout = QVBoxLayout()
 
-        label = QLabel('Select the CSV model file:')
+        label = QLabel('Select the model file (CSV, Parquet or Feather):')
         layout.addWidget(label)
 
-        file_select_button = QPushButton('Select File CSV')
+        self.lazy = QCheckBox('Lazy mode: apply the operations chunk by chunk when saving, for files larger '
+                              'than memory')
+        layout.addWidget(self.lazy)
+
+        file_select_button = QPushButton('Select File')
         file_select_button.clicked.connect(self.abrir_dialogo_arquivo)
         layout.addWidget(file_select_button)
 
@@ -51,31 +63,58 @@ class InitialWindow(QWidget):
         options |= QFileDialog.ReadOnly
         file_dialog = QFileDialog(self)
         file_dialog.setFileMode(QFileDialog.ExistingFile)
-        file_dialog.setNameFilter('CSV (*.csv)')
+        file_dialog.setNameFilter(FILE_FILTER)
 
         if file_dialog.exec():
             arquivo_selecionado = file_dialog.selectedFiles()
             if arquivo_selecionado:
                 try:
                     self.file = arquivo_selecionado[0]
-                    self.df = pd.read_csv(self.file)
+                    cache = ColumnCache(self.file)
+                    if cache.stale and not self.discard_stale_columns(cache):
+                        return
+                    if self.lazy.isChecked():
+                        # the lazy mode streams the model file alone, and saving rewrites it under the saved columns
+                        if cache.saved():
+                            QMessageBox.warning(self, 'Warning', 'The model has columns saved beside it. Open it '
+                                                'without the lazy mode and export it first.', QMessageBox.Ok)
+                            return
+                        self.df = ColumnPlan(self.file)
+                    else:
+                        # the model as last saved, with the columns saved beside it
+                        self.cache = cache
+                        self.df = self.cache.read()
                     self.open_main_window()
                 except pd.errors.EmptyDataError:
                     print('The file is empty.')
                 except pd.errors.ParserError:
                     print('The file could not be parsed.')
 
+    # The columns saved beside the model were saved against an older model file; they are only removed if the user
+    # agrees, otherwise the model is not opened
+    def discard_stale_columns(self, cache):
+        answer = QMessageBox.question(self, 'Warning', f'The columns saved in {cache.directory} are older than the '
+                                      'model file, which was written since. Discard them?',
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if answer != QMessageBox.Yes:
+            return False
+        cache.discard()
+        return True
+
     def open_main_window(self):
-        self.main_window = MainWindow(self.file, self.df)
+        self.main_window = MainWindow(self.file, self.df, self.cache)
         self.main_window.show()
         self.hide()
 
 class MainWindow(QWidget):
-    def __init__(self, file, df):
+    def __init__(self, file, df, cache=None):
         super().__init__()
 
         self.file = file
         self.df = df
+        self.cache = cache
+        self.profiler = ColumnProfiler(df)
+        self.history = ColumnHistory()
 
         self.setWindowTitle('Main')
 
@@ -97,6 +136,18 @@ class MainWindow(QWidget):
         save_button.clicked.connect(self.save_columns)
         layout.addWidget(save_button)
 
+        export_button = QPushButton('Export Model')
+        export_button.clicked.connect(self.export_model)
+        layout.addWidget(export_button)
+
+        undo_button = QPushButton('Undo')
+        undo_button.clicked.connect(self.undo)
+        layout.addWidget(undo_button)
+
+        redo_button = QPushButton('Redo')
+        redo_button.clicked.connect(self.redo)
+        layout.addWidget(redo_button)
+
         self.setLayout(layout)
 
     def show_add_window(self):
@@ -110,14 +161,68 @@ class MainWindow(QWidget):
         self.hide()
 
     def show_info_window(self):
+        self.profiler.prefetch()
         self.info_window = InfoWindow(self, self.df)
         self.info_window.show()
         self.hide()
 
+    # Called by the windows changing columns, with the version of the model before the change: the change can be
+    # undone, the profiles of the columns are outdated and they are saved again
+    def columns_changed(self, before, *columns):
+        self.history.record(before)
+        self.mark_changed(columns)
+
+    def mark_changed(self, columns):
+        self.profiler.changed(*columns)
+        if self.cache is not None:
+            self.cache.changed(*columns)
+
+    # Undo and redo give back the model of another version, sharing the values of its columns with it
+    def undo(self):
+        if not self.history.can_undo():
+            QMessageBox.warning(self, 'Warning', 'Nothing to undo.', QMessageBox.Ok)
+            return
+        self.df, columns = self.history.undo(self.df)
+        self.profiler.df = self.df
+        self.mark_changed(columns)
+        QMessageBox.information(self, 'Warning', 'Operation undone!', QMessageBox.Ok)
+
+    def redo(self):
+        if not self.history.can_redo():
+            QMessageBox.warning(self, 'Warning', 'Nothing to redo.', QMessageBox.Ok)
+            return
+        self.df, columns = self.history.redo(self.df)
+        self.profiler.df = self.df
+        self.mark_changed(columns)
+        QMessageBox.information(self, 'Warning', 'Operation redone!', QMessageBox.Ok)
+
+    # Only the columns changed since the last save are written, beside the model file; the lazy mode streams the
+    # whole model to its file, which its operations before cannot be undone on
     def save_columns(self):
-        self.df.to_csv(self.file, index=False)
+        try:
+            if isinstance(self.df, ColumnPlan):
+                self.df.save(self.file)
+                self.history.clear()
+            else:
+                self.cache.save(self.df)
+        except (ValueError, TypeError) as e:
+            QMessageBox.warning(self, 'Warning', f'{e}', QMessageBox.Ok)
+            return
         QMessageBox.information(self, 'Warning', 'Columns saved!', QMessageBox.Ok)
 
+    # Write the whole model to its file
+    def export_model(self):
+        try:
+            if isinstance(self.df, ColumnPlan):
+                self.df.save(self.file)
+                self.history.clear()
+            else:
+                self.cache.export(self.df)
+        except (ValueError, TypeError) as e:
+            QMessageBox.warning(self, 'Warning', f'{e}', QMessageBox.Ok)
+            return
+        QMessageBox.information(self, 'Warning', 'Model exported!', QMessageBox.Ok)
+
 class AddWindow(QWidget):
     def __init__(self, mw, df):
         super().__init__()
@@ -147,10 +252,33 @@ class AddWindow(QWidget):
         self.expression.setPlaceholderText("if(col['A'] > col['B'], col['A'], col['B'])")
         layout.addWidget(self.expression)
 
+        groups_label = QLabel("Group functions, within the rows of each rock type e.g.: group_mean, group_sum, "
+                              "group_min, group_max, group_std, group_median, group_count, group_rank, "
+                              "group_cumsum(col['A'], col['ROCK'])")
+        groups_label.setWordWrap(True)
+        layout.addWidget(groups_label)
+
+        where_label = QLabel("Only where (optional, other rows keep their values):")
+        layout.addWidget(where_label)
+        self.where = QLineEdit()
+        self.where.setPlaceholderText("col['DESTINO'] == 2")
+        layout.addWidget(self.where)
+
         run_button = QPushButton('OK')
         run_button.clicked.connect(self.add_column)
         layout.addWidget(run_button)
 
+        script_label = QLabel("Or several columns, one 'name = expression' per line:")
+        layout.addWidget(script_label)
+        self.script = QPlainTextEdit()
+        self.script.setPlaceholderText("tonnage = col['volume'] * col['density']\n"
+                                       "metal = col['tonnage'] * col['grade'] / 100")
+        layout.addWidget(self.script)
+
+        run_button = QPushButton('Run Script')
+        run_button.clicked.connect(self.add_columns)
+        layout.addWidget(run_button)
+
         run_button = QPushButton('Return')
         run_button.clicked.connect(self.back)
         layout.addWidget(run_button)
@@ -158,12 +286,33 @@ class AddWindow(QWidget):
         self.setLayout(layout)
 
     def add_column(self):
-        expression = fix_expression(self.expression.text())
+        expression = self.expression.text()
         new_column = self.new_column.text()
-        perform_operations(self.df, expression, new_column)
+        before = model_version(self.df)
+        try:
+            perform_operations(self.df, expression, new_column, self.where.text().strip() or None)
+        except ValueError as e:
+            QMessageBox.warning(self, 'Warning', f'{e}', QMessageBox.Ok)
+            return
+        self.mw.columns_changed(before, new_column)
         QMessageBox.information(self, 'Warning', 'Column added!', QMessageBox.Ok)
         self.back()
 
+    # Add every column of the script; shared terms are computed once and independent columns in parallel
+    def add_columns(self):
+        before = model_version(self.df)
+        try:
+            if isinstance(self.df, ColumnPlan):
+                names = self.df.add_script(self.script.toPlainText())
+            else:
+                names = run_script(self.df, self.script.toPlainText())
+        except ValueError as e:
+            QMessageBox.warning(self, 'Warning', f'{e}', QMessageBox.Ok)
+            return
+        self.mw.columns_changed(before, *names)
+        QMessageBox.information(self, 'Warning', f'{len(names)} columns added!', QMessageBox.Ok)
+        self.back()
+
     def back(self):
         self.hide()
         self.mw.show()
@@ -198,7 +347,13 @@ class RemoveWindow(QWidget):
 
     def remove_column(self):
         column = self.combobox.currentText()
-        self.df.drop(column, axis=1, inplace=True)
+        before = model_version(self.df)
+        if isinstance(self.df, ColumnPlan):
+            self.df.remove(column)
+        else:
+            # del shares the other columns with the version before, which drop would copy
+            del self.df[column]
+        self.mw.columns_changed(before, column)
         QMessageBox.information(self, 'Warning', 'Column removed!', QMessageBox.Ok)
         self.back()
 
@@ -223,6 +378,11 @@ class InfoWindow(QWidget):
             self.combobox.addItem(coluna)
         layout.addWidget(self.combobox)
 
+        self.approximate = QCheckBox('Approximate statistics: stream the column through quantile and distinct count '
+                                     'sketches, for very large columns')
+        self.approximate.setChecked(isinstance(self.df, ColumnPlan))
+        layout.addWidget(self.approximate)
+
         info_label = QLabel("Information:")
         layout.addWidget(info_label)
         self.info_text = QTextBrowser()
@@ -238,47 +398,11 @@ class InfoWindow(QWidget):
 
         self.setLayout(layout)
 
+    # The statistics come from the profiler of the main window, computed in the background for all the columns
     def print_information(self):
         column_name = self.combobox.currentText()
-
-        original_stdout = sys.stdout
-        sys.stdout = StringIO()
-
-        try:
-            # Calculate statistics
-            mean_value = self.df[column_name].mean()
-            median_value = self.df[column_name].median()
-            standard_deviation = self.df[column_name].std()
-            minimum_value = self.df[column_name].min()
-            maximum_value = self.df[column_name].max()
-            quartiles = self.df[column_name].quantile([0.25, 0.5, 0.75])
-            num_observations = self.df[column_name].count()
-            most_frequent_value = self.df[column_name].mode().iloc[0]
-
-            # Print the statistics
-            print(f"Statistics for column '{column_name}':")
-            print(f"Mean: {mean_value}")
-            print(f"Median: {median_value}")
-            print(f"Standard Deviation: {standard_deviation}")
-            print(f"Minimum: {minimum_value}")
-            print(f"Maximum: {maximum_value}")
-            print(f"Quartiles: Q1 = {quartiles[0.25]}, Q2 (Median) = {quartiles[0.5]}, Q3 = {quartiles[0.75]}")
-            print(f"Number of Observations: {num_observations}")
-            print(f"Most Frequent Value (Mode): {most_frequent_value}")
-
-            unique_values = sorted(self.df[column_name].unique())
-            min_diff = float('inf')
-            for i in range(1, len(unique_values)):
-                diff = unique_values[i] - unique_values[i - 1]
-                if diff < min_diff:
-                    min_diff = diff
-            print(f"Min difference: {min_diff}")
-
-        finally:
-            output_content = sys.stdout.getvalue()
-            sys.stdout = original_stdout
-
-        self.info_text.setPlainText(output_content)
+        profile = self.mw.profiler.profile(column_name, self.approximate.isChecked())
+        self.info_text.setPlainText(format_profile(column_name, profile))
 
     def back(self):
         self.hide()
@@ -0,0 +1,184 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from csv_io import read_frame, write_columns
+
+# Block model files are read and written in the format given by their extension. A .npy bundle is a directory
+# holding columns.json with the column names and one .npy file per column, which is loaded memory-mapped.
+FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.npy': 'npy',
+}
+
+# Name filter for the file dialogs
+FILE_FILTER = 'Models (*.csv *.parquet *.pq *.feather *.arrow)'
+
+def model_format(path):
+    extension = os.path.splitext(path.rstrip('/\\'))[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unsupported model format: {path}')
+    return FORMATS[extension]
+
+def is_model(path):
+    return os.path.splitext(path.rstrip('/\\'))[1].lower() in FORMATS
+
+# Column names of a model, without reading its data
+def model_columns(path):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    if file_format == 'feather':
+        import pyarrow
+        import pyarrow.ipc
+        # the schema is in the footer of the file, no batch is read
+        with pyarrow.memory_map(path) as source:
+            return pyarrow.ipc.open_file(source).schema.names
+    with open(os.path.join(path, 'columns.json'), 'r') as file:
+        return json.load(file)
+
+def npy_column(path, index):
+    try:
+        return np.load(os.path.join(path, f'{index}.npy'), mmap_mode='r')
+    except ValueError:
+        # text columns are stored as object arrays, which cannot be memory-mapped
+        return np.load(os.path.join(path, f'{index}.npy'), allow_pickle=True)
+
+def npy_columns(path, columns):
+    names = model_columns(path)
+    columns = names if columns is None else columns
+    return {column: npy_column(path, names.index(column)) for column in columns}
+
+# Read a model, or only the given columns of it
+def read_model(path, columns=None):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        if columns is not None:
+            # in the order of the file, as pandas gives them
+            header = model_columns(path)
+            columns = [column for column in header if column in columns] + \
+                      [column for column in columns if column not in header]
+        return read_frame(path, columns)
+    if file_format == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if file_format == 'feather':
+        return pd.read_feather(path, columns=columns)
+    return pd.DataFrame(npy_columns(path, columns))
+
+# Read a model in DataFrames of at most chunksize rows; at least one, possibly empty, chunk is returned
+def iter_model(path, columns=None, chunksize=1_000_000):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        empty = True
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            empty = False
+            yield batch.to_pandas()
+        if empty:
+            yield pd.read_parquet(path, columns=columns)
+        return
+    if file_format == 'feather':
+        yield from iter_feather(path, columns, chunksize)
+        return
+    arrays = npy_columns(path, columns)
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+    for offset in range(0, max(rows, 1), chunksize):
+        yield pd.DataFrame({column: values[offset:offset + chunksize] for column, values in arrays.items()})
+
+# Read a Feather file record batch by record batch, so only the batches of a chunk, and only the given columns of
+# them, are decompressed at a time; the batches are gathered or sliced into chunks of chunksize rows
+def iter_feather(path, columns, chunksize):
+    import pyarrow
+    import pyarrow.ipc
+    with pyarrow.memory_map(path) as source:
+        schema = pyarrow.ipc.open_file(source).schema
+        options = None
+        if columns is not None:
+            options = pyarrow.ipc.IpcReadOptions(included_fields=[schema.get_field_index(column) for column in columns])
+            schema = pyarrow.schema([schema.field(column) for column in columns])
+        reader = pyarrow.ipc.open_file(source, options=options)
+        pending, rows, chunks = [], 0, 0
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            pending.append(batch if columns is None else batch.select(columns))
+            rows += batch.num_rows
+            while rows >= chunksize:
+                table = pyarrow.Table.from_batches(pending, schema)
+                yield table.slice(0, chunksize).to_pandas()
+                chunks += 1
+                rest = table.slice(chunksize)
+                pending, rows = rest.to_batches(), rest.num_rows
+        if rows or chunks == 0:
+            yield pyarrow.Table.from_batches(pending, schema).to_pandas()
+
+def write_model(df, path):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        # numeric models are formatted in parallel, the others by pandas
+        if all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in df.dtypes):
+            write_columns(path, df.columns, [df[column].to_numpy() for column in df.columns])
+        else:
+            df.to_csv(path, index=False)
+    elif file_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif file_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for index, column in enumerate(df.columns):
+            np.save(os.path.join(path, f'{index}.npy'), df[column].to_numpy())
+        with open(os.path.join(path, 'columns.json'), 'w') as file:
+            json.dump([str(column) for column in df.columns], file)
+
+# Writes a model chunk by chunk, in the format given by its extension; the chunks have the columns of the first one
+class ModelWriter:
+    def __init__(self, path):
+        self.path = path
+        self.format = model_format(path)
+        if self.format == 'npy':
+            raise ValueError('.npy bundles cannot be written in chunks.')
+        self.writer = None
+        self.schema = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, df):
+        if self.format == 'csv':
+            first = self.schema is None
+            df.to_csv(self.path, index=False, header=first, mode='w' if first else 'a')
+            self.schema = list(df.columns)
+            return
+        import pyarrow
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            if self.format == 'parquet':
+                import pyarrow.parquet
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+            else:
+                import pyarrow.ipc
+                self.writer = pyarrow.ipc.new_file(self.path, self.schema)
+        else:
+            # the types pandas infers may change from one chunk to the next
+            table = table.cast(self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
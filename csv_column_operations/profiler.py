@@ -0,0 +1,158 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from sketches import CONFIDENCE, DistinctSketch, Moments, QuantileSketch
+
+# Rows of an in-memory column summarized at a time by the approximate profile
+CHUNK_ROWS = 1_000_000
+
+QUARTILES = (0.25, 0.5, 0.75)
+
+# Quantiles of sorted values, interpolated linearly between the closest ones as pandas does
+def sorted_quantiles(values, quantiles):
+    positions = np.asarray(quantiles) * (len(values) - 1)
+    low = np.floor(positions).astype(np.intp)
+    high = np.minimum(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (positions - low)
+
+# Statistics of the values of a column. The numbers are sorted once: the extrema, quartiles, distinct values,
+# mode and minimum spacing come from the sorted values; the mean and standard deviation from one more pass each
+def profile_values(values):
+    if isinstance(values, pd.Series):
+        values = values.to_numpy()
+    if values.dtype.kind not in 'biuf':
+        series = pd.Series(values).dropna()
+        mode = series.mode()
+        return {'count': len(series), 'unique': series.nunique(), 'mode': mode.iloc[0] if len(mode) else None}
+
+    if values.dtype.kind == 'b':
+        values = values.astype(np.int8)
+    if values.dtype.kind == 'f':
+        values = values[~np.isnan(values)]
+    count = len(values)
+    if count == 0:
+        return {'count': 0, 'unique': 0, 'mode': None, 'mean': np.nan, 'std': np.nan, 'min': np.nan,
+                'max': np.nan, 'quartiles': dict.fromkeys(QUARTILES, np.nan), 'min_diff': np.inf}
+
+    values = np.sort(values)
+    mean = values.mean()
+    deviations = values - mean
+    std = np.sqrt(np.dot(deviations, deviations) / (count - 1)) if count > 1 else np.nan
+    del deviations
+
+    # the first of each run of equal values
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    uniques = values[starts]
+    runs = np.diff(np.append(starts, count))
+    return {
+        'count': count,
+        'unique': len(uniques),
+        # the smallest of the most frequent values, as the first of pandas' modes
+        'mode': uniques[np.argmax(runs)],
+        'mean': mean,
+        'std': std,
+        'min': values[0],
+        'max': values[-1],
+        'quartiles': dict(zip(QUARTILES, sorted_quantiles(values, QUARTILES))),
+        'min_diff': np.diff(uniques).min() if len(uniques) > 1 else np.inf,
+    }
+
+# Approximate statistics of a column streamed as chunks of values, in a memory bounded by the chunk size: the moments,
+# extrema and count are exact, the quartiles come from a quantile sketch and the distinct values from a distinct
+# count sketch, with their error bounds. There is no mode or minimum spacing
+def approximate_profile(chunks):
+    moments = Moments()
+    quantiles = QuantileSketch()
+    distinct = DistinctSketch()
+    numeric = True
+    count = 0
+    for values in chunks:
+        values = np.asarray(values)
+        distinct.update(values)
+        if values.dtype.kind in 'biuf':
+            moments.update(values)
+            quantiles.update(values)
+        else:
+            numeric = False
+            count += int(pd.notna(values).sum())
+    profile = {'count': moments.count if numeric else count + moments.count, 'unique': distinct.estimate(),
+               'unique_error': distinct.relative_error()}
+    if numeric:
+        profile.update({
+            'mean': moments.mean if moments.count else np.nan,
+            'std': moments.std,
+            'min': moments.min if moments.count else np.nan,
+            'max': moments.max if moments.count else np.nan,
+            'quartiles': dict(zip(QUARTILES, quantiles.quantiles(QUARTILES))),
+            'rank_error': quantiles.rank_error(),
+        })
+    return profile
+
+# Text of the statistics of a column, as the Column Information window shows them
+def format_profile(column, profile):
+    lines = [f"Statistics for column '{column}':"]
+    # the error bounds of the approximate statistics
+    rank_error = f" (approximate, rank within {profile['rank_error']:.2%})" if 'rank_error' in profile else ''
+    unique_error = f" (approximate, within {profile['unique_error']:.2%})" if 'unique_error' in profile else ''
+    if 'mean' in profile:
+        quartiles = profile['quartiles']
+        lines += [
+            f"Mean: {profile['mean']}",
+            f"Median: {quartiles[0.5]}{rank_error}",
+            f"Standard Deviation: {profile['std']}",
+            f"Minimum: {profile['min']}",
+            f"Maximum: {profile['max']}",
+            f"Quartiles: Q1 = {quartiles[0.25]}, Q2 (Median) = {quartiles[0.5]}, Q3 = {quartiles[0.75]}{rank_error}",
+        ]
+    lines += [
+        f"Number of Observations: {profile['count']}",
+        f"Distinct Values: {profile['unique']}{unique_error}",
+    ]
+    if 'mode' in profile:
+        lines.append(f"Most Frequent Value (Mode): {profile['mode']}")
+    if 'min_diff' in profile:
+        lines.append(f"Min difference: {profile['min_diff']}")
+    if unique_error:
+        lines.append(f"Error bounds at {CONFIDENCE:.0%} confidence; no mode or minimum spacing in approximate mode")
+    return '\n'.join(lines) + '\n'
+
+# Chunks of the values of a column of a DataFrame, or of a lazy ColumnPlan, streamed from its file
+def column_chunks(df, column):
+    if isinstance(df, pd.DataFrame):
+        values = df[column].to_numpy()
+        return (values[start:start + CHUNK_ROWS] for start in range(0, max(len(values), 1), CHUNK_ROWS))
+    return (chunk[column].to_numpy() for chunk in df.iter_chunks([column]))
+
+# Statistics of the columns of a model, computed in parallel and kept until the column changes, which the windows
+# changing the columns report with changed(). The model is a DataFrame or a lazy ColumnPlan, whose columns are read
+# from the file one at a time and only when asked for. Approximate statistics stream the column instead of sorting it
+class ColumnProfiler:
+    def __init__(self, df, threads=None):
+        self.df = df
+        self.executor = ThreadPoolExecutor(max_workers=threads or os.cpu_count())
+        self.profiles = {}
+
+    def submit(self, column, approximate=False):
+        key = (column, approximate)
+        if key not in self.profiles:
+            # the values are taken here, so the workers do not touch the DataFrame while it is changed
+            if approximate:
+                self.profiles[key] = self.executor.submit(approximate_profile, column_chunks(self.df, column))
+            else:
+                self.profiles[key] = self.executor.submit(profile_values, self.df[column].to_numpy())
+        return self.profiles[key]
+
+    # Start profiling every column not profiled yet, in the background
+    def prefetch(self):
+        if isinstance(self.df, pd.DataFrame):
+            for column in self.df.columns:
+                self.submit(column)
+
+    def profile(self, column, approximate=False):
+        return self.submit(column, approximate).result()
+
+    def changed(self, *columns):
+        for column in columns:
+            self.profiles.pop((column, False), None)
+            self.profiles.pop((column, True), None)
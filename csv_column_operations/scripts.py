@@ -0,0 +1,191 @@
+import ast
+import copy
+import os
+import re
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from expressions import BLOCK_ROWS, ExpressionCompiler, compile_tree, evaluate_code, is_grouped, parse_expression
+
+# A script line: the new column name, an = that is not part of a comparison, and its expression
+LINE = re.compile(r'^\s*([^=]+?)\s*=(?!=)\s*(.+?)\s*$')
+
+# Parse a script of 'name = expression' lines, with empty and # comment lines ignored, into (name, expression)
+def parse_script(text):
+    lines = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        match = LINE.match(line)
+        if match is None:
+            raise ValueError(f"Line {number}: expected name = expression, got: {line.strip()}")
+        lines.append(match.groups())
+    names = Counter(name for name, _ in lines)
+    repeated = [name for name, count in names.items() if count > 1]
+    if repeated:
+        raise ValueError(f'Columns defined more than once: {", ".join(repeated)}')
+    if not lines:
+        raise ValueError('The script has no columns.')
+    return lines
+
+# Compiler of the lines of a script: col['name'] of a column defined in the script is that column, except in its
+# own definition, where it is the input column, so that A = col['A'] * 2 replaces A
+class ScriptCompiler(ExpressionCompiler):
+    def __init__(self, columns, targets):
+        super().__init__(columns)
+        self.targets = targets
+        self.target = None
+
+    def reference(self, name):
+        if name in self.targets and name != self.target:
+            return 'target', name
+        return 'input', super().reference(name)
+
+# Key of a subexpression, the same for equal subexpressions of any line
+def node_key(node):
+    return ast.dump(node, annotate_fields=False)
+
+def is_subexpression(node):
+    return isinstance(node, ast.expr) and not isinstance(node, (ast.Name, ast.Constant))
+
+# Subexpressions used in more than one place, counting each place once even when it is itself repeated:
+# (x + y) * z used twice makes a temporary of the product but not of x + y
+def common_subexpressions(trees):
+    nodes = {}
+    uses = Counter()
+
+    def intern(node):
+        key = node_key(node)
+        if key not in nodes:
+            nodes[key] = node
+            for child in ast.iter_child_nodes(node):
+                if is_subexpression(child):
+                    uses[intern(child)] += 1
+        return key
+
+    for tree in trees:
+        if is_subexpression(tree):
+            uses[intern(tree)] += 1
+    return {key: nodes[key] for key, count in uses.items() if count > 1}
+
+# Replace the subexpressions of a tree that have a temporary with its variable, but the tree itself
+def replace_subexpressions(node, temporaries, top=True):
+    if not top and is_subexpression(node) and node_key(node) in temporaries:
+        return ast.Name(temporaries[node_key(node)], ast.Load())
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            setattr(node, field, [replace_subexpressions(item, temporaries, False)
+                                  if isinstance(item, ast.AST) else item for item in value])
+        elif isinstance(value, ast.AST):
+            setattr(node, field, replace_subexpressions(value, temporaries, False))
+    return node
+
+# Text of a compiled tree as written in a script, with the variables of its columns given by names
+def tree_text(tree, names):
+    tree = copy.deepcopy(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            # the functions and constants of the namespace start with an underscore
+            node.id = names.get(node.id, node.id.removeprefix('_'))
+    return ast.unparse(tree)
+
+# A column or temporary of a script: its compiled code, the variables it reads and its text for the errors
+class Step:
+    def __init__(self, variable, tree, text, name=None):
+        self.variable = variable
+        self.text = text
+        self.name = name
+        self.grouped = is_grouped(tree)
+        self.code = compile_tree(tree)
+        # the functions and constants of the namespace start with an underscore
+        self.reads = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and not node.id.startswith('_')}
+
+# A script of derived columns, one 'name = expression' line each, in any order. Each line is a step of a dependency
+# graph, as are the subexpressions shared by lines, computed once into temporaries
+class Script:
+    def __init__(self, text, columns):
+        lines = parse_script(text)
+        compiler = ScriptCompiler(set(columns), {name for name, _ in lines})
+        trees = []
+        for name, expression in lines:
+            compiler.target = name
+            try:
+                trees.append(compiler.visit(parse_expression(expression)))
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}') from None
+
+        common = common_subexpressions(trees)
+        temporaries = {key: f'temporary{i}' for i, key in enumerate(common)}
+        definitions = {key: copy.deepcopy(node) for key, node in common.items()}
+        names = {variable: f"col['{column}']" for (_, column), variable in compiler.variables.items()}
+        texts = {key: tree_text(node, names) for key, node in definitions.items()}
+        self.steps = [Step(temporaries[key], replace_subexpressions(node, temporaries), texts[key])
+                      for key, node in definitions.items()]
+        self.steps += [Step(compiler.variables.setdefault(('target', name), f'column{len(compiler.variables)}'),
+                            replace_subexpressions(tree, temporaries, top=False), f'{name} = {expression}', name)
+                       for (name, expression), tree in zip(lines, trees)]
+        self.names = [name for name, _ in lines]
+        self.grouped = any(step.grouped for step in self.steps)
+        self.inputs = {variable: column for (kind, column), variable in compiler.variables.items()
+                       if kind == 'input'}
+
+        # the steps a step waits for, and the ones waiting for it
+        produced = {step.variable: step for step in self.steps}
+        self.waits = {step: {produced[variable] for variable in step.reads if variable in produced}
+                      for step in self.steps}
+        self.check_cycles()
+
+    def check_cycles(self):
+        pending = {step: len(waits) for step, waits in self.waits.items()}
+        ready = [step for step, count in pending.items() if count == 0]
+        done = 0
+        while ready:
+            step = ready.pop()
+            done += 1
+            for other, waits in self.waits.items():
+                if step in waits:
+                    pending[other] -= 1
+                    if pending[other] == 0:
+                        ready.append(other)
+        if done < len(self.steps):
+            cycle = sorted(step.name for step, count in pending.items() if count and step.name)
+            raise ValueError(f'Circular column definitions: {", ".join(cycle)}')
+
+    # Evaluate the steps on the rows of df, each as soon as the ones it reads are done, threads at a time, and add
+    # the new columns to df in the order of the script. A temporary is dropped when its last reader is done
+    def run(self, df, threads=None, block_rows=BLOCK_ROWS):
+        rows = len(df)
+        arrays = {variable: df[column].to_numpy() for variable, column in self.inputs.items()}
+        readers = Counter(variable for step in self.steps for variable in step.reads)
+        pending = {step: len(waits) for step, waits in self.waits.items()}
+        waiting = {step: [other for other, waits in self.waits.items() if step in waits] for step in self.steps}
+
+        def evaluate_step(step):
+            # steps run in parallel, so the blocks of each step are evaluated in turn; group functions need the
+            # whole columns
+            return evaluate_code(step.code, {variable: arrays[variable] for variable in step.reads}, rows, 1,
+                                 max(rows, 1) if step.grouped else block_rows, step.text)
+
+        with ThreadPoolExecutor(max_workers=threads or os.cpu_count()) as executor:
+            running = {executor.submit(evaluate_step, step): step
+                       for step, count in pending.items() if count == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    arrays[step.variable] = future.result()
+                    for variable in step.reads:
+                        readers[variable] -= 1
+                        if readers[variable] == 0 and variable.startswith('temporary'):
+                            del arrays[variable]
+                    for other in waiting[step]:
+                        pending[other] -= 1
+                        if pending[other] == 0:
+                            running[executor.submit(evaluate_step, other)] = other
+
+        for step in self.steps:
+            if step.name is not None:
+                df[step.name] = arrays[step.variable]
+        return self.names
+
+def run_script(df, text, threads=None):
+    return Script(text, tuple(df.columns)).run(df, threads)
@@ -0,0 +1,152 @@
+import math
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+# Size of the largest compactor of the quantile sketch; the rank error is about 1/k
+QUANTILE_K = 200
+
+# log2 of the registers of the distinct count sketch; the relative error is about 1.04 / sqrt(2 ** DISTINCT_P)
+DISTINCT_P = 14
+
+# Confidence of the reported error bounds
+CONFIDENCE = 0.99
+
+# KLL quantile sketch: values are kept in levels of compactors, a value of level h standing for 2 ** h values. When a
+# level is over its capacity it is sorted and every other value, starting at a random one, moves up a level. Each
+# compaction changes the rank of any value by at most the weight of the level, up or down with the same probability,
+# so the rank error is bounded (Hoeffding) from the compactions done
+class QuantileSketch:
+    def __init__(self, k=QUANTILE_K, seed=0):
+        self.k = k
+        self.rng = np.random.default_rng(seed)
+        self.levels = [np.empty(0)]
+        # whether the values of each level are sorted, as the half of a compaction moved to an empty level is
+        self.ordered = [True]
+        self.count = 0
+        # sum of the squared weights of the compactions
+        self.variance = 0.0
+
+    # Capacity of a level, smaller the further below the top level it is
+    def capacity(self, level):
+        return max(2, math.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.ordered[0] = False
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self.capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+                self.ordered.append(True)
+            if not self.ordered[level]:
+                items = np.sort(items)
+            # an odd value out stays on its level
+            even = len(items) - len(items) % 2
+            self.ordered[level + 1] = len(self.levels[level + 1]) == 0
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], items[self.rng.integers(2):even:2]))
+            self.levels[level] = items[even:]
+            self.ordered[level] = True
+            self.variance += (2.0 ** level) ** 2
+            # a new level lowers the capacity of the ones below, so they are checked again
+            level = 0
+
+    # Values at the given quantiles, or NaN without values
+    def quantiles(self, quantiles):
+        if self.count == 0:
+            return np.full(len(quantiles), np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+        positions = np.searchsorted(ranks, np.asarray(quantiles) * ranks[-1], side='left')
+        return values[np.minimum(positions, len(values) - 1)]
+
+    # Bound of the rank error of the quantiles, as a fraction of the values, at the given confidence
+    def rank_error(self, confidence=CONFIDENCE):
+        if self.count == 0:
+            return 0.0
+        return math.sqrt(2 * self.variance * math.log(2 / (1 - confidence))) / self.count
+
+# Hashes of values, the same for equal numbers whatever their dtype in a chunk
+def hash_values(values):
+    values = np.asarray(values)
+    if values.dtype.kind in 'biuf':
+        values = values.astype(np.float64)
+        values = values[~np.isnan(values)] + 0.0
+    else:
+        values = pd.Series(values).dropna().to_numpy()
+    return pd.util.hash_array(values)
+
+# HyperLogLog distinct count sketch: the first p bits of the hash of a value pick a register, which keeps the
+# longest run of leading zeros of the remaining bits seen
+class DistinctSketch:
+    def __init__(self, p=DISTINCT_P):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    def update(self, values):
+        hashes = hash_values(values)
+        bits = 64 - self.p
+        registers = (hashes >> np.uint64(bits)).astype(np.intp)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        # the remaining bits are fewer than the 53 of a float mantissa, so log2 is exact
+        with np.errstate(divide='ignore'):
+            runs = bits - np.floor(np.log2(rest.astype(np.float64)))
+        runs = np.minimum(runs, bits + 1).astype(np.uint8)
+        np.maximum.at(self.registers, registers, runs)
+
+    def estimate(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # few values: linear counting of the empty registers is more accurate
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    # Relative error bound of the estimate at the given confidence
+    def relative_error(self, confidence=CONFIDENCE):
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        return z * 1.04 / math.sqrt(len(self.registers))
+
+# Streaming moments of the values of the chunks, merged chunk by chunk (Chan et al.)
+class Moments:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        count = len(values)
+        if count == 0:
+            return
+        mean = values.mean()
+        deviations = values - mean
+        m2 = np.dot(deviations, deviations)
+        total = self.count + count
+        delta = mean - self.mean
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
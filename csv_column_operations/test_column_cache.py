@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from column_cache import ColumnCache
+from expressions import evaluate
+from model_io import read_model, write_model
+
+def sample_model(rows=1000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({f'a{index}': rng.random(rows) for index in range(4)})
+    df['rock'] = rng.choice(['x', 'y'], rows)
+    return df
+
+@pytest.fixture(params=['model.csv', 'model.parquet'])
+def model_file(request, tmp_path):
+    path = str(tmp_path / request.param)
+    write_model(sample_model(), path)
+    return path
+
+
+def test_cache_saves_only_changed_columns(model_file):
+    cache = ColumnCache(model_file)
+    df = cache.read()
+    df['s'] = evaluate(df, "col['a0'] * 2")
+    df['a1'] = 0.0
+    df = df.drop(columns='a2')
+    cache.changed('s', 'a1', 'a2')
+    cache.save(df)
+    assert sorted(os.listdir(cache.directory)) == ['0.feather', '1.feather', 'columns.json']
+
+    saved = ColumnCache(model_file)
+    assert saved.saved()
+    pd.testing.assert_frame_equal(saved.read(), df)
+
+def test_cache_export_removes_sidecar(model_file):
+    cache = ColumnCache(model_file)
+    df = cache.read()
+    df['s'] = evaluate(df, "col['a0'] + col['a3']")
+    cache.changed('s')
+    cache.save(df)
+    cache.export(df)
+    assert not os.path.exists(cache.directory)
+    pd.testing.assert_frame_equal(ColumnCache(model_file).read(), df, check_exact=False)
+# A second save only writes the columns changed since the first, and drops the files of the replaced ones
+def test_cache_saves_again_only_what_changed(model_file):
+    cache = ColumnCache(model_file)
+    df = cache.read()
+    df['s'] = 1.0
+    cache.changed('s')
+    cache.save(df)
+    unchanged = os.stat(os.path.join(cache.directory, '0.feather')).st_mtime_ns
+    df['a0'] = df['s'] + 1
+    cache.changed('a0')
+    cache.save(df)
+    assert sorted(os.listdir(cache.directory)) == ['0.feather', '1.feather', 'columns.json']
+    assert os.stat(os.path.join(cache.directory, '0.feather')).st_mtime_ns == unchanged
+    df['s'] = 3.0
+    cache.changed('s')
+    cache.save(df)
+    assert sorted(os.listdir(cache.directory)) == ['1.feather', '2.feather', 'columns.json']
+    pd.testing.assert_frame_equal(ColumnCache(model_file).read(), df)
+
+def test_stale_sidecar_is_kept_until_discarded(model_file):
+    cache = ColumnCache(model_file)
+    df = cache.read()
+    df['s'] = 1.0
+    cache.changed('s')
+    cache.save(df)
+    # the model file written again, and a second later for file systems with coarse times
+    write_model(sample_model(), model_file)
+    os.utime(model_file, ns=(os.stat(model_file).st_atime_ns, os.stat(model_file).st_mtime_ns + 10 ** 9))
+
+    stale = ColumnCache(model_file)
+    assert stale.stale and os.path.exists(stale.directory)
+    pd.testing.assert_frame_equal(stale.read(), read_model(model_file))
+    with pytest.raises(ValueError):
+        stale.save(df)
+    stale.discard()
+    assert not stale.stale and not os.path.exists(stale.directory)
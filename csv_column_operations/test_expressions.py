@@ -0,0 +1,98 @@
+import re
+import numpy as np
+import pandas as pd
+import pytest
+from expressions import Expression, evaluate, evaluate_filtered, fix_expression
+
+def sample_frame(rows=50_000):
+    rng = np.random.default_rng(7)
+    df = pd.DataFrame({'au': rng.lognormal(0.0, 1.0, rows), 'cu': rng.uniform(0.0, 2.0, rows),
+                       'DESTINO': rng.integers(1, 4, rows), 'rock': rng.choice(['ox', 'fresh'], rows)})
+    df.loc[::13, 'au'] = np.nan
+    return df
+
+def test_expressions_match_numpy():
+    df = sample_frame()
+    au, cu = df.au.to_numpy(), df.cu.to_numpy()
+    np.testing.assert_allclose(evaluate(df, "col['au'] * 31.1 + sqrt(col['cu']) - np.log(col['cu'] + 1)"),
+                               au * 31.1 + np.sqrt(cu) - np.log(cu + 1))
+    np.testing.assert_array_equal(evaluate(df, "if(col['au'] > 1 and not col['cu'] < 0.5, 1, 0)"),
+                                  np.where((au > 1) & ~(cu < 0.5), 1, 0))
+    np.testing.assert_array_equal(evaluate(df, "0.5 < col['cu'] <= 1.5"), (0.5 < cu) & (cu <= 1.5))
+    np.testing.assert_array_equal(evaluate(df, "col['rock'] == 'ox'"), df.rock.to_numpy() == 'ox')
+    np.testing.assert_array_equal(evaluate(df, '2 * pi'), np.full(len(df), 2 * np.pi))
+
+def test_blocks_and_threads_give_the_same_values():
+    df = sample_frame()
+    expression = Expression("if(col['DESTINO'] == 2, col['au'] * col['cu'], nan)", tuple(df.columns))
+    whole = expression.evaluate(df, threads=1, block_rows=len(df))
+    np.testing.assert_array_equal(expression.evaluate(df, threads=4, block_rows=1000), whole)
+    np.testing.assert_array_equal(expression.evaluate(df, threads=1, block_rows=999), whole)
+
+# The conditional if(condition, a, b) is only a call where a call can be
+def test_if_calls_and_conditional_expressions():
+    assert fix_expression("if(col['a'] > 0, if (col['b'] > 1, 1, 2), 3)") == \
+        "where(col['a'] > 0, where(col['b'] > 1, 1, 2), 3)"
+    assert fix_expression("2 * if(if(col['a'], 1, 0), 3, 4)") == "2 * where(where(col['a'], 1, 0), 3, 4)"
+    assert fix_expression("col['a'] if (col['b'] > 0) else 0") == "col['a'] if (col['b'] > 0) else 0"
+    assert fix_expression("col['a'] if (col['b']) else if(col['c'], 1, 2)") == \
+        "col['a'] if (col['b']) else where(col['c'], 1, 2)"
+    df = sample_frame(100)
+    np.testing.assert_array_equal(evaluate(df, "col['au'] if (col['DESTINO'] > 1) else 0"),
+                                  np.where(df.DESTINO > 1, df.au, 0))
+
+@pytest.mark.parametrize('text, message', [
+    ("__import__('os').system('ls')", 'Unknown function'),
+    ("col['au'].__class__", 'Not allowed'),
+    ('(lambda: 1)()', 'Unknown function'),
+    ("open('model.csv')", 'Unknown function'),
+    ("np.linalg.inv(col['au'])", 'Unknown function'),
+    ("sqrt(x=col['au'])", 'Unknown function'),
+    ("col['zn'] * 2", 'Unknown column: zn'),
+    ('au * 2', "Unknown name: au, columns are written as col['au']"),
+    ("df['au']", 'Only columns'),
+    ("[col['au']]", 'Not allowed'),
+    ("col['au'] *", 'Invalid expression'),
+])
+def test_only_the_whitelist_is_allowed(text, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        Expression(text, ('au', 'cu'))
+
+# Errors of valid expressions on the values of the columns name the expression
+@pytest.mark.parametrize('text', ["col['au'] + 'x'", "col['rock'] * 2.5", "sqrt(col['rock'])"])
+def test_evaluation_errors_are_value_errors(text):
+    df = sample_frame(100)
+    with pytest.raises(ValueError, match=f'Cannot evaluate {re.escape(text)}: '):
+        evaluate(df, text)
+    with pytest.raises(ValueError, match='Cannot evaluate'):
+        Expression(text, tuple(df.columns)).evaluate(df, threads=2, block_rows=10)
+
+@pytest.mark.parametrize('how', ['mean', 'sum', 'min', 'max', 'std', 'median', 'count', 'rank', 'cumsum'])
+def test_group_functions_match_groupby(how):
+    df = sample_frame(5000)
+    df.loc[::17, 'rock'] = None
+    expected = df.groupby(['rock', 'DESTINO'], sort=False)['au'].transform(how)
+    np.testing.assert_allclose(evaluate(df, f"group_{how}(col['au'], col['rock'], col['DESTINO'])"), expected)
+    np.testing.assert_allclose(evaluate(df, f"group_{how}(col['au'])"),
+                               df.groupby(np.zeros(len(df)))['au'].transform(how))
+
+def test_group_functions_in_expressions():
+    df = sample_frame(5000)
+    np.testing.assert_allclose(evaluate(df, "col['au'] / group_mean(col['au'], col['rock'])"),
+                               df.au / df.groupby('rock').au.transform('mean'))
+    np.testing.assert_array_equal(evaluate(df, "group_count(1, col['rock'])"),
+                                  df.groupby('rock').rock.transform('size'))
+
+def test_where_filters_the_rows():
+    df = sample_frame(5000)
+    destino = df.DESTINO.to_numpy() == 2
+    values = evaluate_filtered(df, "col['au'] * 2", "col['DESTINO'] == 2", 'au')
+    np.testing.assert_array_equal(values, np.where(destino, df.au * 2, df.au))
+    # a new column is missing outside the filter, and the group functions only see the filtered rows
+    values = evaluate_filtered(df, "group_rank(col['cu'], col['rock'])", "col['DESTINO'] == 2", 'rank')
+    expected = df.cu[destino].groupby(df.rock[destino]).rank().reindex(df.index)
+    np.testing.assert_array_equal(values, expected)
+    values = evaluate_filtered(df, "col['rock'] + '_2'", "col['DESTINO'] == 2", 'label')
+    assert values.dtype == object and values[~destino].tolist() == [None] * int(np.count_nonzero(~destino))
+    with pytest.raises(ValueError, match='The filter must be a condition'):
+        evaluate_filtered(df, "col['au']", "col['DESTINO'] + 1", 'au')
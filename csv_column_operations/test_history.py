@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+from expressions import evaluate
+from history import ColumnHistory, changed_columns, model_version
+from lazy import ColumnPlan
+from model_io import read_model, write_model
+
+def sample_model(rows=1000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({f'a{index}': rng.random(rows) for index in range(4)})
+    df['rock'] = rng.choice(['x', 'y'], rows)
+    return df
+
+@pytest.fixture(params=['model.csv', 'model.parquet'])
+def model_file(request, tmp_path):
+    path = str(tmp_path / request.param)
+    write_model(sample_model(), path)
+    return path
+
+def test_history_undo_and_redo():
+    df = sample_model()
+    original = df.copy()
+    history = ColumnHistory()
+    before = model_version(df)
+    df['s'] = evaluate(df, "col['a0'] * 2")
+    history.record(before)
+    before = model_version(df)
+    del df['a1']
+    history.record(before)
+    changed = df.copy()
+
+    df, columns = history.undo(df)
+    assert columns == ['a1']
+    df, columns = history.undo(df)
+    assert columns == ['s'] and not history.can_undo()
+    pd.testing.assert_frame_equal(df, original)
+
+    df, _ = history.redo(df)
+    df, _ = history.redo(df)
+    assert not history.can_redo()
+    pd.testing.assert_frame_equal(df, changed)
+
+
+# A version shares the values of the columns with the model, which can then only be changed a whole column at a time
+def test_versions_cannot_be_changed_in_place():
+    df = sample_model()
+    df['grade'] = pd.Categorical(df['rock'])
+    original = df.copy()
+    before = model_version(df)
+
+    def set_value():
+        df.loc[0, 'a0'] = 5.0
+
+    def set_position():
+        df.iloc[1, 1] = 5.0
+
+    def set_array():
+        df['a2'].to_numpy()[2] = 5.0
+
+    def set_category():
+        df.loc[3, 'grade'] = 'y'
+
+    for change in (set_value, set_position, set_array, set_category):
+        with pytest.raises(ValueError, match='read-only'):
+            change()
+    df['a0'] = df['a0'] * 2
+    del df['a1']
+    pd.testing.assert_frame_equal(pd.DataFrame(before), original)
+    assert changed_columns(before, model_version(df)) == ['a0', 'a1']
+
+def test_history_of_a_lazy_plan(model_file):
+    plan = ColumnPlan(model_file)
+    history = ColumnHistory()
+    before = model_version(plan)
+    plan.add_expression('s', "col['a0'] * 2")
+    history.record(before)
+    before = model_version(plan)
+    plan.remove('a3')
+    history.record(before)
+
+    plan, columns = history.undo(plan)
+    assert columns == ['a3'] and 'a3' in plan.columns
+    plan, columns = history.undo(plan)
+    assert columns == ['s'] and plan.operations == []
+
+    plan, _ = history.redo(plan)
+    plan.save(model_file)
+    assert 's' in read_model(model_file).columns and 'a3' in plan.columns
+    history.clear()
+    assert not history.can_undo() and not history.can_redo()
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lazy import ColumnPlan
+from model_io import read_model, write_model
+
+def sample_model(rows=1000):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({f'a{index}': rng.random(rows) for index in range(4)})
+    df['rock'] = rng.choice(['x', 'y'], rows)
+    return df
+
+@pytest.fixture(params=['model.csv', 'model.parquet', 'model.feather'])
+def model_file(request, tmp_path):
+    path = str(tmp_path / request.param)
+    write_model(sample_model(), path)
+    return path
+
+def test_lazy_save_applies_the_operations(model_file):
+    df = read_model(model_file)
+    plan = ColumnPlan(model_file, chunksize=300)
+    plan.add_expression('s', "col['a0'] * 2")
+    plan.add_expression('a1', '0', where="col['rock'] == 'x'")
+    plan.remove('a2')
+    plan.add_script("t = col['s'] + col['a3']")
+    np.testing.assert_allclose(plan['s'], df['a0'] * 2)
+
+    plan.save(model_file)
+    assert plan.operations == [] and plan.input_columns == plan.columns
+    saved = read_model(model_file)
+    assert list(saved.columns) == ['a0', 'a1', 'a3', 'rock', 's', 't']
+    np.testing.assert_allclose(saved['a1'], df['a1'].where(df['rock'] != 'x', 0))
+    np.testing.assert_allclose(saved['t'], df['a0'] * 2 + df['a3'])
+
+# Only the input columns and the operations a column depends on are read and applied, and the removals
+def test_columns_read_only_what_they_need(model_file):
+    plan = ColumnPlan(model_file, chunksize=300)
+    plan.add_expression('s', "col['a0'] * 2")
+    plan.add_expression('u', "col['a1'] + 1", where="col['rock'] == 'y'")
+    plan.add_script("t = col['s'] + col['a3']")
+    plan.remove('a2')
+    add_s, _, script, remove = plan.operations
+    assert plan.prune(['s']) == (['a0'], [add_s, remove])
+    assert plan.prune(['t']) == (['a0', 'a3'], [add_s, script, remove])
+    assert plan.prune(['u'])[0] == ['a1', 'rock']
+    chunks = list(plan.iter_chunks(['t', 'rock']))
+    assert [len(chunk) for chunk in chunks] == [300, 300, 300, 100]
+    assert all(list(chunk.columns) == ['t', 'rock'] for chunk in chunks)
+
+def test_lazy_mode_refuses_group_functions(model_file):
+    plan = ColumnPlan(model_file)
+    with pytest.raises(ValueError):
+        plan.add_expression('m', "group_mean(col['a0'], col['rock'])")
+    with pytest.raises(ValueError):
+        plan.add_expression('m', "col['a0']", where="group_rank(col['a0']) < 10")
+    with pytest.raises(ValueError):
+        plan.add_script("m = group_mean(col['a0'], col['rock'])")
+    assert plan.operations == []
+
+# A failed operation leaves nothing behind in the plan
+def test_invalid_operations_are_not_recorded(model_file):
+    plan = ColumnPlan(model_file)
+    with pytest.raises(ValueError, match='Unknown column: a9'):
+        plan.remove('a9')
+    with pytest.raises(ValueError, match='Unknown column: a9'):
+        plan.add_expression('s', "col['a9'] * 2")
+    assert plan.operations == [] and plan.columns == plan.input_columns
+    plan.save(model_file)
+    pd.testing.assert_frame_equal(read_model(model_file), sample_model(), check_exact=False)
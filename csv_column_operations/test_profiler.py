@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from profiler import QUARTILES, ColumnProfiler, format_profile, profile_values
+
+def sample_frame(rows=20_000):
+    rng = np.random.default_rng(3)
+    df = pd.DataFrame({'au': rng.lognormal(0.0, 1.0, rows).round(3), 'DESTINO': rng.integers(1, 4, rows),
+                       'ore': rng.random(rows) < 0.3, 'rock': rng.choice(['ox', 'fresh', None], rows)})
+    df.loc[::17, 'au'] = np.nan
+    return df
+
+# The statistics InfoWindow took from pandas one call at a time
+def pandas_profile(series):
+    series = series.dropna()
+    if series.dtype.kind not in 'biuf':
+        return {'count': series.count(), 'unique': series.nunique(), 'mode': series.mode().iloc[0]}
+    series = series.astype(float)
+    uniques = np.sort(series.unique())
+    return {'count': series.count(), 'unique': series.nunique(), 'mode': series.mode().iloc[0],
+            'mean': series.mean(), 'std': series.std(), 'min': series.min(), 'max': series.max(),
+            'quartiles': {q: series.quantile(q) for q in QUARTILES}, 'min_diff': np.diff(uniques).min()}
+
+@pytest.mark.parametrize('column', ['au', 'DESTINO', 'ore', 'rock'])
+def test_profile_matches_pandas(column):
+    df = sample_frame()
+    profile = profile_values(df[column])
+    expected = pandas_profile(df[column])
+    assert profile.keys() == expected.keys()
+    for key, value in expected.items():
+        if key == 'quartiles':
+            np.testing.assert_allclose(list(profile[key].values()), list(value.values()))
+        elif isinstance(value, str):
+            assert profile[key] == value
+        else:
+            np.testing.assert_allclose(profile[key], value)
+
+def test_profile_without_values():
+    profile = profile_values(np.full(5, np.nan))
+    assert profile['count'] == 0 and profile['mode'] is None and np.isnan(profile['mean'])
+    assert "Number of Observations: 0" in format_profile('au', profile)
+
+# Profiles are kept until their column is reported changed
+def test_profiles_are_cached_until_changed():
+    df = sample_frame()
+    profiler = ColumnProfiler(df, threads=2)
+    profiler.prefetch()
+    assert set(profiler.profiles) == {(column, False) for column in df.columns}
+    first = profiler.submit('au')
+    assert profiler.submit('au') is first
+    df['au'] = df['au'] * 2
+    profiler.changed('au')
+    assert profiler.submit('au') is not first
+    assert profiler.profile('au')['max'] == pytest.approx(2 * first.result()['max'])
+    assert profiler.submit('DESTINO') is profiler.profiles[('DESTINO', False)]
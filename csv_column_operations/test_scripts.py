@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+from expressions import evaluate
+from scripts import Script, run_script
+
+SCRIPT = """
+# lines in any order: nsr reads tonnage and recovery, defined after it
+nsr = col['tonnage'] * col['recovery'] * 60 - (col['au'] * 31.1 + col['cu']) * 2
+tonnage = col['volume'] * col['density']
+
+recovery = if(col['au'] * 31.1 + col['cu'] > 1, 0.9, 0.6)
+au = col['au'] * 1.1
+"""
+
+def sample_frame(rows=40_000):
+    rng = np.random.default_rng(11)
+    return pd.DataFrame({'au': rng.lognormal(0.0, 1.0, rows), 'cu': rng.uniform(0.0, 2.0, rows),
+                         'volume': 1000.0, 'density': rng.uniform(2.5, 3.0, rows)})
+
+# au replaces the input column, in its own line, and is the new column in the other lines
+def test_script_adds_its_columns_in_order():
+    df = sample_frame()
+    expected = df.copy()
+    expected['au'] = expected.au * 1.1
+    expected['tonnage'] = evaluate(expected, "col['volume'] * col['density']")
+    expected['recovery'] = evaluate(expected, "if(col['au'] * 31.1 + col['cu'] > 1, 0.9, 0.6)")
+    expected['nsr'] = evaluate(expected, "col['tonnage'] * col['recovery'] * 60 - (col['au'] * 31.1 + col['cu']) * 2")
+    assert run_script(df, SCRIPT, threads=4) == ['nsr', 'tonnage', 'recovery', 'au']
+    assert list(df.columns) == ['au', 'cu', 'volume', 'density', 'nsr', 'tonnage', 'recovery']
+    pd.testing.assert_frame_equal(df, expected[df.columns])
+
+def test_blocks_and_threads_give_the_same_values():
+    df, single = sample_frame(), sample_frame()
+    Script(SCRIPT, tuple(df.columns)).run(df, threads=4, block_rows=1000)
+    Script(SCRIPT, tuple(single.columns)).run(single, threads=1, block_rows=len(single))
+    pd.testing.assert_frame_equal(df, single)
+
+# The term shared by recovery and nsr is computed once, into a temporary read by both
+def test_shared_subexpressions_are_computed_once():
+    script = Script(SCRIPT, ('au', 'cu', 'volume', 'density'))
+    temporaries = [step for step in script.steps if step.name is None]
+    assert [step.text for step in temporaries] == ["col['au'] * 31.1 + col['cu']"]
+    readers = [step.name for step in script.steps if temporaries[0].variable in step.reads]
+    assert sorted(readers) == ['nsr', 'recovery']
+
+def test_nested_shared_terms_make_one_temporary():
+    script = Script("a = (col['x'] + col['y']) * col['z'] + 1\nb = (col['x'] + col['y']) * col['z'] - 1",
+                    ('x', 'y', 'z'))
+    assert [step.text for step in script.steps if step.name is None] == ["(col['x'] + col['y']) * col['z']"]
+
+@pytest.mark.parametrize('text, message', [
+    ("a = col['b'] + 1\nb = col['a'] * 2", 'Circular column definitions: a, b'),
+    ("a = col['x']\na = col['x'] * 2", 'Columns defined more than once: a'),
+    ("a = col['x']\ncol['x'] * 2", 'Line 2: expected name = expression'),
+    ("a = col['zn']", "a: Unknown column: zn"),
+    ('# only a comment', 'The script has no columns.'),
+])
+def test_invalid_scripts(text, message):
+    with pytest.raises(ValueError, match=message):
+        Script(text, ('x',))
+
+def test_evaluation_errors_name_the_line():
+    df = sample_frame(100)
+    df['rock'] = 'ox'
+    with pytest.raises(ValueError, match=r"Cannot evaluate grade = col\['rock'\] \* 2.5: "):
+        run_script(df, "tonnage = col['volume'] * 2\ngrade = col['rock'] * 2.5")
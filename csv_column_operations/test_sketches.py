@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from lazy import ColumnPlan
+from model_io import write_model
+from profiler import QUARTILES, ColumnProfiler, approximate_profile
+from sketches import QUANTILE_K, DistinctSketch, Moments, QuantileSketch, hash_values
+
+def chunks(values, rows=50_000):
+    return [values[start:start + rows] for start in range(0, len(values), rows)]
+
+# The ranks of the sketched quantiles are within the reported error, and the sketch keeps few values
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_quantiles_are_within_the_rank_error(seed):
+    values = np.random.default_rng(seed).lognormal(0.0, 1.0, 1_000_000)
+    sketch = QuantileSketch(seed=seed)
+    for chunk in chunks(values):
+        sketch.update(chunk)
+    quantiles = np.linspace(0.01, 0.99, 99)
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(quantiles), side='right') / len(values)
+    assert sketch.count == len(values)
+    assert np.max(np.abs(ranks - quantiles)) <= sketch.rank_error()
+    assert sketch.rank_error() < 0.05
+    assert sum(len(level) for level in sketch.levels) < 4 * QUANTILE_K
+
+# The bound holds at 99% for a random input; the fixed inputs here are checked at 99.99%
+@pytest.mark.parametrize('distinct', [100, 5000, 300_000])
+def test_distinct_count_is_within_the_relative_error(distinct):
+    rng = np.random.default_rng(distinct)
+    values = rng.integers(0, distinct, 1_000_000).astype(np.float64)
+    sketch = DistinctSketch()
+    for chunk in chunks(values):
+        sketch.update(chunk)
+    exact = len(np.unique(values))
+    assert abs(sketch.estimate() - exact) <= sketch.relative_error(0.9999) * exact
+
+# Equal numbers hash the same whatever their dtype, and missing values are not counted
+def test_hashes_ignore_the_dtype():
+    np.testing.assert_array_equal(hash_values(np.array([1, 2, 3])), hash_values(np.array([1.0, 2.0, np.nan, 3.0])))
+    np.testing.assert_array_equal(hash_values(np.array([0.0])), hash_values(np.array([-0.0])))
+    assert len(hash_values(np.array(['ox', None, 'fresh'], dtype=object))) == 2
+
+def test_moments_merge_chunks_exactly():
+    values = np.random.default_rng(4).normal(1e6, 3.0, 300_001)
+    moments = Moments()
+    for chunk in chunks(values, 7919):
+        moments.update(chunk)
+    assert moments.count == len(values)
+    assert moments.mean == pytest.approx(values.mean(), rel=1e-14)
+    assert moments.std == pytest.approx(values.std(ddof=1), rel=1e-9)
+    assert (moments.min, moments.max) == (values.min(), values.max())
+
+# The approximate profile of a column of a lazy plan streams it from the file
+def test_approximate_profile_of_a_lazy_column(tmp_path):
+    rng = np.random.default_rng(5)
+    df = pd.DataFrame({'au': rng.lognormal(0.0, 1.0, 200_000), 'rock': rng.choice(['ox', 'fresh'], 200_000)})
+    df.loc[::9, 'au'] = np.nan
+    path = str(tmp_path / 'model.parquet')
+    write_model(df, path)
+    plan = ColumnPlan(path, chunksize=30_000)
+    plan.add_expression('au2', "col['au'] * 2")
+    profile = ColumnProfiler(plan).profile('au2', approximate=True)
+    values = df.au.dropna().to_numpy() * 2
+    assert profile['count'] == len(values)
+    assert profile['mean'] == pytest.approx(values.mean())
+    assert (profile['min'], profile['max']) == (values.min(), values.max())
+    ranks = np.searchsorted(np.sort(values), list(profile['quartiles'].values()), side='right') / len(values)
+    assert np.max(np.abs(ranks - np.array(QUARTILES))) <= profile['rank_error']
+    assert abs(profile['unique'] - len(values)) <= DistinctSketch().relative_error(0.9999) * len(values)
+    text = approximate_profile([df.rock.to_numpy()])
+    assert text['count'] == 200_000 and text['unique'] == 2 and 'mean' not in text
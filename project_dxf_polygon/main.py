@@ -1,8 +1,9 @@
 import sys
-import csv
 import ezdxf
 import numpy as np
-from shapely.geometry import Polygon, Point
+import shapely
+from shapely.geometry import Polygon
+from csv_io import read_numeric, write_numeric
 from PySide6.QtWidgets import (
     QApplication,
     QWidget,
@@ -30,11 +31,47 @@ def read_dxf(filename):
 
 
 def read_csv(filename):
-    with open(filename, 'r') as f:
-        reader = csv.reader(f)
-        next(reader) # skip header
-        data = [row for row in reader]
-    return np.array(data, dtype=float)
+    _, data = read_numeric(filename)
+    return data
+
+# Cells on each side of the grid laid over the bounding box of the polygon
+GRID_CELLS = 256
+
+# Edges of the cells of the grid along one axis, and the cell of each coordinate in it; a coordinate is in the cell
+# whose edges it lies between, compared as the same floats the cells are made of
+def grid_cells(low, high, cells, values):
+    edges = np.linspace(low, high, cells + 1)
+    return edges, np.clip(np.searchsorted(edges, values, side='right') - 1, 0, cells - 1)
+
+# Whether each of the (x, y) points is inside the polygon. Points outside its bounding box are left out at once; the
+# box is divided into a grid, and a cell the boundary of the polygon does not cross is wholly inside or outside it, as
+# its center is, so only the points in the cells the boundary crosses are tested exactly, against the prepared polygon
+def points_inside(polygon, points):
+    inside = np.zeros(len(points), dtype=bool)
+    xmin, ymin, xmax, ymax = polygon.bounds
+    x, y = points[:, 0], points[:, 1]
+    candidates = np.flatnonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+    # a polygon without area contains no points
+    if len(candidates) == 0 or xmin == xmax or ymin == ymax:
+        return inside
+    x, y = x[candidates], y[candidates]
+    shapely.prepare(polygon)
+
+    # no more cells than points to place in them
+    cells = max(1, min(GRID_CELLS, int(np.sqrt(len(candidates)))))
+    x_edges, columns = grid_cells(xmin, xmax, cells, x)
+    y_edges, rows = grid_cells(ymin, ymax, cells, y)
+    x0, y0 = np.meshgrid(x_edges[:-1], y_edges[:-1])
+    x1, y1 = np.meshgrid(x_edges[1:], y_edges[1:])
+    boundary = polygon.boundary
+    shapely.prepare(boundary)
+    crossed = shapely.intersects(boundary, shapely.box(x0, y0, x1, y1))
+    cell_inside = ~crossed & shapely.contains_xy(polygon, (x0 + x1) / 2, (y0 + y1) / 2)
+
+    exact = crossed[rows, columns]
+    inside[candidates] = cell_inside[rows, columns]
+    inside[candidates[exact]] = shapely.contains_xy(polygon, x[exact], y[exact])
+    return inside
 
 class Window(QWidget):
     def __init__(self):
@@ -105,7 +142,7 @@ class Window(QWidget):
     def run_projection(self):
          # Calculate surface points inside polygon
         surface_points = self.config['csv'][:, :2]
-        mask = [self.config['dxf'].contains(Point(p)) for p in surface_points]
+        mask = points_inside(self.config['dxf'], surface_points)
         elevations = np.zeros_like(self.config['csv'][:, 2])
         elevations[mask] = float(self.elevation.text())
 
@@ -114,7 +151,7 @@ class Window(QWidget):
         updated_data[:, 2] = np.where(mask, elevations, updated_data[:, 2])
 
         # Save output
-        np.savetxt(self.output_local.text(), updated_data, delimiter=',', header='x,y,z', comments='')
+        write_numeric(self.output_local.text(), ['x', 'y', 'z'], updated_data)
         QMessageBox.information(self, 'Warning', 'Projection completed.', QMessageBox.Ok)
         QApplication.quit()
 
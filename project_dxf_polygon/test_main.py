@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import Polygon
+from main import points_inside
+
+# A star-shaped, concave polygon around (500, 500), as the polylines of the DXF files
+def star_polygon(points=12, inner=150.0, outer=400.0):
+    angles = np.linspace(0.0, 2 * np.pi, 2 * points, endpoint=False)
+    radii = np.where(np.arange(2 * points) % 2 == 0, outer, inner)
+    return Polygon(np.column_stack((500 + radii * np.cos(angles), 500 + radii * np.sin(angles))))
+
+def expected_inside(polygon, points):
+    return np.array([polygon.contains(shapely.Point(x, y)) for x, y in points])
+
+# The points of a surface, some outside the bounding box of the polygon and some on its vertices
+def test_points_inside_match_contains():
+    rng = np.random.default_rng(8)
+    polygon = star_polygon()
+    points = np.vstack((rng.uniform(0.0, 1000.0, (3000, 2)), np.asarray(polygon.exterior.coords)[:5]))
+    np.testing.assert_array_equal(points_inside(polygon, points), expected_inside(polygon, points))
+
+def test_no_points_inside():
+    polygon = star_polygon()
+    assert points_inside(polygon, np.empty((0, 2))).shape == (0,)
+    assert not points_inside(polygon, np.array([[2000.0, 0.0], [-5.0, 500.0]])).any()
+
+# Enough points for the full grid, with points on the edges of its cells and on the boundary of the polygon
+def test_grid_cells_give_the_exact_result():
+    rng = np.random.default_rng(9)
+    polygon = star_polygon(points=40, inner=20.0)
+    xmin, ymin, xmax, ymax = polygon.bounds
+    x_edges, y_edges = np.linspace(xmin, xmax, 257), np.linspace(ymin, ymax, 257)
+    on_edges = np.column_stack((rng.choice(x_edges, 5000), rng.uniform(ymin, ymax, 5000)))
+    coords = np.asarray(polygon.exterior.coords)
+    on_boundary = (coords[:-1] + coords[1:]) / 2
+    points = np.vstack((rng.uniform(0.0, 1000.0, (80_000, 2)), on_edges, on_boundary,
+                        np.column_stack((rng.uniform(xmin, xmax, 5000), rng.choice(y_edges, 5000)))))
+    inside = points_inside(polygon, points)
+    np.testing.assert_array_equal(inside, shapely.contains_xy(polygon, points[:, 0], points[:, 1]))
+    assert inside.any() and not inside.all()
+
+# A sliver thinner than a cell, and a few points in one cell
+@pytest.mark.parametrize('rows', [3, 40_000])
+def test_thin_polygons(rows):
+    polygon = Polygon([(0.0, 0.0), (1000.0, 0.5), (1000.0, 1.5), (0.0, 1.0)])
+    points = np.random.default_rng(rows).uniform((0.0, 0.0), (1000.0, 2.0), (rows, 2))
+    np.testing.assert_array_equal(points_inside(polygon, points), expected_inside(polygon, points))
+
+def test_polygon_without_area():
+    polygon = Polygon([(0.0, 0.0), (10.0, 0.0), (5.0, 0.0)])
+    assert not points_inside(polygon, np.array([[5.0, 0.0], [2.0, 0.0]])).any()
@@ -1,8 +1,8 @@
 import sys
 import ezdxf
 import numpy as np
-import csv
 from scipy.spatial import cKDTree
+from csv_io import read_numeric, write_numeric
 from PySide6.QtWidgets import (
     QApplication,
     QWidget,
@@ -30,16 +30,10 @@ def triangulate_surface(msp):
     return np.vstack(triangles)
 
 def load_csv_surface(csv_file):
-    points = []
-
-    with open(csv_file, 'r') as file:
-        reader = csv.reader(file)
-        next(reader)  # Skip header
-        for row in reader:
-            x, y, elevation = map(float, row)
-            points.append((x, y, elevation))
-
-    return np.array(points)
+    _, points = read_numeric(csv_file)
+    if points.shape[1] != 3:
+        raise ValueError('The CSV surface must have the x, y and elevation columns.')
+    return points
 
 def project_surface_to_grid(dxf_surface, csv_surface):
     # Create a KD-tree for the DXF surface points for efficient nearest neighbor search
@@ -59,12 +53,7 @@ def project_surface_to_grid(dxf_surface, csv_surface):
     return np.array(projected_points)
 
 def save_csv(points, output_file):
-    with open(output_file, 'w', newline='') as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(['X', 'Y', 'Z'])  # Header
-
-        for x, y, z in points:
-            writer.writerow([x, y, z])
+    write_numeric(output_file, ['X', 'Y', 'Z'], points)
 
 class Window(QWidget):
     def __init__(self):
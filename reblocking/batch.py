@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import sys
+from engine import reblock_model
+from model_io import is_model, memory_report
+
+# Keys of the config file, the same ones the wizard fills in
+REQUIRED_KEYS = ['input', 'output', 'X', 'Y', 'Z', 'dx', 'dy', 'dz', 'rdx', 'rdy', 'rdz']
+OPTIONAL_KEYS = {'sum': [], 'mean': [], 'p_mean': [], 'pounder': None}
+
+def load_config(path):
+    with open(path, 'r') as file:
+        config = json.load(file)
+    for key, default in OPTIONAL_KEYS.items():
+        config.setdefault(key, default)
+    return config
+
+def check_config(config):
+    missing = [key for key in REQUIRED_KEYS if key not in config]
+    if missing:
+        raise ValueError(f'Missing keys in the reblocking config: {", ".join(missing)}')
+    if config['p_mean'] and not config['pounder']:
+        raise ValueError('A pounder column is required for the weighted mean columns.')
+
+# Reblock a single model file
+def reblock_file(config, input_file, output_file):
+    config = dict(config, input=input_file, output=output_file, df=None)
+    reblock_model(config)
+    if config['df'] is not None:
+        print(f'{input_file}: {memory_report(config["df"])}')
+
+# Reblock the model in config['input'] into config['output'], or, when the input is a directory,
+# every model in it into the output directory under the same names (and so in the same formats)
+def reblock_batch(config):
+    check_config(config)
+    # a .npy bundle is a directory too, but a single model
+    if not os.path.isdir(config['input']) or is_model(config['input']):
+        reblock_file(config, config['input'], config['output'])
+        return [config['output']]
+
+    os.makedirs(config['output'], exist_ok=True)
+    outputs = []
+    for name in sorted(os.listdir(config['input'])):
+        if is_model(name):
+            output_file = os.path.join(config['output'], name)
+            reblock_file(config, os.path.join(config['input'], name), output_file)
+            print(f'{name} reblocked.')
+            outputs.append(output_file)
+    return outputs
+
+# Parent block size given as RDXxRDYxRDZ, e.g. 20x20x10
+def parse_size(text):
+    try:
+        size = [float(value) for value in text.lower().split('x')]
+    except ValueError:
+        size = []
+    if len(size) != 3:
+        raise argparse.ArgumentTypeError(f'Invalid parent block size: {text}')
+    return size
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reblock block models from a JSON config file, without the wizard.')
+    parser.add_argument('config', help='JSON file with the wizard keys (X, Y, Z, dx, dy, dz, rdx, rdy, rdz, sum, mean, '
+                                       'p_mean, pounder, input, output) and optionally min, max, count, mode, '
+                                       'mode_weight, percentiles ({column: [q, ...]}), percentile_range, '
+                                       'size_columns ([dx, dy, dz] columns of sub-blocked models), percent, '
+                                       'engine, chunksize, workers, dense, float32, int32 and sizes')
+    parser.add_argument('--input', help='model file (.csv, .parquet, .feather or .npy bundle) or directory of models, '
+                                        'overrides the config')
+    parser.add_argument('--output', help='output file or directory, overrides the config')
+    parser.add_argument('--engine', help='reblocking engine, overrides the config')
+    parser.add_argument('--workers', type=int, help='worker processes of the parallel engine')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, help='parent block sizes to sweep in one pass, as '
+                                                                    'RDXxRDYxRDZ; each is written to the output name '
+                                                                    'with the size appended')
+    args = parser.parse_args(argv)
+
+    config = load_config(args.config)
+    for key in ['input', 'output', 'engine', 'workers', 'sizes']:
+        if getattr(args, key) is not None:
+            config[key] = getattr(args, key)
+    try:
+        reblock_batch(config)
+    except (ValueError, OSError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from engine import ENGINES, load_model
+from model_io import write_model
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, the peak memory is not measured there
+    resource = None
+
+# Size of the synthetic blocks and of the parent blocks they are reblocked to
+BLOCK_SIZE = (10.0, 10.0, 5.0)
+PARENT_SIZE = (20.0, 20.0, 10.0)
+
+# Extension of the input and output model of each format
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather', 'npy': '.npy'}
+
+# A case of the comparison is reported as a regression when it is slower than this fraction over the previous run
+TOLERANCE = 0.2
+
+# Seconds between two samples of the memory of a case and its worker processes
+SAMPLE_INTERVAL = 0.05
+
+# Fields identifying a case, to match it between two result files
+CASE_KEYS = ('blocks', 'attributes', 'sparsity', 'shape', 'engine', 'format')
+
+# Grid shape (nx, ny, nz), twice as wide as high, with at least cells cells
+def grid_shape(cells):
+    nz = max(1, round((cells / 4) ** (1 / 3)))
+    nx = max(1, math.ceil(math.sqrt(cells / nz)))
+    return nx, max(1, math.ceil(cells / (nx * nz))), nz
+
+# Synthetic block model of the given number of blocks, taken at random from a regular grid of the given shape, or
+# of a shape with blocks / (1 - sparsity) cells. It has the coordinates, a tonnage and lognormal grades a0, a1, ...
+def synthetic_model(blocks, attributes=10, sparsity=0.0, shape=None, seed=0):
+    rng = np.random.default_rng(seed)
+    shape = tuple(shape) if shape else grid_shape(math.ceil(blocks / (1 - sparsity)))
+    cells = math.prod(shape)
+    if blocks > cells:
+        raise ValueError(f'{blocks} blocks do not fit in a {"x".join(map(str, shape))} grid.')
+    picks = np.arange(blocks) if blocks == cells else np.sort(rng.choice(cells, blocks, replace=False))
+    indices = np.unravel_index(picks, shape)
+    model = pd.DataFrame({
+        axis: index * size + size / 2 for axis, index, size in zip('XYZ', indices, BLOCK_SIZE)
+    })
+    model['ton'] = math.prod(BLOCK_SIZE) * rng.uniform(2.5, 3.0, blocks)
+    for attribute in range(attributes):
+        model[f'a{attribute}'] = rng.lognormal(0.0, 1.0, blocks)
+    return model
+
+# Reblocking config of a synthetic model: the tonnage is summed, even grades averaged and odd ones weighted by it
+def synthetic_config(model, engine, input_file, output_file):
+    grades = [column for column in model.columns if column.startswith('a')]
+    return {
+        'df': None, 'input': input_file, 'output': output_file, 'engine': engine,
+        'X': 'X', 'Y': 'Y', 'Z': 'Z',
+        'dx': BLOCK_SIZE[0], 'dy': BLOCK_SIZE[1], 'dz': BLOCK_SIZE[2],
+        'rdx': PARENT_SIZE[0], 'rdy': PARENT_SIZE[1], 'rdz': PARENT_SIZE[2],
+        'sum': ['ton'], 'mean': grades[0::2], 'p_mean': grades[1::2], 'pounder': 'ton',
+    }
+
+# Peak resident memory in MB of the largest of this process and its finished children (the parallel engine
+# workers): the peak of each is kept by the system, not the peak of their sum
+def largest_process_rss():
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+# Resident memory in bytes of a process and of its children, read from /proc, or None where there is no /proc
+def process_tree_rss(pid):
+    try:
+        entries = [entry for entry in os.listdir('/proc') if entry.isdigit()]
+    except OSError:
+        return None
+    total = 0
+    for entry in entries:
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as file:
+                # the fields after the command name, which is in parentheses; the parent process id is the second
+                parent = int(file.read().rsplit(')', 1)[1].split()[1])
+            if int(entry) == pid or parent == pid:
+                with open(f'/proc/{entry}/statm', 'r') as file:
+                    total += int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            # a process that ended while it was read
+            continue
+    return total
+
+# Peak resident memory in MB of this process plus its worker processes, sampled every SAMPLE_INTERVAL seconds in
+# a thread while the case runs; None where there is no /proc. Peaks shorter than the interval can be missed, and
+# pages shared between the processes (the shared slabs of the parallel engine) count once per process
+class MemorySampler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        rss = process_tree_rss(os.getpid())
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss / 2 ** 20)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+# Time the load, reblock and save steps of one reblocking; the chunked engine streams the model, so its load time
+# is part of the reblock one
+def run_case(config):
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        if config['engine'] != 'chunked':
+            load_model(config)
+        loaded = time.perf_counter()
+        reblocked_model = ENGINES[config['engine']](config)
+        reblocked = time.perf_counter()
+        write_model(reblocked_model, config['output'])
+        saved = time.perf_counter()
+    largest = largest_process_rss()
+    return {
+        'load_s': loaded - start,
+        'reblock_s': reblocked - loaded,
+        'save_s': saved - reblocked,
+        'parent_blocks': len(reblocked_model),
+        # the total is at least the peak of the largest process, which a sample may have missed
+        'peak_rss_mb': max(memory.peak, largest) if memory.peak is not None and largest is not None else memory.peak,
+        'largest_process_rss_mb': largest,
+    }
+
+# Run every engine on every format of one synthetic model; each case runs in a fresh process, so that its peak
+# memory is its own
+def benchmark_model(blocks, attributes, sparsity, shape, engines, formats, workdir, workers=None):
+    model = synthetic_model(blocks, attributes, sparsity, shape)
+    case = {'blocks': blocks, 'attributes': attributes, 'sparsity': sparsity,
+            'shape': list(shape) if shape else None}
+    results = []
+    for file_format in formats:
+        input_file = os.path.join(workdir, f'model{EXTENSIONS[file_format]}')
+        write_model(model, input_file)
+        for engine in engines:
+            config = synthetic_config(model, engine, input_file,
+                                      os.path.join(workdir, f'reblocked_{engine}{EXTENSIONS[file_format]}'))
+            if workers:
+                config['workers'] = workers
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_case, config).result()
+            result = {**case, 'engine': engine, 'format': file_format, **result}
+            result['blocks_per_s'] = blocks / (result['load_s'] + result['reblock_s'])
+            print(f'{blocks} blocks, {file_format}, {engine}: load {result["load_s"]:.2f} s, '
+                  f'reblock {result["reblock_s"]:.2f} s, save {result["save_s"]:.2f} s, '
+                  f'peak {result["peak_rss_mb"] or 0:.0f} MB with the workers, '
+                  f'{result["largest_process_rss_mb"] or 0:.0f} MB in the largest process')
+            results.append(result)
+    return results
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def case_key(result):
+    return tuple(json.dumps(result.get(key)) for key in CASE_KEYS)
+
+# Print the load plus reblock time of each case against a previous run; returns the cases slower than the tolerance
+def compare_results(results, previous, tolerance=TOLERANCE):
+    previous_cases = {case_key(result): result for result in previous['results']}
+    regressions = []
+    for result in results:
+        before = previous_cases.get(case_key(result))
+        if before is None:
+            continue
+        elapsed = result['load_s'] + result['reblock_s']
+        elapsed_before = before['load_s'] + before['reblock_s']
+        ratio = elapsed / elapsed_before if elapsed_before > 0 else math.inf
+        print(f'{result["blocks"]} blocks, {result["format"]}, {result["engine"]}: {elapsed_before:.2f} s -> '
+              f'{elapsed:.2f} s ({ratio:.2f}x)')
+        if ratio > 1 + tolerance:
+            regressions.append(result)
+    return regressions
+
+# Grid shape given as NXxNYxNZ, e.g. 200x200x50
+def parse_shape(text):
+    try:
+        shape = [int(value) for value in text.lower().split('x')]
+    except ValueError:
+        shape = []
+    if len(shape) != 3 or min(shape) < 1:
+        raise argparse.ArgumentTypeError(f'Invalid grid shape: {text}')
+    return shape
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the reblocking of synthetic block models per engine and format.')
+    parser.add_argument('--blocks', nargs='+', type=int, default=[1_000_000],
+                        help='block counts of the models, e.g. 1000000 10000000 50000000')
+    parser.add_argument('--attributes', type=int, default=10, help='grade columns of the models')
+    parser.add_argument('--sparsity', type=float, default=0.0, help='fraction of the grid without blocks')
+    parser.add_argument('--shape', type=parse_shape, help='grid shape as NXxNYxNZ, instead of one fitted to the '
+                                                          'blocks and sparsity')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--formats', nargs='+', choices=list(EXTENSIONS), default=list(EXTENSIONS))
+    parser.add_argument('--workers', type=int, help='worker processes of the parallel engine')
+    parser.add_argument('--workdir', help='directory for the model files, a temporary one by default')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='slowdown over the previous run '
+                                                                           'reported as a regression')
+    args = parser.parse_args(argv)
+    if not 0 <= args.sparsity < 1:
+        parser.error('--sparsity must be in [0, 1).')
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for blocks in args.blocks:
+            results += benchmark_model(blocks, args.attributes, args.sparsity, args.shape, args.engines,
+                                       args.formats, workdir, args.workers)
+    with open(args.output, 'w') as file:
+        json.dump({'environment': environment(), 'results': results}, file, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            regressions = compare_results(results, json.load(file), args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} cases slower than {args.tolerance:.0%} over the previous run.', file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
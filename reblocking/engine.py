@@ -0,0 +1,1064 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from model_io import iter_model, read_compact, write_model
+
+# Block corners closer than this fraction of a parent block to a parent boundary are snapped onto it,
+# so floating-point error in the coordinates cannot split one parent block into two
+SNAP = 1e-6
+
+# While the bounding grid has at most this many parent cells per input block, the keys are reduced
+# with a direct bincount over the grid (linear time); sparser models go through a sort instead
+DENSE_CELLS_PER_BLOCK = 4
+
+# Rows read at a time by the chunked engine
+CHUNKSIZE = 1_000_000
+
+# Default number of slabs per worker process of the parallel engine, to even out slabs of unequal size
+SLABS_PER_WORKER = 2
+
+# coordinate column, block size and parent block size keys of the config for each axis
+AXES = (('X', 'dx', 'rdx'), ('Y', 'dy', 'rdy'), ('Z', 'dz', 'rdz'))
+
+# Default number of histogram bins per parent block of the columns with percentiles in the chunked engine, which
+# cannot sort a model it does not hold (the other engines give exact percentiles). Each percentile is within one bin,
+# (max - min) / bins of the column over the whole model, of the two values the exact one is interpolated between, so
+# skewed grades crowded in the low bins lose most of it; and each bin is a float64 field, 8 * bins bytes per parent
+# block and column
+PERCENTILE_BINS = 100
+
+# Aggregations besides sum, mean and p_mean, only done by the key-based engines
+EXTENDED_KEYS = ('min', 'max', 'count', 'mode', 'percentiles')
+
+# The grid engine reblocks a regular model on dense 3D arrays when it fills at least this fraction of its
+# bounding grid, and only does the aggregations below there; other models go through the keys
+DENSE_FILL = 0.5
+DENSE_KEYS = ('min', 'max', 'count', 'percentiles')
+
+# Phases of a reblocking reported to config['progress'], in order
+PHASES = ('load', 'keys', 'aggregate', 'write')
+
+# Raised by a progress callback to stop the reblocking at the next phase or chunk
+class ReblockingCancelled(Exception):
+    pass
+
+# Report the start of a phase to config['progress'], a callable taking the phase and the number of blocks read so
+# far (None when it did not change); the callback may raise ReblockingCancelled
+def report(config, phase, blocks=None):
+    if config.get('progress'):
+        config['progress'](phase, blocks)
+
+# Reblocking grouping on the float parent coordinates
+def reblock_groupby(config):
+    block_model = config['df']
+    report(config, 'aggregate', len(block_model))
+    # calculate the block coordinates in the new grid from the block origins, set to the new block centroids;
+    # the model itself is left untouched
+    keys = []
+    for key, (axis, size, parent_size) in zip(['rx', 'ry', 'rz'], AXES):
+        origins = block_model[config[axis]] - config[size] / 2
+        keys.append(((origins // config[parent_size]) * config[parent_size] + config[parent_size] / 2).rename(key))
+
+    # Group by the reblocked coordinates and calculate reblocked values for each block in each column
+    aggregations = {
+        **{column: 'sum'
+           for column in config['sum']},
+        **{column: 'mean'
+           for column in config['mean']},
+    }
+    reblocked_parts = []
+    if aggregations:
+        reblocked_parts.append(block_model.groupby(keys).agg(aggregations))
+    if config['p_mean']:
+        # weighted mean = sum(value * weight) / sum(weight); the products are built once for all
+        # columns and summed per block together with the weight in a single grouped pass
+        weight = block_model[config['pounder']]
+        weighted_sums = block_model[config['p_mean']].mul(weight, axis=0)
+        weighted_sums.columns = [f'{column}*w' for column in config['p_mean']]
+        weighted_sums['w'] = weight
+        weighted_sums = weighted_sums.groupby(keys).sum()
+        weight_sums = weighted_sums.pop('w')
+        weighted_sums.columns = config['p_mean']
+        reblocked_parts.append(weighted_sums.div(weight_sums, axis=0))
+    reblocked_model = pd.concat(reblocked_parts, axis=1).reset_index()
+    # rename reblocked coordinates
+    reblocked_model.rename(columns={'rx': 'X', 'ry': 'Y', 'rz': 'Z'}, inplace=True)
+    return reblocked_model
+
+# Integer index of the parent block holding each block along one axis, computed in place in the float64
+# buffer and written to out when they are given
+def grid_index(coordinates, block_size, parent_size, origin=0.0, buffer=None, out=None):
+    corners = np.subtract(coordinates, block_size / 2, out=buffer)
+    corners -= origin
+    corners /= parent_size
+    corners += SNAP
+    np.floor(corners, out=corners)
+    if out is None:
+        return corners.astype(np.int64)
+    out[...] = corners
+    return out
+
+# Centroid coordinates of the parent blocks with the given indices along one axis
+def grid_coordinates(index, parent_size, origin=0.0):
+    return index * parent_size + parent_size / 2 + origin
+
+# Pack (i, j, k) indices into single int64 keys that sort in the same order as (i, j, k)
+def pack_keys(i, j, k):
+    low = (i.min(), j.min(), k.min())
+    shape = (int(i.max() - low[0]) + 1, int(j.max() - low[1]) + 1, int(k.max() - low[2]) + 1)
+    keys = np.ravel_multi_index((i - low[0], j - low[1], k - low[2]), shape)
+    return keys, low, shape
+
+def unpack_keys(keys, low, shape):
+    i, j, k = np.unravel_index(keys, shape)
+    return i + low[0], j + low[1], k + low[2]
+
+# Segment id (0..cells-1, in key order) of each key, and the sorted keys of the occupied cells; the ids are
+# written to the scratch buffers when given
+def segment_ids(keys, shape, scratch=None):
+    cells = shape[0] * shape[1] * shape[2]
+    if cells > DENSE_CELLS_PER_BLOCK * len(keys):
+        occupied_keys, ids = np.unique(keys, return_inverse=True)
+        return ids, occupied_keys
+    lookup = np.bincount(keys, minlength=cells)
+    occupied_keys = np.flatnonzero(lookup)
+    occupied = lookup > 0 if scratch is None else np.greater(lookup, 0, out=scratch.cell_mask(cells))
+    np.cumsum(occupied, out=lookup)
+    lookup -= 1
+    # keys are always in range, 'clip' lets take write straight into the output buffer
+    return np.take(lookup, keys, out=None if scratch is None else scratch.ids[:len(keys)], mode='clip'), occupied_keys
+
+# Minimum (np.fmin) or maximum (np.fmax) of the values of each segment, skipping NaN like pandas does
+def segment_extreme(function, ids, values, segments):
+    extremes = np.full(segments, np.nan)
+    function.at(extremes, ids, values)
+    return np.rint(extremes).astype(np.int64) if values.dtype.kind in 'biu' else extremes
+
+# Sum of the values of each segment, skipping NaN like pandas does
+def segment_sum(ids, values, segments):
+    values = np.asarray(values)
+    integer = values.dtype.kind in 'biu'
+    values = values.astype(np.float64, copy=False)
+    missing = np.isnan(values)
+    if missing.any():
+        values = np.where(missing, 0.0, values)
+    sums = np.bincount(ids, weights=values, minlength=segments)
+    return np.rint(sums).astype(np.int64) if integer else sums
+
+# Work arrays reused between reblocking runs, so the same model can be reblocked many times (e.g. at several
+# parent sizes) with a flat memory footprint; pass one as config['scratch'], it grows when a bigger model comes
+class Scratch:
+    def __init__(self, size=0):
+        self.size = size
+        self.real = np.empty(size, dtype=np.float64)
+        self.weight = np.empty(size, dtype=np.float64)
+        self.index = np.empty(size, dtype=np.int64)
+        self.keys = np.empty(size, dtype=np.int64)
+        self.ids = np.empty(size, dtype=np.int64)
+        self.mask = np.empty(size, dtype=bool)
+        # occupancy of the parent cells, which can outnumber the blocks
+        self.cells = np.empty(0, dtype=bool)
+
+    def reserve(self, size):
+        if size > self.size:
+            self.__init__(size)
+        return self
+
+    def cell_mask(self, cells):
+        if cells > len(self.cells):
+            self.cells = np.empty(cells, dtype=bool)
+        return self.cells[:cells]
+
+# Values as float64 in the buffer with missing values zeroed, so that sums skip them; mask flags the missing ones
+def fill_buffer(buffer, mask, values):
+    np.copyto(buffer, values)
+    np.isnan(buffer, out=mask)
+    np.copyto(buffer, 0.0, where=mask)
+    return buffer
+
+def scratch_sum(ids, values, segments, scratch):
+    n = len(ids)
+    sums = np.bincount(ids, weights=fill_buffer(scratch.real[:n], scratch.mask[:n], values), minlength=segments)
+    return np.rint(sums).astype(np.int64) if values.dtype.kind in 'biu' else sums
+
+# Values of a column as a NumPy array; empty chunks of a CSV come with object columns, read as float64
+def column_values(block_model, column):
+    values = block_model[column].to_numpy()
+    return values.astype(np.float64) if values.dtype.kind == 'O' else values
+
+# Label tables of the mode columns, kept in config['mode_labels'] as {column: Index of its values}
+def mode_tables(config):
+    return config.setdefault('mode_labels', {})
+
+# Codes of the values of a mode column in its label table, and the table: the values are factorized against it and
+# the ones new to it are appended, so every chunk or slab of the model gives a value the same code whatever its dtype
+# there (1 and 1.0 are one value), and the values are kept as they are (a rock code '001' stays '001'). Missing
+# values have code -1
+def mode_codes(block_model, config, column):
+    codes, uniques = pd.factorize(block_model[column])
+    labels = mode_tables(config).get(column, pd.Index([], dtype=object))
+    if len(uniques) == 0:
+        return codes, labels
+    uniques = pd.Index(np.asarray(uniques), dtype=object)
+    positions = labels.get_indexer(uniques)
+    new = positions < 0
+    if new.any():
+        positions[new] = np.arange(len(labels), len(labels) + np.count_nonzero(new))
+        labels = labels.append(uniques[new])
+        mode_tables(config)[column] = labels
+    return np.where(codes < 0, -1, positions[codes]), labels
+
+# Fill the label tables from a whole model, before it is split between worker processes, which could not add to them
+def fill_mode_tables(block_model, config):
+    for column in config.get('mode', []):
+        mode_codes(block_model, config, column)
+
+# Weight of every value of a mode column per segment: one field per code of its label table, named
+# mode:{column}:{code}, holding the sum of config['mode_weight'] (e.g. tonnage) over its blocks, or their count
+# (volume, for split blocks) without a weight column
+def partial_modes(block_model, config, column, ids, segments, scratch, shares=None, volumes=None):
+    n = len(ids)
+    codes, labels = mode_codes(block_model, config, column)
+    if len(labels) == 0:
+        return {}
+    weight = scratch.weight[:n]
+    if config.get('mode_weight'):
+        fill_buffer(weight, scratch.mask[:n], column_values(block_model, config['mode_weight']))
+        if shares is not None:
+            weight *= shares
+    elif volumes is not None:
+        np.copyto(weight, volumes)
+    else:
+        weight.fill(1.0)
+    # missing values have code -1
+    np.copyto(weight, 0.0, where=codes < 0)
+    cells = np.multiply(ids, len(labels), out=scratch.index[:n])
+    cells += codes
+    np.copyto(cells, 0, where=codes < 0)
+    weights = np.bincount(cells, weights=weight, minlength=segments * len(labels)).reshape(segments, len(labels))
+    return {f'mode:{column}:{code}': weights[:, code] for code in range(len(labels))}
+
+# Histogram of a percentile column per segment over the range in config['percentile_range'], one field per bin;
+# split blocks count by volume
+def partial_histogram(block_model, config, column, ids, segments, scratch, volumes=None):
+    n = len(ids)
+    bins = config.get('percentile_bins', PERCENTILE_BINS)
+    low, high = config['percentile_range'][column]
+    real, mask = scratch.real[:n], scratch.mask[:n]
+    fill_buffer(real, mask, column_values(block_model, column))
+    real -= low
+    real *= bins / (high - low) if high > low else 0.0
+    np.clip(real, 0, bins - 1, out=real)
+    np.floor(real, out=real)
+    cells = np.multiply(ids, bins, out=scratch.index[:n])
+    np.add(cells, real, out=cells, casting='unsafe')
+    np.logical_not(mask, out=mask)
+    np.copyto(real, mask)
+    if volumes is not None:
+        real *= volumes
+    counts = np.bincount(cells, weights=real, minlength=segments * bins).reshape(segments, bins)
+    return {f'hist:{column}:{index}': counts[:, index] for index in range(bins)}
+
+# Partial aggregates of the configured columns per segment, all additive except min and max: sums for 'sum' and
+# 'mean', non-missing counts for 'mean' and 'count', sum(value * weight) and sum(weight) for 'p_mean', weights per
+# value for 'mode' and exact 'percentiles', or histograms of them when config['histograms'] is set (chunked engine).
+# For pieces of split blocks, shares is the fraction of its block each one holds, which scales the 'sum' columns and the
+# weights, and volumes its volume, which weights the means, so that they are volume-weighted
+def partial_sums(block_model, config, ids, segments, scratch, shares=None, volumes=None):
+    n = len(ids)
+    real, mask = scratch.real[:n], scratch.mask[:n]
+    partials = {}
+    for column in config['sum'] + config['mean']:
+        values = column_values(block_model, column)
+        scale = shares if column in config['sum'] else volumes
+        if scale is not None:
+            values = np.multiply(values, scale, out=real)
+        partials[f'sum:{column}'] = scratch_sum(ids, values, segments, scratch)
+    for column in dict.fromkeys(config['mean'] + config.get('count', [])):
+        fill_buffer(real, mask, column_values(block_model, column))
+        np.logical_not(mask, out=mask)
+        np.copyto(real, mask)
+        if column in config.get('count', []):
+            partials[f'count:{column}'] = np.bincount(ids, weights=real, minlength=segments)
+        if column in config['mean']:
+            if volumes is not None:
+                real *= volumes
+            partials[f'n:{column}'] = np.bincount(ids, weights=real, minlength=segments)
+    if config['p_mean']:
+        weight = scratch.weight[:n]
+        np.copyto(weight, column_values(block_model, config['pounder']))
+        if shares is not None:
+            weight *= shares
+        partials['w'] = scratch_sum(ids, weight, segments, scratch)
+        for column in config['p_mean']:
+            np.multiply(column_values(block_model, column), weight, out=real)
+            partials[f'wsum:{column}'] = scratch_sum(ids, real, segments, scratch)
+    for column in config.get('min', []):
+        partials[f'min:{column}'] = segment_extreme(np.fmin, ids, column_values(block_model, column), segments)
+    for column in config.get('max', []):
+        partials[f'max:{column}'] = segment_extreme(np.fmax, ids, column_values(block_model, column), segments)
+    for column in config.get('mode', []):
+        partials.update(partial_modes(block_model, config, column, ids, segments, scratch, shares, volumes))
+    for column, quantiles in config.get('percentiles', {}).items():
+        if config.get('histograms'):
+            partials.update(partial_histogram(block_model, config, column, ids, segments, scratch, volumes))
+        else:
+            partials.update(partial_percentiles(block_model, column, quantiles, ids, segments, volumes))
+    return partials
+
+# Value of each row with the largest weight in the mode fields of a column; rows without weight get no value
+def finalize_mode(partials, config, column, segments):
+    labels = mode_tables(config).get(column, pd.Index([], dtype=object))
+    if len(labels) == 0:
+        return np.full(segments, None, dtype=object)
+    # codes added after some chunks have no field in their partials, nor weight
+    weights = np.zeros((segments, len(labels)))
+    for code in range(len(labels)):
+        if f'mode:{column}:{code}' in partials:
+            weights[:, code] = np.nan_to_num(partials[f'mode:{column}:{code}'])
+    modes = pd.Series(labels.to_numpy()[weights.argmax(axis=1)])
+    return modes.where(weights.max(axis=1) > 0).infer_objects().to_numpy()
+
+# Percentiles q (0-100) of each row from the histogram fields of a column, interpolated inside their bin (see
+# PERCENTILE_BINS for their error)
+def finalize_percentiles(partials, column, config, quantiles):
+    bins = config.get('percentile_bins', PERCENTILE_BINS)
+    low, high = config['percentile_range'][column]
+    counts = np.nan_to_num(np.column_stack([partials[f'hist:{column}:{index}'] for index in range(bins)]))
+    cumulative = np.cumsum(counts, axis=1)
+    rows = np.arange(len(counts))
+    values = {}
+    for q in quantiles:
+        target = cumulative[:, -1] * q / 100
+        # first non-empty bin reaching the target
+        bin_index = ((cumulative >= target[:, None]) & (counts > 0)).argmax(axis=1)
+        bin_count = counts[rows, bin_index]
+        fraction = np.clip((target - cumulative[rows, bin_index] + bin_count) / bin_count, 0, 1)
+        value = low + (bin_index + fraction) * (high - low) / bins
+        values[f'{column}_p{q:g}'] = np.where(cumulative[:, -1] > 0, value, np.nan)
+    return values
+
+# Reblocked values from the partial aggregates
+def finalize(partials, config):
+    values = {}
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for column in config['sum']:
+            values[column] = partials[f'sum:{column}']
+        for column in config['mean']:
+            values[column] = partials[f'sum:{column}'] / partials[f'n:{column}']
+        for column in config['p_mean']:
+            values[column] = partials[f'wsum:{column}'] / partials['w']
+        for column in config.get('min', []):
+            values[f'{column}_min'] = partials[f'min:{column}']
+        for column in config.get('max', []):
+            values[f'{column}_max'] = partials[f'max:{column}']
+        for column in config.get('count', []):
+            values[f'{column}_count'] = np.rint(partials[f'count:{column}']).astype(np.int64)
+        for column in config.get('mode', []):
+            values[column] = finalize_mode(partials, config, column, len(partials['i']))
+        for column, quantiles in config.get('percentiles', {}).items():
+            if f'hist:{column}:0' in partials:
+                values.update(finalize_percentiles(partials, column, config, quantiles))
+            else:
+                values.update({f'{column}_p{q:g}': partials[f'pct:{column}:{q:g}'] for q in quantiles})
+    return values
+
+# Percentile q (0-100) of each segment of sorted values, given by its start and count, interpolated between the two
+# nearest values as pandas quantile does; empty segments get NaN
+def sorted_percentile(values, starts, counts, q):
+    position = (counts - 1) * (q / 100)
+    lower = np.floor(position)
+    low = np.clip(starts + lower.astype(np.int64), 0, len(values) - 1)
+    high = np.minimum(low + 1, np.clip(starts + counts - 1, 0, len(values) - 1))
+    value = values[low] + (values[high] - values[low]) * (position - lower)
+    return np.where(counts > 0, value, np.nan)
+
+# Percentiles q (0-100) of the values of each segment, from one sort of the values by segment and value. Without
+# weights they are interpolated as pandas quantile does; with weights (the volumes of the pieces of split blocks)
+# each is the first value whose cumulative weight reaches q% of its segment's
+def segment_percentiles(ids, values, segments, quantiles, weights=None):
+    present = ~np.isnan(values)
+    ids, values = ids[present], values[present]
+    if len(values) == 0:
+        return [np.full(segments, np.nan) for _ in quantiles]
+    order = np.lexsort((values, ids))
+    ids, values = ids[order], values[order]
+    counts = np.bincount(ids, minlength=segments)
+    starts = np.cumsum(counts) - counts
+    if weights is None:
+        return [sorted_percentile(values, starts, counts, q) for q in quantiles]
+    lasts = np.clip(starts + counts - 1, 0, len(values) - 1)
+    weights = weights[present][order]
+    cumulative = np.cumsum(weights)
+    before = np.concatenate(([0.0], cumulative))[np.minimum(starts, len(values))]
+    totals = np.bincount(ids, weights=weights, minlength=segments)
+    percentiles = []
+    for q in quantiles:
+        index = np.searchsorted(cumulative, before + totals * (q / 100), side='left')
+        value = values[np.clip(index, np.minimum(starts, lasts), lasts)]
+        percentiles.append(np.where(counts > 0, value, np.nan))
+    return percentiles
+
+# Exact percentiles of a column per segment, one field per percentile named pct:{column}:{q}; the pieces of split
+# blocks weigh by their volume
+def partial_percentiles(block_model, column, quantiles, ids, segments, volumes=None):
+    values = column_values(block_model, column).astype(np.float64, copy=False)
+    percentiles = segment_percentiles(ids, values, segments, quantiles, volumes)
+    return {f'pct:{column}:{q:g}': values for q, values in zip(quantiles, percentiles)}
+
+# Columns of the model read by the reblocking
+def used_columns(config):
+    columns = [config['X'], config['Y'], config['Z'], *config['sum'], *config['mean'], *config['p_mean']]
+    if config['p_mean']:
+        columns.append(config['pounder'])
+    for key in EXTENDED_KEYS:
+        columns.extend(config.get(key, []))
+    if config.get('mode') and config.get('mode_weight'):
+        columns.append(config['mode_weight'])
+    columns.extend(config.get('size_columns') or [])
+    if config.get('percent'):
+        columns.append(config['percent'])
+    return list(dict.fromkeys(columns))
+
+# Range of the histogram of each column with percentiles, from config['percentile_range'] or else the finite
+# values of the column; it is stored in the config, so every part of the model is binned alike. Without a
+# loaded model, those columns alone are read once
+def percentile_ranges(config):
+    if not config.get('percentiles'):
+        return {}
+    ranges = config.setdefault('percentile_range', {})
+    missing = [column for column in config.get('percentiles', {}) if column not in ranges]
+    if not missing:
+        return ranges
+    if config.get('df') is not None:
+        chunks = [config['df'][missing]]
+    else:
+        chunks = iter_model(config['input'], missing, config.get('chunksize', CHUNKSIZE))
+    low, high = np.full(len(missing), np.inf), np.full(len(missing), -np.inf)
+    for chunk in chunks:
+        values = chunk.to_numpy(np.float64)
+        finite = np.isfinite(values)
+        low = np.minimum(low, np.where(finite, values, np.inf).min(axis=0, initial=np.inf))
+        high = np.maximum(high, np.where(finite, values, -np.inf).max(axis=0, initial=-np.inf))
+    for column, column_low, column_high in zip(missing, low, high):
+        ranges[column] = (float(column_low), float(column_high)) if column_low <= column_high else (0.0, 0.0)
+    return ranges
+
+# Load the columns of config['input'] used by the reblocking into config['df'], with compact dtypes (float32 if
+# config['float32'] is set, int32 if config['int32'] is set); coordinates stay float64
+def load_model(config):
+    config['df'] = read_compact(config['input'], used_columns(config), keep=[config['X'], config['Y'], config['Z']],
+                                float32=config.get('float32', False), int32=config.get('int32', False))
+    return config['df']
+
+# Coordinates of the blocks as float64 views; blocks without coordinates are dropped, as groupby does
+def block_coordinates(block_model, config):
+    coordinates = [block_model[config[axis]].to_numpy(np.float64) for axis, _, _ in AXES]
+    # a sum is only finite if every coordinate is, so the check needs no full-length mask
+    if not np.isfinite(sum(values.sum() for values in coordinates)):
+        valid = np.isfinite(coordinates[0]) & np.isfinite(coordinates[1]) & np.isfinite(coordinates[2])
+        block_model = block_model[valid]
+        coordinates = [values[valid] for values in coordinates]
+    return block_model, coordinates
+
+# Packed parent keys of the blocks, computed axis by axis in the scratch buffers without touching the model
+def block_keys(coordinates, config, scratch):
+    n = len(coordinates[0])
+    origin = config.get('origin', (0.0, 0.0, 0.0))
+    index, keys = scratch.index[:n], scratch.keys[:n]
+    low, shape = [], []
+    for axis, (values, (_, size, parent_size), offset) in enumerate(zip(coordinates, AXES, origin)):
+        grid_index(values, config[size], config[parent_size], offset, buffer=scratch.real[:n], out=index)
+        low.append(index.min())
+        shape.append(int(index.max() - low[-1]) + 1)
+        if math.prod(shape) >= 2 ** 63:
+            raise ValueError('The reblocked grid is too large to be indexed.')
+        index -= low[-1]
+        if axis == 0:
+            keys[:] = index
+        else:
+            keys *= shape[-1]
+            keys += index
+    return keys, tuple(low), tuple(shape)
+
+# Segment id of each entry in its parent block, and the indices of the occupied parent blocks in (i, j, k) order
+def group_cells(i, j, k):
+    if len(i) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, (empty, empty, empty)
+    keys, low, shape = pack_keys(i, j, k)
+    ids, occupied = segment_ids(keys, shape)
+    return ids, unpack_keys(occupied, low, shape)
+
+def partials_frame(cells, partials):
+    return pd.DataFrame({'i': cells[0], 'j': cells[1], 'k': cells[2], **partials})
+
+# Whether the blocks are split between the parent blocks they overlap: sub-blocked models, with a size per block
+# in config['size_columns'] (three columns, for X, Y and Z), and models with a partial block percentage column
+# in config['percent']
+def splits_blocks(config):
+    return bool(config.get('size_columns') or config.get('percent'))
+
+# Size of the blocks along each axis: a column per axis for sub-blocked models, else the config block size
+def block_sizes(block_model, config):
+    if config.get('size_columns'):
+        return [block_model[column].to_numpy(np.float64) for column in config['size_columns']]
+    return [config[size] for _, size, _ in AXES]
+
+# Pieces of the blocks in the parent blocks they overlap: the row of the block of each piece (None when no block
+# straddles a parent boundary, so every block is one piece), its parent indices (i, j, k), the share of its block
+# it holds and its volume. The shares of a block add up to one, so sums over the pieces keep the tonnage and metal
+# of the model. A partial block percentage only scales the volumes, which weight the means: the tonnage and other
+# sums of a partial block are taken to be its partial ones already
+def split_blocks(block_model, config):
+    origin = config.get('origin', (0.0, 0.0, 0.0))
+    n = len(block_model)
+    coordinates = [block_model[config[axis]].to_numpy(np.float64) for axis, _, _ in AXES]
+    sizes = block_sizes(block_model, config)
+    lows, highs, firsts, counts = [], [], [], []
+    for values, size, (_, _, parent_size), offset in zip(coordinates, sizes, AXES, origin):
+        low = (values - size / 2 - offset) / config[parent_size]
+        high = (values + size / 2 - offset) / config[parent_size]
+        first = np.floor(low + SNAP).astype(np.int64)
+        lows.append(low)
+        highs.append(high)
+        firsts.append(first)
+        counts.append(np.maximum(np.floor(high - SNAP).astype(np.int64) - first, 0) + 1)
+    pieces = counts[0] * counts[1] * counts[2]
+    rows = None
+    if pieces.sum() > n:
+        rows = np.repeat(np.arange(n), pieces)
+        # index of each piece in its block, unravelled over the pieces of the block along each axis, Z fastest
+        local = np.arange(len(rows)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        lows, highs, firsts, counts = ([values[rows] for values in arrays] for arrays in (lows, highs, firsts, counts))
+    shares = np.ones(len(rows) if rows is not None else n)
+    indices = []
+    for axis in (2, 1, 0):
+        if rows is None:
+            indices.append(firsts[axis])
+            continue
+        piece = local % counts[axis]
+        local //= counts[axis]
+        index = firsts[axis] + piece
+        # the pieces of a block meet at the parent boundaries, the first and last ones keep the block faces,
+        # so the shares along an axis add up to one exactly
+        start = np.where(piece == 0, lows[axis], index)
+        end = np.where(piece == counts[axis] - 1, highs[axis], index + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = (end - start) / (highs[axis] - lows[axis])
+        shares *= np.where(np.isfinite(share), share, 1.0)
+        indices.append(index)
+    volumes = np.multiply(*sizes[:2]) * sizes[2]
+    if np.ndim(volumes) and rows is not None:
+        volumes = volumes[rows]
+    volumes = volumes * shares
+    if config.get('percent'):
+        # percentages from 0 to 100; blocks without one are whole
+        percent = np.nan_to_num(column_values(block_model, config['percent']).astype(np.float64), nan=100.0) / 100
+        percent = percent if rows is None else percent[rows]
+        volumes *= percent
+    return rows, tuple(indices[::-1]), shares, volumes
+
+# Partial aggregates of split blocks
+def reduce_split(block_model, config):
+    block_model, _ = block_coordinates(block_model, config)
+    rows, indices, shares, volumes = split_blocks(block_model, config)
+    if config.get('slab_layers'):
+        # the pieces in the parent blocks of other slabs of the parallel engine are reduced there
+        axis, first, end = config['slab_layers']
+        kept = np.flatnonzero((indices[axis] >= first) & (indices[axis] < end))
+        rows = kept if rows is None else rows[kept]
+        indices = tuple(index[kept] for index in indices)
+        shares, volumes = shares[kept], volumes[kept]
+    if rows is not None:
+        block_model = block_model.iloc[rows, block_model.columns.get_indexer(used_columns(config))]
+    ids, cells = group_cells(*indices)
+    partials = partial_sums(block_model, config, ids, len(cells[0]), Scratch(len(ids)), shares, volumes)
+    return partials_frame(cells, partials)
+
+# Partial aggregates per occupied parent block of a set of blocks, computed in the scratch buffers
+def reduce_blocks(block_model, config, scratch=None):
+    report(config, 'keys')
+    if splits_blocks(config):
+        return reduce_split(block_model, config)
+    block_model, coordinates = block_coordinates(block_model, config)
+    n = len(block_model)
+    scratch = (scratch or Scratch()).reserve(n)
+    if n == 0:
+        ids = np.empty(0, dtype=np.int64)
+        cells = (ids, ids, ids)
+    else:
+        keys, low, shape = block_keys(coordinates, config, scratch)
+        ids, occupied = segment_ids(keys, shape, scratch)
+        cells = unpack_keys(occupied, low, shape)
+    report(config, 'aggregate')
+    return partials_frame(cells, partial_sums(block_model, config, ids, len(cells[0]), scratch))
+
+# Reduction of each kind of partial field, by its prefix; the other fields are summed
+REDUCERS = {
+    'min:': lambda ids, values, segments: segment_extreme(np.fmin, ids, values, segments),
+    'max:': lambda ids, values, segments: segment_extreme(np.fmax, ids, values, segments),
+    # the percentiles of a parent block come from the one slab holding it, the others are missing
+    'pct:': lambda ids, values, segments: segment_extreme(np.fmax, ids, values, segments),
+}
+
+def reduce_field(field, ids, values, segments):
+    for prefix, reducer in REDUCERS.items():
+        if field.startswith(prefix):
+            return reducer(ids, values, segments)
+    return segment_sum(ids, values, segments)
+
+# Merge partial aggregates holding repeated parent blocks, e.g. from different chunks of the model; fields
+# missing from some of them (values of a mode column absent from a chunk) are NaN and skipped
+def reduce_partials(partials):
+    ids, (ci, cj, ck) = group_cells(partials['i'].to_numpy(), partials['j'].to_numpy(), partials['k'].to_numpy())
+    fields = partials.columns.drop(['i', 'j', 'k'])
+    return pd.DataFrame({
+        'i': ci, 'j': cj, 'k': ck,
+        **{field: reduce_field(field, ids, partials[field].to_numpy(), len(ci)) for field in fields},
+    })
+
+# Reblocked model from the partial aggregates, with the parent blocks centroids as coordinates
+def partials_to_model(partials, config):
+    origin = config.get('origin', (0.0, 0.0, 0.0))
+    values = finalize({field: partials[field].to_numpy() for field in partials.columns}, config)
+    return pd.DataFrame({
+        'X': grid_coordinates(partials['i'].to_numpy(), config['rdx'], origin[0]),
+        'Y': grid_coordinates(partials['j'].to_numpy(), config['rdy'], origin[1]),
+        'Z': grid_coordinates(partials['k'].to_numpy(), config['rdz'], origin[2]),
+        **values,
+    })
+
+# Layout of a regular model on a dense grid of blocks spanning whole parent blocks: the blocks of the model are
+# the cells of the grid, each parent block holds factors[axis] of them along each axis and low is the parent
+# index of the first one. flat is the C-order index of each block in the grid and counts the number of blocks
+# in each cell, both None when the blocks already fill the grid in C or Fortran order, so that the columns are
+# reshaped without copying
+class DenseGrid:
+    def __init__(self, block_model, shape, low, factors, order, flat=None, counts=None):
+        self.block_model = block_model
+        self.shape = shape
+        self.low = low
+        self.factors = factors
+        self.order = order
+        self.flat = flat
+        self.counts = counts
+        self.parents = tuple(size // factor for size, factor in zip(shape, factors))
+
+    # Per-block values laid out on the grid, in its order; missing cells take fill
+    def layout(self, values, fill=0):
+        if self.flat is None:
+            return values
+        cells = np.full(len(self.counts), fill, dtype=values.dtype)
+        cells[self.flat] = values
+        return cells
+
+    # Reduction of a grid layout over each parent block with a binary ufunc (np.add, np.fmin, ...), as a flat
+    # C-order array over the parent grid. The layout is viewed as a 6D array with an axis over the parent blocks
+    # and one over the blocks inside them for each axis, and every inner axis is reduced by combining its strided
+    # slices, the fastest varying first, which runs much faster than a ufunc reduce over short axes
+    def reduce_layout(self, function, cells, dtype):
+        (px, py, pz), (fx, fy, fz) = self.parents, self.factors
+        if self.order == 'F':
+            blocks, inner = cells.reshape((fx, px, fy, py, fz, pz), order='F'), (0, 2, 4)
+        else:
+            blocks, inner = cells.reshape((px, fx, py, fy, pz, fz)), (1, 3, 5)
+        for axis in sorted(inner, key=lambda axis: abs(blocks.strides[axis])):
+            slices = np.moveaxis(blocks, axis, 0)
+            result = slices[0].astype(dtype)
+            for part in slices[1:]:
+                function(result, part, out=result)
+            blocks = np.expand_dims(result, axis)
+        return blocks.ravel()
+
+    def reduce(self, function, values, dtype=np.float64, fill=0):
+        return self.reduce_layout(function, self.layout(values, fill), dtype)
+
+    # Percentiles q (0-100) of the values of each parent block, as a flat C-order array over the parent grid: the
+    # layout is copied into one row per parent block, in C order, and the rows sorted, missing values last
+    def percentiles(self, values, quantiles):
+        (px, py, pz), (fx, fy, fz) = self.parents, self.factors
+        cells = self.layout(values.astype(np.float64, copy=False), fill=np.nan)
+        if self.order == 'F':
+            blocks = cells.reshape((fx, px, fy, py, fz, pz), order='F').transpose(1, 3, 5, 0, 2, 4)
+        else:
+            blocks = cells.reshape((px, fx, py, fy, pz, fz)).transpose(0, 2, 4, 1, 3, 5)
+        blocks = np.sort(blocks.reshape(px * py * pz, fx * fy * fz), axis=1)
+        counts = np.count_nonzero(~np.isnan(blocks), axis=1)
+        starts = np.arange(0, blocks.size, blocks.shape[1])
+        return [sorted_percentile(blocks.ravel(), starts, counts, q) for q in quantiles]
+
+    def blocks_per_parent(self):
+        if self.counts is None:
+            return np.full(math.prod(self.parents), math.prod(self.factors), dtype=np.int64)
+        return self.reduce_layout(np.add, self.counts, np.int64)
+
+# Dense grid of a model that is a (nearly) full regular grid of blocks of size (dx, dy, dz) aligned on the parent
+# grid, without repeated blocks, or None if it is not; it is built in the scratch buffers, and its flat indices
+# live there until they are reused
+def dense_grid(block_model, config, scratch=None):
+    origin = config.get('origin', (0.0, 0.0, 0.0))
+    block_model, coordinates = block_coordinates(block_model, config)
+    n = len(block_model)
+    if n == 0:
+        return None
+    scratch = (scratch or Scratch()).reserve(n)
+    position, index = scratch.real[:n], scratch.index[:n]
+    # C order flat indices, built axis by axis, and Fortran order ones too when X varies first, as in a model
+    # laid out in Fortran order
+    flat_c = scratch.keys[:n]
+    flat_f = scratch.ids[:n] if n > 1 and coordinates[0][0] != coordinates[0][1] else None
+    low, shape, factors = [], [], []
+    for axis, (values, (_, size, parent_size), offset) in enumerate(zip(coordinates, AXES, origin)):
+        factor = size_factor(config[parent_size], config[size])
+        if factor is None:
+            return None
+        np.subtract(values, config[size] / 2 + offset, out=position)
+        position /= config[size]
+        np.rint(position, out=index, casting='unsafe')
+        position -= index
+        # the same tolerance grid_index snaps with, so both paths put every block in the same parent block
+        if np.abs(position, out=position).max() > SNAP * factor:
+            return None
+        low.append(int(index.min()) // factor)
+        index -= low[-1] * factor
+        shape.append(-(-(int(index.max()) + 1) // factor) * factor)
+        factors.append(factor)
+        # the grid only grows with the axes, and a sparse one is given up before its indices could overflow
+        if n < DENSE_FILL * math.prod(shape):
+            return None
+        if axis == 0:
+            flat_c[:] = index
+            if flat_f is not None:
+                flat_f[:] = index
+        else:
+            flat_c *= shape[-1]
+            flat_c += index
+            if flat_f is not None:
+                index *= math.prod(shape[:-1])
+                flat_f += index
+    cells = math.prod(shape)
+    if n == cells:
+        steps = scratch.mask[:n - 1]
+        for order, flat in (('C', flat_c), ('F', flat_f)):
+            if flat is None or flat[0] != 0:
+                continue
+            if np.equal(np.subtract(flat[1:], flat[:-1], out=index[:n - 1]), 1, out=steps).all():
+                return DenseGrid(block_model, shape, low, factors, order)
+    counts = np.bincount(flat_c, minlength=cells)
+    if counts.max() > 1:
+        return None
+    return DenseGrid(block_model, shape, low, factors, 'C', flat_c, counts)
+
+# Values of a column with missing values zeroed, so that sums skip them, and the flags of the non-missing ones,
+# or None when none is missing
+def dense_values(block_model, column):
+    values = column_values(block_model, column)
+    if values.dtype.kind != 'f':
+        return values, None
+    present = ~np.isnan(values)
+    if present.all():
+        return values, None
+    return np.where(present, values, 0), present
+
+# The partial aggregates of reduce_blocks for a model on a dense grid, reduced over strided views of its columns
+# (or of a copy laid out on the grid, when it has missing blocks) instead of keys
+def dense_partials(grid, config):
+    block_model = grid.block_model
+    blocks_per_parent = grid.blocks_per_parent()
+    occupied = np.flatnonzero(blocks_per_parent)
+    blocks_per_parent = blocks_per_parent[occupied].astype(np.float64)
+    partials = {}
+    for column in config['sum'] + config['mean']:
+        values, _ = dense_values(block_model, column)
+        dtype = np.int64 if values.dtype.kind in 'biu' else np.float64
+        partials[f'sum:{column}'] = grid.reduce(np.add, values, dtype)[occupied]
+    for column in dict.fromkeys(config['mean'] + config.get('count', [])):
+        _, present = dense_values(block_model, column)
+        counts = blocks_per_parent if present is None else grid.reduce(np.add, present)[occupied]
+        for field, columns in (('n', config['mean']), ('count', config.get('count', []))):
+            if column in columns:
+                partials[f'{field}:{column}'] = counts
+    if config['p_mean']:
+        weight, _ = dense_values(block_model, config['pounder'])
+        weight = weight.astype(np.float64, copy=False)
+        partials['w'] = grid.reduce(np.add, weight)[occupied]
+        for column in config['p_mean']:
+            weighted = column_values(block_model, column) * weight
+            np.copyto(weighted, 0.0, where=np.isnan(weighted))
+            partials[f'wsum:{column}'] = grid.reduce(np.add, weighted)[occupied]
+    for key, function in (('min', np.fmin), ('max', np.fmax)):
+        for column in config.get(key, []):
+            values = column_values(block_model, column)
+            extremes = grid.reduce(function, values.astype(np.float64, copy=False), fill=np.nan)[occupied]
+            if values.dtype.kind in 'biu':
+                extremes = np.rint(extremes).astype(np.int64)
+            partials[f'{key}:{column}'] = extremes
+    for column, quantiles in config.get('percentiles', {}).items():
+        percentiles = grid.percentiles(column_values(block_model, column), quantiles)
+        partials.update({f'pct:{column}:{q:g}': values[occupied] for q, values in zip(quantiles, percentiles)})
+    i, j, k = np.unravel_index(occupied, grid.parents)
+    return partials_frame((i + grid.low[0], j + grid.low[1], k + grid.low[2]), partials)
+
+# Reblocking keyed on integer parent block indices: blocks are reduced per int64 key with bincount,
+# and coordinates are rebuilt only for the occupied parent blocks. The model is never modified and the
+# full-length work arrays come from config['scratch'] when given. Regular models are reduced on dense arrays
+# instead, unless config['dense'] is false
+def grid_partials(config):
+    report(config, 'keys', len(config['df']))
+    dense = (config.get('dense', True) and not splits_blocks(config)
+             and all(key in DENSE_KEYS for key in EXTENDED_KEYS if config.get(key)))
+    grid = dense_grid(config['df'], config, config.get('scratch')) if dense else None
+    if grid is not None:
+        report(config, 'aggregate')
+        return dense_partials(grid, config)
+    return reduce_blocks(config['df'], config, config.get('scratch'))
+
+# Out-of-core reblocking: the model in config['input'] is read in chunks of config['chunksize'] rows and the
+# partial aggregates of each chunk are merged into an accumulator holding one row per parent block, so memory
+# is bounded by the number of output blocks instead of the size of the model. Percentiles come from histograms,
+# see PERCENTILE_BINS
+def chunked_partials(config):
+    percentile_ranges(config)
+    mode_tables(config)
+    config = dict(config, histograms=True)
+    accumulator = None
+    scratch = config.get('scratch') or Scratch()
+    blocks = 0
+    for chunk in iter_model(config['input'], used_columns(config), config.get('chunksize', CHUNKSIZE)):
+        blocks += len(chunk)
+        report(config, 'load', blocks)
+        partials = reduce_blocks(chunk, config, scratch)
+        if accumulator is None:
+            accumulator = partials
+        else:
+            accumulator = reduce_partials(pd.concat([accumulator, partials], ignore_index=True))
+    return accumulator
+
+# Columns of a model placed once in shared memory, which the worker processes of the parallel engine read their
+# slabs from instead of being sent copies of them; text and categorical columns are shared as category codes. rows
+# is shared alongside, the rows of the model in slab order
+class SharedColumns:
+    def __init__(self, block_model, columns, rows):
+        self.memory = []
+        self.arrays = {}
+        self.categories = {}
+        try:
+            for column in columns:
+                values = block_model[column]
+                if not isinstance(values.dtype, np.dtype) or values.dtype.kind not in 'biuf':
+                    values = values.astype('category')
+                    self.categories[column] = values.cat.categories
+                    values = values.cat.codes
+                self.share(column, values.to_numpy())
+            self.share(None, rows)
+        except BaseException:
+            self.close()
+            raise
+
+    def share(self, key, values):
+        memory = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        self.memory.append(memory)
+        np.ndarray(values.shape, values.dtype, buffer=memory.buf)[...] = values
+        self.arrays[key] = (memory.name, values.dtype.str, len(values))
+
+    # The blocks of rows[start:end], read in a worker process
+    def frame(self, start, end):
+        memory = {key: shared_memory.SharedMemory(name=name) for key, (name, _, _) in self.arrays.items()}
+        try:
+            arrays = {key: np.ndarray(length, dtype, buffer=memory[key].buf)
+                      for key, (_, dtype, length) in self.arrays.items()}
+            rows = arrays.pop(None)[start:end]
+            columns = {}
+            for column, values in arrays.items():
+                values = values[rows]
+                if column in self.categories:
+                    values = pd.Categorical.from_codes(values, self.categories[column])
+                columns[column] = values
+            del arrays
+            return pd.DataFrame(columns, copy=False)
+        finally:
+            for block in memory.values():
+                block.close()
+
+    def close(self):
+        for memory in self.memory:
+            memory.close()
+            memory.unlink()
+        self.memory = []
+
+# Partial aggregates of one slab of shared columns, in a worker process
+# Partial aggregates of one slab of shared columns, in a worker process; layers are the parent indices (axis, first,
+# end) of the slab, where the pieces of the split blocks it was sent are kept
+def reduce_slab(shared, start, end, layers, config):
+    if splits_blocks(config):
+        config = dict(config, slab_layers=layers)
+    return reduce_blocks(shared.frame(start, end), config)
+
+# First and last parent index along an axis of the pieces of each block: the parent block of its corner, as
+# grid_index gives, and for split blocks the one of its far face too
+def layer_range(block_model, coordinates, config, axis):
+    _, size, parent_size = AXES[axis]
+    origin = config.get('origin', (0.0, 0.0, 0.0))[axis]
+    if not splits_blocks(config):
+        first = grid_index(coordinates[axis], config[size], config[parent_size], origin)
+        return first, first
+    sizes = block_sizes(block_model, config)[axis]
+    low = (coordinates[axis] - sizes / 2 - origin) / config[parent_size]
+    high = (coordinates[axis] + sizes / 2 - origin) / config[parent_size]
+    first = np.floor(low + SNAP).astype(np.int64)
+    return first, np.maximum(np.floor(high - SNAP).astype(np.int64), first)
+
+# Parallel reblocking: the model is split into slabs of config['slab'] parent blocks along config['slab_axis'],
+# which are reduced in config['workers'] processes. This process only finds the slabs of each block and shares the
+# used columns; the workers compute the keys and partials of their slabs. A split block overlapping several slabs
+# is sent to each, which keeps the pieces in its own parent blocks, so no parent block is in two slabs and the
+# percentiles of each come whole from one worker
+def parallel_partials(config):
+    report(config, 'keys', len(config['df']))
+    workers = config.get('workers') or os.cpu_count()
+    block_model, coordinates = block_coordinates(config['df'], config)
+    fill_mode_tables(block_model, config)
+    if len(block_model) == 0:
+        return reduce_blocks(block_model, config)
+    axis = 'XYZ'.index(config.get('slab_axis', 'Z'))
+    first, last = layer_range(block_model, coordinates, config, axis)
+    base = first.min()
+    slab = config.get('slab') or -(-(int(last.max() - base) + 1) // (workers * SLABS_PER_WORKER))
+    slabs = (first - base) // slab
+    copies = (last - base) // slab - slabs + 1
+    rows = None
+    if copies.max() > 1:
+        rows = np.repeat(np.arange(len(slabs)), copies)
+        slabs = slabs[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(copies) - copies, copies)
+    # a stable partition, by radix sort over the few slab numbers, so every slab keeps the blocks in the order a
+    # single process would sum them
+    order = np.argsort(slabs.astype(np.min_scalar_type(slabs.max())), kind='stable')
+    bounds = np.searchsorted(slabs[order], np.arange(slabs[order[-1]] + 2))
+    if rows is not None:
+        order = rows[order]
+    # the model, the scratch buffers and the progress callback are not sent to the workers, only the shared columns
+    worker_config = {key: value for key, value in config.items() if key not in ('df', 'scratch', 'progress')}
+
+    shared = SharedColumns(block_model, used_columns(config), order)
+    try:
+        report(config, 'aggregate')
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(reduce_slab, shared, start, end,
+                                       (axis, base + number * slab, base + (number + 1) * slab), worker_config)
+                       for number, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])) if start < end]
+            try:
+                for _ in as_completed(futures):
+                    report(config, 'aggregate')
+            except ReblockingCancelled:
+                executor.shutdown(cancel_futures=True)
+                raise
+            partials = [future.result() for future in futures]
+    finally:
+        shared.close()
+    # slabs hold disjoint parent blocks, merging only puts them in (i, j, k) order
+    return reduce_partials(pd.concat(partials, ignore_index=True))
+
+def reblock_grid(config):
+    return partials_to_model(grid_partials(config), config)
+
+def reblock_chunked(config):
+    return partials_to_model(chunked_partials(config), config)
+
+def reblock_parallel(config):
+    return partials_to_model(parallel_partials(config), config)
+
+ENGINES = {
+    'groupby': reblock_groupby,
+    'grid': reblock_grid,
+    'chunked': reblock_chunked,
+    'parallel': reblock_parallel,
+}
+
+# Engines building partial aggregates, which a sweep can coarsen; the groupby engine sweeps with the grid one
+PARTIALS = {
+    'groupby': grid_partials,
+    'grid': grid_partials,
+    'chunked': chunked_partials,
+    'parallel': parallel_partials,
+}
+
+def with_size(config, size):
+    return dict(config, rdx=size[0], rdy=size[1], rdz=size[2])
+
+# Partial aggregates of a coarser grid, whose parent blocks hold the given whole number of partials' parent blocks
+# along each axis
+def coarsen_partials(partials, factors):
+    return reduce_partials(partials.assign(
+        i=partials['i'].to_numpy() // factors[0],
+        j=partials['j'].to_numpy() // factors[1],
+        k=partials['k'].to_numpy() // factors[2],
+    ))
+
+# Whole number of parent blocks of size fine in a parent block of size coarse, or None if it is not a multiple
+def size_factor(coarse, fine):
+    factor = round(coarse / fine)
+    return factor if factor >= 1 and abs(coarse - factor * fine) <= SNAP * coarse else None
+
+# Whether the partial aggregates of a size can be coarsened into the ones of a whole multiple of it. Exact percentiles
+# cannot, they need the values of the blocks (the histograms of the chunked engine can), nor counts of split blocks: a
+# block split between two parent blocks is counted in both, and again in the coarser one holding them
+def coarsens(config, partials_of):
+    if config.get('percentiles') and partials_of is not chunked_partials:
+        return False
+    return not (config.get('count') and splits_blocks(config))
+
+# Reblock one model to several parent sizes (config['sizes'], a list of (rdx, rdy, rdz)) in a single pass: the
+# model is reduced once to the finest size along each axis and every size that is a whole multiple of it is built
+# from those partial aggregates; other sizes, and every size when the partials do not coarsen, get a pass of their
+# own. Returns the models in the order of the sizes
+def reblock_sweep(config):
+    partials_of = PARTIALS[config.get('engine', 'grid')]
+    # the ranges and label tables are shared by the configs of every size
+    if partials_of is chunked_partials:
+        percentile_ranges(config)
+    mode_tables(config)
+    finest = tuple(min(size[axis] for size in config['sizes']) for axis in range(3))
+    finest_partials = None
+    models = []
+    for size in config['sizes']:
+        report(config, 'aggregate')
+        sized_config = with_size(config, size)
+        factors = [size_factor(coarse, fine) for coarse, fine in zip(size, finest)]
+        if None in factors or not coarsens(config, partials_of):
+            partials = partials_of(sized_config)
+        else:
+            if finest_partials is None:
+                finest_partials = partials_of(with_size(config, finest))
+            partials = coarsen_partials(finest_partials, factors)
+        models.append(partials_to_model(partials, sized_config))
+    return models
+
+# Output file of one size of a sweep: the size is appended to the output name, e.g. model_20x20x10.csv
+def sweep_output(output, size):
+    base, extension = os.path.splitext(output.rstrip('/\\'))
+    return f'{base}_{size[0]:g}x{size[1]:g}x{size[2]:g}{extension}'
+
+def reblock_model(config):
+    engine = config.get('engine', 'grid')
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown reblocking engine: {engine}')
+    if engine == 'groupby' and not config.get('sizes'):
+        if any(config.get(key) for key in EXTENDED_KEYS):
+            raise ValueError('The groupby engine only does sum, mean and weighted mean, use another engine.')
+        if splits_blocks(config):
+            raise ValueError('The groupby engine does not split sub-blocks, use another engine.')
+    report(config, 'load', 0)
+    if engine != 'chunked' and config.get('df') is None:
+        load_model(config)
+    if config.get('sizes'):
+        for size, reblocked_model in zip(config['sizes'], reblock_sweep(config)):
+            report(config, 'write')
+            write_model(reblocked_model, sweep_output(config['output'], size))
+        return
+    reblocked_model = ENGINES[engine](config)
+    report(config, 'write')
+    write_model(reblocked_model, config['output'])
@@ -1,5 +1,7 @@
 import pandas as pd
 import sys
+import time
+from PySide6.QtCore import Signal, QObject, QRunnable, QThreadPool
 from PySide6.QtWidgets import (
     QApplication,
     QWidget,
@@ -10,48 +12,80 @@ from PySide6.QtWidgets import (
     QFileDialog,
     QComboBox,
     QCheckBox,
-    QMessageBox
+    QMessageBox,
+    QProgressBar
 )
+from engine import PHASES, ReblockingCancelled, reblock_model
+from model_io import FILE_FILTER, memory_report, model_columns
 
-def reblock_model(config):
-    block_model = config['df']
-    # set original coordinates to block origin
-    block_model[config['X']] -= config['dx'] / 2
-    block_model[config['Y']] -= config['dy'] / 2
-    block_model[config['Z']] -= config['dz'] / 2
-
-    # calculate the block coordinates in the new grid
-    block_model['rx'] = (block_model[config['X']] // config['rdx']) * config['rdx']
-    block_model['ry'] = (block_model[config['Y']] // config['rdy']) * config['rdy']
-    block_model['rz'] = (block_model[config['Z']] // config['rdz']) * config['rdz']
-
-    # set reblocked coordinates to block centroid
-    block_model['rx'] += config['rdx'] / 2
-    block_model['ry'] += config['rdy'] / 2
-    block_model['rz'] += config['rdz'] / 2
-
-    # Group by the reblocked coordinates and calculate reblocked values for each block in each column
-    reblocked_model = block_model.groupby(['rx', 'ry', 'rz']).agg({
-        **{column: 'sum'
-           for column in config['sum']},
-        **{column: 'mean'
-           for column in config['mean']},
-        **{column: lambda x: (x * block_model.loc[x.index, config['pounder']]).sum() / block_model.loc[x.index, config['pounder']].sum()
-           for column in config['p_mean']},
-    }).reset_index()
-    # rename reblocked coordinates
-    reblocked_model.rename(columns={'rx': 'X', 'ry': 'Y', 'rz': 'Z'}, inplace=True)
-    reblocked_model.to_csv(config['output'], index=False)
+# ReblockTask cannot emit signals itself, it needs this subclass
+class SignalEmitter(QObject):
+
+    progress = Signal(str, int, float)
+    finished = Signal(bool, str)
+    error = Signal(str)
+
+# Reblock in a worker thread, so the window keeps responding; progress reports each phase with the blocks read so
+# far and the blocks per second, and cancel stops the reblocking at the next phase or chunk
+class ReblockTask(QRunnable):
+
+    def __init__(self, config):
+        super().__init__()
+        self.config = config
+        self.cancelled = False
+        self.blocks = 0
+        self.signalEmitter = SignalEmitter()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def report(self, phase, blocks):
+        if self.cancelled:
+            raise ReblockingCancelled()
+        if blocks is not None:
+            self.blocks = blocks
+        elapsed = time.perf_counter() - self.start
+        self.signalEmitter.progress.emit(phase, self.blocks, self.blocks / elapsed if elapsed > 0 else 0.0)
+
+    def run(self):
+        self.start = time.perf_counter()
+        self.config['progress'] = self.report
+        try:
+            reblock_model(self.config)
+            elapsed = time.perf_counter() - self.start
+            message = f'Reblocking completed: {self.blocks:,} blocks in {elapsed:.1f} s'
+            if elapsed > 0:
+                message += f' ({self.blocks / elapsed:,.0f} blocks/s)'
+            message += '.'
+            if self.config['df'] is not None:
+                message += f'\nModel: {memory_report(self.config["df"])}.'
+            self.signalEmitter.finished.emit(True, message)
+        except ReblockingCancelled:
+            self.signalEmitter.finished.emit(False, 'Reblocking cancelled.')
+        except Exception as e:
+            self.signalEmitter.error.emit(f'{e}')
+            self.signalEmitter.finished.emit(False, 'Reblocking failed.')
+        finally:
+            self.config['progress'] = None
 
 class Tela1(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle('File Selection')
         layout = QVBoxLayout()
-        label = QLabel('Select the CSV model file:')
+        label = QLabel('Select the model file (CSV, Parquet or Feather):')
         layout.addWidget(label)
 
-        file_select_button = QPushButton('Selecionar Arquivo CSV')
+        self.chunked_checkbox = QCheckBox('Read the model in chunks (models larger than memory)')
+        layout.addWidget(self.chunked_checkbox)
+
+        self.float32_checkbox = QCheckBox('Load grades as float32 (less memory, about 7 significant digits)')
+        layout.addWidget(self.float32_checkbox)
+
+        self.int32_checkbox = QCheckBox('Load integer columns as int32')
+        layout.addWidget(self.int32_checkbox)
+
+        file_select_button = QPushButton('Selecionar Arquivo')
         file_select_button.clicked.connect(self.abrir_dialogo_arquivo)
         layout.addWidget(file_select_button)
 
@@ -68,14 +102,20 @@ class Tela1(QWidget):
         options |= QFileDialog.ReadOnly
         file_dialog = QFileDialog(self)
         file_dialog.setFileMode(QFileDialog.ExistingFile)
-        file_dialog.setNameFilter('CSV (*.csv)')
+        file_dialog.setNameFilter(FILE_FILTER)
 
         if file_dialog.exec():
             arquivo_selecionado = file_dialog.selectedFiles()
             if arquivo_selecionado:
                 self.arquivo_selecionado = arquivo_selecionado[0]
                 try:
-                    self.config['df'] = pd.read_csv(self.arquivo_selecionado)
+                    # only the header is read here, the columns used are loaded (or streamed) when reblocking
+                    self.config['input'] = self.arquivo_selecionado
+                    self.config['columns'] = model_columns(self.arquivo_selecionado)
+                    self.config['float32'] = self.float32_checkbox.isChecked()
+                    self.config['int32'] = self.int32_checkbox.isChecked()
+                    if self.chunked_checkbox.isChecked():
+                        self.config['engine'] = 'chunked'
                     self.abrir_tela2()
                 except pd.errors.EmptyDataError:
                     print('The file is empty.')
@@ -103,7 +143,7 @@ class Tela2(QWidget):
             'Z': QComboBox()
         }
 
-        for coluna in config['df'].columns:
+        for coluna in config['columns']:
             for key in self.comboboxes.keys():
                 self.comboboxes[key].addItem(coluna)
 
@@ -111,6 +151,24 @@ class Tela2(QWidget):
         layout.addWidget(self.comboboxes['Y'])
         layout.addWidget(self.comboboxes['Z'])
 
+        label_subblocos = QLabel('Sub-blocked models: select the block size columns (dx, dy, dz), or leave empty:')
+        layout.addWidget(label_subblocos)
+
+        self.size_comboboxes = [QComboBox(), QComboBox(), QComboBox()]
+        for combobox in self.size_comboboxes:
+            combobox.addItem('')
+            combobox.addItems(config['columns'])
+            layout.addWidget(combobox)
+
+        label_percentual = QLabel('Select the partial block percentage column (0 to 100, weights the means by volume), '
+                                  'or leave empty:')
+        layout.addWidget(label_percentual)
+
+        self.percent_combobox = QComboBox()
+        self.percent_combobox.addItem('')
+        self.percent_combobox.addItems(config['columns'])
+        layout.addWidget(self.percent_combobox)
+
         label_dimensoes = QLabel('Inform the model dimensions (dx, dy, dz):')
         layout.addWidget(label_dimensoes)
 
@@ -144,6 +202,10 @@ class Tela2(QWidget):
         self.config['Y'] = self.comboboxes['Y'].currentText()
         self.config['Z'] = self.comboboxes['Z'].currentText()
 
+        size_columns = [combobox.currentText() for combobox in self.size_comboboxes]
+        self.config['size_columns'] = size_columns if all(size_columns) else None
+        self.config['percent'] = self.percent_combobox.currentText() or None
+
         self.config['dx'] = float(self.dx_input.text())
         self.config['dy'] = float(self.dy_input.text())
         self.config['dz'] = float(self.dz_input.text())
@@ -170,7 +232,7 @@ class Tela3(QWidget):
         layout.addWidget(label)
 
         self.checkboxes = {}
-        for coluna in self.config['df'].columns:
+        for coluna in self.config['columns']:
             if coluna not in [self.config['X'], self.config['Y'], self.config['Z']]:
                 checkbox = QCheckBox(coluna)
                 layout.addWidget(checkbox)
@@ -202,7 +264,7 @@ class Tela4(QWidget):
         layout.addWidget(label)
 
         self.checkboxes = {}
-        for coluna in self.config['df'].columns:
+        for coluna in self.config['columns']:
             if coluna not in [self.config['X'], self.config['Y'], self.config['Z']]:
                 if coluna not in self.config['sum']:
                     checkbox = QCheckBox(coluna)
@@ -237,7 +299,7 @@ class Tela5(QWidget):
 
         self.combobox = QComboBox()
 
-        for coluna in config['df'].columns:
+        for coluna in config['columns']:
             self.combobox.addItem(coluna)
 
         layout.addWidget(self.combobox)
@@ -246,7 +308,7 @@ class Tela5(QWidget):
         layout.addWidget(label)
 
         self.checkboxes = {}
-        for coluna in self.config['df'].columns:
+        for coluna in self.config['columns']:
             if coluna not in [self.config['X'], self.config['Y'], self.config['Z']]:
                 if coluna not in self.config['sum']:
                     if coluna not in self.config['mean']:
@@ -283,19 +345,73 @@ class Tela6(QWidget):
         self.local_arquivo_input = QLineEdit()
         layout.addWidget(self.local_arquivo_input)
 
-        confirmar_button = QPushButton('Confirm')
-        confirmar_button.clicked.connect(self.gerar_resultado)
-        layout.addWidget(confirmar_button)
+        self.confirmar_button = QPushButton('Confirm')
+        self.confirmar_button.clicked.connect(self.gerar_resultado)
+        layout.addWidget(self.confirmar_button)
 
+        self.status_label = QLabel('')
+        layout.addWidget(self.status_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, len(PHASES))
+        self.progress_bar.hide()
+        layout.addWidget(self.progress_bar)
+
+        self.cancelar_button = QPushButton('Cancel')
+        self.cancelar_button.clicked.connect(self.cancelar)
+        self.cancelar_button.hide()
+        layout.addWidget(self.cancelar_button)
+
+        self.task = None
         self.setLayout(layout)
 
     def gerar_resultado(self):
         self.config['output'] = self.local_arquivo_input.text()
-        reblock_model(self.config)
-        # Chame sua função de reblocagem e salve o resultado no arquivo especificado
-        QMessageBox.information(self, 'Warning', 'Reblocking completed.', QMessageBox.Ok)
+        # the reblocking runs in a worker thread, the result is shown when it finishes
+        self.task = ReblockTask(self.config)
+        self.task.signalEmitter.progress.connect(self.mostrar_progresso)
+        self.task.signalEmitter.finished.connect(self.finalizar)
+        self.task.signalEmitter.error.connect(self.mostrar_erro)
+        self.confirmar_button.setEnabled(False)
+        self.cancelar_button.setEnabled(True)
+        self.cancelar_button.show()
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.status_label.setText('Starting...')
+        QThreadPool.globalInstance().start(self.task)
+
+    def mostrar_progresso(self, phase, blocks, blocks_per_second):
+        self.progress_bar.setValue(PHASES.index(phase))
+        self.status_label.setText(f'{phase.capitalize()}: {blocks:,} blocks read, {blocks_per_second:,.0f} blocks/s')
+
+    def cancelar(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.cancelar_button.setEnabled(False)
+            self.status_label.setText('Cancelling...')
+
+    def mostrar_erro(self, error):
+        QMessageBox.critical(self, 'Error', error, QMessageBox.Ok)
+
+    def finalizar(self, success, message):
+        self.task = None
+        self.cancelar_button.hide()
+        if not success:
+            # the output file can be changed and the reblocking started again
+            self.progress_bar.hide()
+            self.status_label.setText(message)
+            self.confirmar_button.setEnabled(True)
+            return
+        self.progress_bar.setValue(len(PHASES))
+        QMessageBox.information(self, 'Warning', message, QMessageBox.Ok)
         QApplication.quit()
 
+    def closeEvent(self, event):
+        # a running reblocking stops at its next phase when the window is closed
+        if self.task is not None:
+            self.task.cancel()
+        super().closeEvent(event)
+
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     tela1 = Tela1()
@@ -0,0 +1,190 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from csv_io import read_frame, write_columns
+
+# Block model files are read and written in the format given by their extension. A .npy bundle is a directory
+# holding columns.json with the column names and one .npy file per column, which is loaded memory-mapped.
+FORMATS = {
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.feather': 'feather',
+    '.arrow': 'feather',
+    '.npy': 'npy',
+}
+
+# Name filter for the file dialogs
+FILE_FILTER = 'Models (*.csv *.parquet *.pq *.feather *.arrow)'
+
+# Rows of a CSV read to guess the compact dtypes of its columns
+SAMPLE_ROWS = 10_000
+
+def model_format(path):
+    extension = os.path.splitext(path.rstrip('/\\'))[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f'Unsupported model format: {path}')
+    return FORMATS[extension]
+
+def is_model(path):
+    return os.path.splitext(path.rstrip('/\\'))[1].lower() in FORMATS
+
+# Column names of a model, without reading its data
+def model_columns(path):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        return pyarrow.parquet.read_schema(path).names
+    if file_format == 'feather':
+        import pyarrow
+        import pyarrow.ipc
+        # the schema is in the footer of the file, no batch is read
+        with pyarrow.memory_map(path) as source:
+            return pyarrow.ipc.open_file(source).schema.names
+    with open(os.path.join(path, 'columns.json'), 'r') as file:
+        return json.load(file)
+
+def npy_column(path, index):
+    try:
+        return np.load(os.path.join(path, f'{index}.npy'), mmap_mode='r')
+    except ValueError:
+        # text columns are stored as object arrays, which cannot be memory-mapped
+        return np.load(os.path.join(path, f'{index}.npy'), allow_pickle=True)
+
+def npy_columns(path, columns):
+    names = model_columns(path)
+    columns = names if columns is None else columns
+    return {column: npy_column(path, names.index(column)) for column in columns}
+
+# Read a model, or only the given columns of it
+def read_model(path, columns=None):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        if columns is not None:
+            # in the order of the file, as pandas gives them
+            header = model_columns(path)
+            columns = [column for column in header if column in columns] + \
+                      [column for column in columns if column not in header]
+        return read_frame(path, columns)
+    if file_format == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    if file_format == 'feather':
+        return pd.read_feather(path, columns=columns)
+    return pd.DataFrame(npy_columns(path, columns))
+
+# Compact dtype for a column read as dtype, or None to keep it
+def compact_dtype(dtype, float32=False):
+    if dtype.kind == 'f' and float32:
+        return np.float32
+    if dtype.kind == 'O':
+        return 'category'
+    return None
+
+# Convert the columns of a model, except the ones in keep, to compact dtypes: categoricals for text columns (e.g. rock
+# codes), and, when set, float32 for float columns and int32 for integer columns that fit. float32 keeps about seven
+# significant digits, so sums and weighted means reblocked from it drift from the float64 ones
+def compact(df, keep=(), float32=False, int32=False):
+    for column in df.columns:
+        if column in keep:
+            continue
+        dtype = compact_dtype(df[column].dtype, float32)
+        if dtype is not None:
+            df[column] = df[column].astype(dtype)
+        elif int32 and df[column].dtype.kind in 'iu' and len(df) > 0:
+            limits = np.iinfo(np.int32)
+            if limits.min <= df[column].min() and df[column].max() <= limits.max:
+                df[column] = df[column].astype(np.int32)
+    return df
+
+# Read a model with compact dtypes; CSV columns are parsed straight into them, guessed from the first rows
+def read_compact(path, columns=None, keep=(), float32=False, int32=False):
+    df = None
+    if model_format(path) == 'csv':
+        sample = pd.read_csv(path, usecols=columns, nrows=SAMPLE_ROWS)
+        dtypes = {column: compact_dtype(sample[column].dtype, float32) for column in sample.columns if column not in keep}
+        try:
+            df = pd.read_csv(path, usecols=columns, dtype={column: dtype for column, dtype in dtypes.items() if dtype})
+        except ValueError:
+            # the first rows did not tell the column types right, convert after a plain read
+            df = None
+    if df is None:
+        df = read_model(path, columns)
+    return compact(df, keep, float32, int32)
+
+# Memory taken by a model, and saved against the default 8-byte dtypes (float64, int64 or object references)
+def memory_report(df):
+    used = df.memory_usage(index=False).sum()
+    default = len(df) * len(df.columns) * 8
+    return f'{used / 2 ** 20:.1f} MB in memory, {(default - used) / 2 ** 20:.1f} MB saved by compact dtypes'
+
+# Read a model in DataFrames of at most chunksize rows; at least one, possibly empty, chunk is returned
+def iter_model(path, columns=None, chunksize=1_000_000):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        return
+    if file_format == 'parquet':
+        import pyarrow.parquet
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        empty = True
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            empty = False
+            yield batch.to_pandas()
+        if empty:
+            yield pd.read_parquet(path, columns=columns)
+        return
+    if file_format == 'feather':
+        yield from iter_feather(path, columns, chunksize)
+        return
+    arrays = npy_columns(path, columns)
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+    for offset in range(0, max(rows, 1), chunksize):
+        yield pd.DataFrame({column: values[offset:offset + chunksize] for column, values in arrays.items()})
+
+# Read a Feather file record batch by record batch, so only the batches of a chunk, and only the given columns of
+# them, are decompressed at a time; the batches are gathered or sliced into chunks of chunksize rows
+def iter_feather(path, columns, chunksize):
+    import pyarrow
+    import pyarrow.ipc
+    with pyarrow.memory_map(path) as source:
+        schema = pyarrow.ipc.open_file(source).schema
+        options = None
+        if columns is not None:
+            options = pyarrow.ipc.IpcReadOptions(included_fields=[schema.get_field_index(column) for column in columns])
+            schema = pyarrow.schema([schema.field(column) for column in columns])
+        reader = pyarrow.ipc.open_file(source, options=options)
+        pending, rows, chunks = [], 0, 0
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            pending.append(batch if columns is None else batch.select(columns))
+            rows += batch.num_rows
+            while rows >= chunksize:
+                table = pyarrow.Table.from_batches(pending, schema)
+                yield table.slice(0, chunksize).to_pandas()
+                chunks += 1
+                rest = table.slice(chunksize)
+                pending, rows = rest.to_batches(), rest.num_rows
+        if rows or chunks == 0:
+            yield pyarrow.Table.from_batches(pending, schema).to_pandas()
+
+def write_model(df, path):
+    file_format = model_format(path)
+    if file_format == 'csv':
+        # numeric models are formatted in parallel, the others by pandas
+        if all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in df.dtypes):
+            write_columns(path, df.columns, [df[column].to_numpy() for column in df.columns])
+        else:
+            df.to_csv(path, index=False)
+    elif file_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif file_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        os.makedirs(path, exist_ok=True)
+        for index, column in enumerate(df.columns):
+            np.save(os.path.join(path, f'{index}.npy'), df[column].to_numpy())
+        with open(os.path.join(path, 'columns.json'), 'w') as file:
+            json.dump([str(column) for column in df.columns], file)
@@ -0,0 +1,63 @@
+import json
+import os
+import pandas as pd
+from batch import main
+from benchmark import synthetic_config, synthetic_model
+from engine import reblock_groupby
+from model_io import read_model, write_model
+
+CONFIG_KEYS = ['X', 'Y', 'Z', 'dx', 'dy', 'dz', 'rdx', 'rdy', 'rdz', 'sum', 'mean', 'p_mean', 'pounder']
+
+def write_config(tmp_path, **keys):
+    model = synthetic_model(2000, attributes=2, sparsity=0.3, seed=2)
+    input_file = str(tmp_path / 'model.csv')
+    write_model(model, input_file)
+    config = {key: value for key, value in synthetic_config(model, 'grid', input_file, None).items()
+              if key in CONFIG_KEYS}
+    config.update(input=input_file, output=str(tmp_path / 'reblocked.csv'), **keys)
+    path = str(tmp_path / 'config.json')
+    with open(path, 'w') as file:
+        json.dump(config, file)
+    return path, dict(config, df=model)
+
+def assert_reblocked(path, config):
+    expected = reblock_groupby(dict(config)).set_index(['X', 'Y', 'Z'])
+    reblocked = read_model(path).set_index(['X', 'Y', 'Z'])[expected.columns]
+    pd.testing.assert_frame_equal(reblocked, expected, rtol=1e-9, check_dtype=False)
+
+def test_batch_reblocks_the_config(tmp_path):
+    path, config = write_config(tmp_path)
+    assert main([path]) == 0
+    assert_reblocked(config['output'], config)
+
+def test_batch_options_override_the_config(tmp_path):
+    path, config = write_config(tmp_path)
+    output = str(tmp_path / 'reblocked.parquet')
+    assert main([path, '--engine', 'chunked', '--output', output]) == 0
+    assert_reblocked(output, config)
+
+def test_batch_reblocks_a_directory(tmp_path):
+    path, config = write_config(tmp_path)
+    models = tmp_path / 'models'
+    models.mkdir()
+    write_model(config['df'], str(models / 'a.csv'))
+    write_model(config['df'], str(models / 'b.feather'))
+    output = tmp_path / 'reblocked'
+    assert main([path, '--input', str(models), '--output', str(output)]) == 0
+    assert sorted(os.listdir(output)) == ['a.csv', 'b.feather']
+    assert_reblocked(str(output / 'b.feather'), config)
+
+def test_batch_sweeps_sizes(tmp_path):
+    path, config = write_config(tmp_path)
+    assert main([path, '--sizes', '20x20x10', '40x40x20']) == 0
+    assert_reblocked(str(tmp_path / 'reblocked_40x40x20.csv'), dict(config, rdx=40.0, rdy=40.0, rdz=20.0))
+
+def test_batch_reports_missing_keys(tmp_path, capsys):
+    path, _ = write_config(tmp_path)
+    with open(path) as file:
+        config = json.load(file)
+    del config['rdz']
+    with open(path, 'w') as file:
+        json.dump(config, file)
+    assert main([path]) == 1
+    assert 'rdz' in capsys.readouterr().err
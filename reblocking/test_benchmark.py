@@ -0,0 +1,41 @@
+import multiprocessing
+import numpy as np
+import pytest
+from benchmark import MemorySampler, process_tree_rss, run_case, synthetic_config, synthetic_model
+
+def test_synthetic_model_fills_its_grid(tmp_path):
+    model = synthetic_model(1000, attributes=3, sparsity=0.5, seed=3)
+    assert len(model) == 1000 and list(model.columns) == ['X', 'Y', 'Z', 'ton', 'a0', 'a1', 'a2']
+    assert not model.duplicated(['X', 'Y', 'Z']).any()
+    with pytest.raises(ValueError):
+        synthetic_model(100, shape=(4, 4, 4))
+
+def test_run_case_reports_times_and_memory(tmp_path):
+    model = synthetic_model(1000, attributes=2)
+    input_file = str(tmp_path / 'model.parquet')
+    model.to_parquet(input_file)
+    result = run_case(synthetic_config(model, 'grid', input_file, str(tmp_path / 'reblocked.parquet')))
+    assert result['parent_blocks'] > 0 and result['reblock_s'] >= 0
+    if result['peak_rss_mb'] is not None:
+        assert result['peak_rss_mb'] >= (result['largest_process_rss_mb'] or 0)
+
+def hold_memory(ready, done):
+    values = np.ones(2 ** 24)
+    ready.set()
+    done.wait(30)
+    return values.sum()
+
+# The memory of the worker processes is added to the one of this process
+def test_memory_sampler_adds_the_children():
+    if process_tree_rss(multiprocessing.current_process().pid) is None:
+        pytest.skip('no /proc to read the memory of the processes from')
+    ready, done = multiprocessing.Event(), multiprocessing.Event()
+    child = multiprocessing.Process(target=hold_memory, args=(ready, done))
+    with MemorySampler() as memory:
+        alone = memory.peak
+        child.start()
+        ready.wait(30)
+        memory.sample()
+        done.set()
+        child.join()
+    assert memory.peak - alone >= 100
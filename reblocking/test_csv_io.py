@@ -0,0 +1,70 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from csv_io import read_frame, read_numeric, write_columns
+
+TOOLS = ['csv_column_operations', 'project_dxf_polygon', 'project_dxf_surface', 'reblocking']
+
+# Floats across the magnitudes where Arrow and repr format them differently, whole, negative zero, infinite and
+# missing values
+def float_values(dtype):
+    rng = np.random.default_rng(4)
+    values = rng.standard_normal(5000) * 10.0 ** rng.integers(-12, 25, 5000)
+    special = [1.5 * 10.0 ** exponent for exponent in range(-9, 24)] + [0.0, -0.0, 1e-4, -1.3040000451301372e14]
+    values = np.concatenate([values, special, [np.inf, -np.inf, np.nan]]).astype(dtype)
+    values[::11] = np.round(values[::11])
+    return values
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_write_columns_writes_what_pandas_writes(tmp_path, dtype):
+    values = float_values(dtype)
+    columns = {'x': values, 'n': np.arange(len(values)), 'flag': np.arange(len(values)) % 3 == 0}
+    write_columns(str(tmp_path / 'written.csv'), list(columns), list(columns.values()), threads=2)
+    pd.DataFrame(columns).to_csv(tmp_path / 'pandas.csv', index=False)
+    assert (tmp_path / 'written.csv').read_bytes() == (tmp_path / 'pandas.csv').read_bytes()
+
+def test_read_frame_reads_what_pandas_reads(tmp_path):
+    path = tmp_path / 'model.csv'
+    path.write_text('X,rock,au,date,flag\n1,fresh,0.5,2024-01-02,True\n2,,,,False\n3,ox,1e-3,2024-03-04,True\n')
+    pd.testing.assert_frame_equal(read_frame(str(path)), pd.read_csv(path))
+    pd.testing.assert_frame_equal(read_frame(str(path), ['X', 'au']), pd.read_csv(path, usecols=['X', 'au']))
+
+def test_written_floats_are_read_back(tmp_path):
+    values = float_values(np.float64)
+    write_columns(str(tmp_path / 'written.csv'), ['x', 'n'], [values, np.arange(len(values))])
+    names, read = read_numeric(str(tmp_path / 'written.csv'))
+    assert names == ['x', 'n']
+    np.testing.assert_array_equal(read[:, 0], values)
+
+def test_read_errors_are_the_ones_pandas_gives(tmp_path):
+    (tmp_path / 'empty.csv').write_text('')
+    (tmp_path / 'ragged.csv').write_text('a,b\n1,2\n3,4,5\n')
+    (tmp_path / 'text.csv').write_text('a,b\n1,x\n')
+    with pytest.raises(pd.errors.EmptyDataError):
+        read_frame(str(tmp_path / 'empty.csv'))
+    with pytest.raises(pd.errors.ParserError):
+        read_frame(str(tmp_path / 'ragged.csv'))
+    with pytest.raises(ValueError, match='c'):
+        read_frame(str(tmp_path / 'text.csv'), ['a', 'c'])
+    with pytest.raises(ValueError, match='Column b'):
+        read_numeric(str(tmp_path / 'text.csv'))
+
+# The DXF tools do not install pandas
+def test_read_errors_without_pandas(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pandas', None)
+    (tmp_path / 'empty.csv').write_text('')
+    (tmp_path / 'ragged.csv').write_text('a,b\n1,2\n3,4,5\n')
+    with pytest.raises(ValueError, match='is empty'):
+        read_numeric(str(tmp_path / 'empty.csv'))
+    with pytest.raises(ValueError, match='ragged.csv'):
+        read_numeric(str(tmp_path / 'ragged.csv'))
+
+def test_copies_are_synced():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    copies = set()
+    for tool in TOOLS:
+        with open(os.path.join(root, tool, 'csv_io.py'), 'rb') as file:
+            copies.add(file.read())
+    assert len(copies) == 1
@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmark import synthetic_config, synthetic_model
+from engine import AXES, ENGINES, PARTIALS, dense_grid, reblock_groupby, reblock_sweep
+from model_io import write_model
+
+# A model filling less of its grid than DENSE_FILL, which the grid engine reblocks on keys
+SPARSE = 0.7
+
+# A grid of whole 40x40x20 parent blocks, filled by the model
+FULL_SHAPE = (8, 8, 4)
+FULL_BLOCKS = 256
+
+PARENT_SIZES = [(20.0, 20.0, 10.0), (40.0, 40.0, 20.0)]
+
+def reblocking_config(engine, tmp_path, blocks=3000, sparsity=SPARSE, shape=None):
+    model = synthetic_model(blocks, attributes=4, sparsity=sparsity, shape=shape, seed=1)
+    model.loc[::7, 'a1'] = np.nan
+    input_file = str(tmp_path / 'model.parquet')
+    model.to_parquet(input_file)
+    config = synthetic_config(model, engine, input_file, None)
+    config.update(df=model, chunksize=700, workers=2)
+    return config
+
+# Sub-blocked model on a grid of 20x20x10 parent cells, some of them split into eight 10x10x5 sub-blocks, with the
+# block sizes in SX, SY and SZ and a partial block percentage in pct
+def sub_blocked_config(engine, tmp_path):
+    rng = np.random.default_rng(5)
+    i, j, k = (index.ravel() for index in np.meshgrid(np.arange(6), np.arange(5), np.arange(4), indexing='ij'))
+    split = rng.random(len(i)) < 0.4
+    whole = pd.DataFrame({'X': i[~split] * 20 + 10.0, 'Y': j[~split] * 20 + 10.0, 'Z': k[~split] * 10 + 5.0,
+                          'SX': 20.0, 'SY': 20.0, 'SZ': 10.0})
+    a, b, c = (offset.ravel() for offset in np.meshgrid([0, 1], [0, 1], [0, 1], indexing='ij'))
+    pieces = pd.DataFrame({'X': (i[split, None] * 20 + a * 10 + 5.0).ravel(),
+                           'Y': (j[split, None] * 20 + b * 10 + 5.0).ravel(),
+                           'Z': (k[split, None] * 10 + c * 5 + 2.5).ravel(), 'SX': 10.0, 'SY': 10.0, 'SZ': 5.0})
+    model = pd.concat([whole, pieces], ignore_index=True)
+    model['ton'] = model.SX * model.SY * model.SZ * rng.uniform(2.5, 3.0, len(model))
+    model['au'] = rng.lognormal(0.0, 1.0, len(model))
+    model.loc[::9, 'au'] = np.nan
+    model['pct'] = rng.uniform(20, 100, len(model))
+    model['rock'] = rng.choice(['A', 'B', 'C'], len(model))
+    input_file = str(tmp_path / 'model.parquet')
+    model.to_parquet(input_file)
+    return {'df': model, 'input': input_file, 'engine': engine, 'X': 'X', 'Y': 'Y', 'Z': 'Z',
+            'dx': 20.0, 'dy': 20.0, 'dz': 10.0, 'rdx': 20.0, 'rdy': 20.0, 'rdz': 10.0,
+            'sum': ['ton'], 'mean': [], 'p_mean': ['au'], 'pounder': 'ton', 'size_columns': ['SX', 'SY', 'SZ'],
+            'min': ['au'], 'max': ['au'], 'count': ['au'], 'mode': ['rock'], 'mode_weight': 'ton',
+            'chunksize': 100, 'workers': 2, 'slab': 1}
+
+def reblock(config):
+    if config['engine'] == 'chunked':
+        config = dict(config, df=None)
+    return ENGINES[config['engine']](config)
+
+def sized(config, size):
+    return dict(config, rdx=size[0], rdy=size[1], rdz=size[2])
+
+def expected_model(config):
+    return reblock_groupby(dict(config)).set_index(['X', 'Y', 'Z'])
+
+# Parent block centroids of the blocks of a model, to group it by with pandas
+def parent_keys(model, config):
+    return [((model[axis] - config[size] / 2) // config[parent_size] * config[parent_size]
+             + config[parent_size] / 2).rename(axis) for axis, size, parent_size in AXES]
+
+def assert_same_model(model, expected):
+    model = model.set_index(['X', 'Y', 'Z'])[expected.columns]
+    pd.testing.assert_frame_equal(model, expected, rtol=1e-9, check_dtype=False)
+
+def test_sparse_grid_matches_groupby(tmp_path):
+    config = reblocking_config('grid', tmp_path)
+    assert dense_grid(config['df'], config) is None
+    assert_same_model(ENGINES['grid'](config), expected_model(config))
+
+@pytest.mark.parametrize('size', PARENT_SIZES)
+def test_grid_on_keys_matches_groupby(size, tmp_path):
+    config = sized(reblocking_config('grid', tmp_path, sparsity=0.0), size)
+    assert_same_model(ENGINES['grid'](dict(config, dense=False)), expected_model(config))
+
+@pytest.mark.parametrize('input_name', ['model.csv', 'model.parquet', 'model.feather'])
+@pytest.mark.parametrize('chunksize', [700, 100_000])
+def test_chunked_matches_groupby(input_name, chunksize, tmp_path):
+    config = reblocking_config('chunked', tmp_path)
+    expected = expected_model(config)
+    input_file = str(tmp_path / input_name)
+    write_model(config['df'], input_file)
+    reblocked = ENGINES['chunked'](dict(config, df=None, input=input_file, chunksize=chunksize))
+    assert_same_model(reblocked, expected)
+
+@pytest.mark.parametrize('workers, slab', [(1, None), (2, None), (2, 1)])
+def test_parallel_matches_groupby(workers, slab, tmp_path):
+    config = reblocking_config('parallel', tmp_path)
+    config['df'].loc[::50, 'Z'] = np.nan
+    reblocked = ENGINES['parallel'](dict(config, workers=workers, slab=slab))
+    assert_same_model(reblocked, expected_model(config))
+
+@pytest.mark.parametrize('engine', ['grid', 'chunked', 'parallel'])
+def test_sweep_matches_groupby(engine, tmp_path):
+    config = reblocking_config(engine, tmp_path)
+    sizes = PARENT_SIZES + [(30.0, 20.0, 10.0)]
+    expected = [expected_model(sized(config, size)) for size in sizes]
+    if engine == 'chunked':
+        config['df'] = None
+    models = reblock_sweep(dict(config, sizes=sizes))
+    assert len(models) == len(sizes)
+    for model, expected_sized in zip(models, expected):
+        assert_same_model(model, expected_sized)
+
+@pytest.mark.parametrize('engine', ['grid', 'parallel'])
+def test_engine_does_not_change_the_model(engine, tmp_path):
+    config = reblocking_config(engine, tmp_path, sparsity=0.0)
+    model = config['df'].copy()
+    ENGINES[engine](config)
+    pd.testing.assert_frame_equal(config['df'], model)
+
+# A model filling 70% of its grid, above DENSE_FILL, which the grid engine lays out on dense arrays with the missing
+# blocks filled in
+def test_dense_grid_with_missing_blocks_matches_groupby(tmp_path):
+    config = reblocking_config('grid', tmp_path, sparsity=0.3)
+    grid = dense_grid(config['df'], config)
+    assert grid is not None and grid.flat is not None
+    assert_same_model(ENGINES['grid'](config), expected_model(config))
+
+# A full grid in C order (Z fastest) or Fortran order (X fastest), whose columns are reshaped without copies
+@pytest.mark.parametrize('order', ['C', 'F'])
+@pytest.mark.parametrize('size', PARENT_SIZES)
+def test_full_ordered_grid_matches_groupby(order, size, tmp_path):
+    config = sized(reblocking_config('grid', tmp_path, blocks=FULL_BLOCKS, sparsity=0.0, shape=FULL_SHAPE), size)
+    if order == 'F':
+        config['df'] = config['df'].sort_values(['Z', 'Y', 'X'], ignore_index=True)
+    grid = dense_grid(config['df'], config)
+    assert grid.order == order and grid.flat is None
+    extended = dict(config, min=['a0'], max=['a0'], count=['a1'])
+    reblocked = ENGINES['grid'](extended)
+    assert_same_model(reblocked, expected_model(config))
+    model = config['df']
+    grades = model.groupby(parent_keys(model, config))
+    expected = pd.DataFrame({'a0_min': grades['a0'].min(), 'a0_max': grades['a0'].max(),
+                             'a1_count': grades['a1'].count()})
+    assert_same_model(reblocked, expected)
+
+# Parent sizes splitting the 20x20x10 blocks in eight, keeping them whole and putting eight of them in one parent block
+SPLIT_SIZES = [(10.0, 10.0, 5.0), (20.0, 20.0, 10.0), (40.0, 40.0, 20.0)]
+
+@pytest.mark.parametrize('percent', [None, 'pct'])
+@pytest.mark.parametrize('engine', ['grid', 'chunked', 'parallel'])
+def test_split_blocks_keep_the_tonnage(engine, percent, tmp_path):
+    config = dict(sub_blocked_config(engine, tmp_path), percent=percent)
+    model = config['df']
+    grid = ENGINES['grid'](dict(config, engine='grid'))
+    for size in SPLIT_SIZES:
+        reblocked = reblock(sized(config, size))
+        assert reblocked['ton'].sum() == pytest.approx(model['ton'].sum(), rel=1e-12)
+        assert np.nansum(reblocked['au'] * reblocked['ton']) == pytest.approx((model['au'] * model['ton']).sum(),
+                                                                                rel=1e-12)
+    pd.testing.assert_frame_equal(reblock(config), grid, rtol=1e-9)
+
+def test_split_blocks_count_the_blocks_in_each_parent(tmp_path):
+    config = sized(sub_blocked_config('grid', tmp_path), SPLIT_SIZES[2])
+    model = config['df']
+    # the blocks are whole in the 40x40x20 parent blocks, which their corners give
+    keys = [((model[axis] - model[f'S{axis}'] / 2) // config[parent_size] * config[parent_size]
+             + config[parent_size] / 2).rename(axis) for axis, _, parent_size in AXES]
+    expected = model.groupby(keys)['au'].count().rename('au_count').to_frame()
+    assert_same_model(ENGINES['grid'](config), expected)
+
+@pytest.mark.parametrize('engine', ['grid', 'chunked', 'parallel'])
+def test_sweep_of_split_blocks_matches_each_size(engine, tmp_path):
+    config = sub_blocked_config(engine, tmp_path)
+    models = reblock_sweep(dict(config, df=None if engine == 'chunked' else config['df'], sizes=SPLIT_SIZES))
+    for model, size in zip(models, SPLIT_SIZES):
+        pd.testing.assert_frame_equal(model, reblock(sized(config, size)), rtol=1e-9)
+
+QUANTILES = [0, 10, 50, 90, 100]
+
+def expected_percentiles(config, column='a1'):
+    model = config['df']
+    grades = model.groupby(parent_keys(model, config))[column]
+    return pd.DataFrame({f'{column}_p{q}': grades.quantile(q / 100) for q in QUANTILES})
+
+# Sparse models on keys, a model with missing blocks and full ones in C and Fortran order on dense arrays
+PERCENTILE_MODELS = [
+    dict(sparsity=SPARSE),
+    dict(sparsity=0.3),
+    dict(blocks=FULL_BLOCKS, sparsity=0.0, shape=FULL_SHAPE),
+]
+
+@pytest.mark.parametrize('model', PERCENTILE_MODELS)
+@pytest.mark.parametrize('engine', ['grid', 'parallel'])
+def test_percentiles_are_exact(engine, model, tmp_path):
+    config = dict(reblocking_config(engine, tmp_path, **model), percentiles={'a1': QUANTILES})
+    expected = expected_percentiles(config)
+    # taken in the aggregation pass, not in a second pass over the model
+    assert 'pct:a1:50' in PARTIALS[engine](dict(config))
+    assert_same_model(ENGINES[engine](config), expected)
+    config['df'] = config['df'].sort_values(['Z', 'Y', 'X'], ignore_index=True)
+    assert_same_model(ENGINES[engine](config), expected)
+
+@pytest.mark.parametrize('engine', ['grid', 'parallel'])
+def test_sweep_percentiles_are_exact(engine, tmp_path):
+    config = dict(reblocking_config(engine, tmp_path), percentiles={'a1': QUANTILES})
+    models = reblock_sweep(dict(config, sizes=PARENT_SIZES))
+    for model, size in zip(models, PARENT_SIZES):
+        assert_same_model(model, expected_percentiles(sized(config, size)))
+
+# The chunked engine bins the values: each percentile is within a bin of the two values the exact one is
+# interpolated between
+def test_chunked_percentiles_are_within_a_bin(tmp_path):
+    config = dict(reblocking_config('chunked', tmp_path), percentiles={'a1': QUANTILES}, percentile_bins=1000)
+    model = config['df']
+    grades = model.groupby(parent_keys(model, config))['a1']
+    columns = [f'a1_p{q}' for q in QUANTILES]
+    lower = pd.DataFrame({column: grades.quantile(q / 100, interpolation='lower')
+                          for column, q in zip(columns, QUANTILES)})
+    higher = pd.DataFrame({column: grades.quantile(q / 100, interpolation='higher')
+                           for column, q in zip(columns, QUANTILES)})
+    reblocked = ENGINES['chunked'](dict(config, df=None)).set_index(['X', 'Y', 'Z'])[columns]
+    bin_width = (model['a1'].max() - model['a1'].min()) / 1000 * 1.000001
+    assert ((reblocked >= lower - bin_width) & (reblocked <= higher + bin_width) | lower.isna()).all().all()
+
+# Pieces of split blocks weigh by volume: each percentile is the first value reaching q% of the volume
+@pytest.mark.parametrize('engine', ['grid', 'parallel'])
+def test_percentiles_of_split_blocks_weigh_by_volume(engine, tmp_path):
+    config = sized(dict(sub_blocked_config(engine, tmp_path), percentiles={'au': QUANTILES}), SPLIT_SIZES[2])
+    model = config['df'].dropna(subset=['au'])
+    keys = [((model[axis] - model[f'S{axis}'] / 2) // config[parent_size] * config[parent_size]
+             + config[parent_size] / 2).rename(axis) for axis, _, parent_size in AXES]
+
+    def weighted(blocks, q):
+        blocks = blocks.sort_values('au')
+        volumes = (blocks.SX * blocks.SY * blocks.SZ).cumsum()
+        return blocks['au'].to_numpy()[np.searchsorted(volumes.to_numpy(), volumes.iloc[-1] * q / 100)]
+
+    grouped = model.groupby(keys)
+    expected = pd.DataFrame({f'au_p{q}': grouped.apply(weighted, q) for q in QUANTILES})
+    assert_same_model(ENGINES[engine](config), expected)
+    # blocks split between parent blocks, and between the slabs of the parallel engine
+    fine = sized(config, SPLIT_SIZES[0])
+    pd.testing.assert_frame_equal(ENGINES[engine](fine), ENGINES['grid'](dict(fine, engine='grid')))
+
+@pytest.mark.parametrize('engine', ['grid', 'chunked', 'parallel'])
+def test_mode_weighted_by_tonnage(engine, tmp_path):
+    config = reblocking_config(engine, tmp_path, sparsity=0.3)
+    model = config['df']
+    model['rock'] = np.random.default_rng(2).choice(['001', '002', '010'], len(model))
+    model.to_parquet(config['input'])
+    tonnage = model.groupby(parent_keys(model, config) + [model['rock']])['ton'].sum()
+    expected = tonnage.groupby(level=[0, 1, 2]).idxmax().map(lambda key: key[-1]).rename('rock').to_frame()
+    config.update(mode=['rock'], mode_weight='ton')
+    assert_same_model(reblock(config), expected)